@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from alerts.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = "Send queued emails from the outbox over a reused connection to settings.EMAIL_DELIVERY_BACKEND."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Emails sent per connection.")
+        parser.add_argument("--loop", action="store_true", help="Keep running, polling for new mail when the outbox is empty.")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to wait between polls with --loop.")
+
+    def handle(self, *args, batch_size, loop, interval, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = deliver_batch(batch_size=batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed == batch_size:
+                # A full batch: there may be more due right away
+                continue
+            if not loop:
+                break
+            time.sleep(interval)
+
+        self.stdout.write(f"Sent {total_sent} email(s), {total_failed} failed attempt(s).")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from alerts.retention import apply_rule, configured_rules
+
+
+class Command(BaseCommand):
+    help = "Delete or archive old notifications according to settings.NOTIFICATION_RETENTION."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows per transaction.")
+        parser.add_argument("--sleep", type=float, default=0, help="Seconds to pause between batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be reclaimed without changing anything.")
+
+    def handle(self, *args, batch_size, sleep, dry_run, **options):
+        total_rows = total_bytes = 0
+        for rule in configured_rules():
+            rows, size = apply_rule(rule, batch_size=batch_size, dry_run=dry_run, pause=sleep)
+            total_rows += rows
+            total_bytes += size
+            self.stdout.write(f"{rule}: {rows} row(s), ~{size} bytes")
+
+        verb = "Would reclaim" if dry_run else "Reclaimed"
+        self.stdout.write(f"{verb} {total_rows} row(s), ~{total_bytes} bytes of message and payload data.")
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from alerts.models import Notification
+
+
+class Command(BaseCommand):
+    help = "Recount unread notifications and correct any user counters that have drifted."
+
+    def handle(self, *args, **options):
+        # One UPDATE counting and writing in the same statement, so a
+        # notification created or read meanwhile can't be overwritten
+        actual = Coalesce(Subquery(Notification.objects.unread_count_for(OuterRef("pk"))), 0)
+        fixed = get_user_model().objects.exclude(unread_notifications=actual).update(unread_notifications=actual)
+
+        self.stdout.write(f"Corrected {fixed} unread counter(s).")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0005_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivednotification',
+            name='original_id',
+            field=models.PositiveBigIntegerField(unique=True),
+        ),
+    ]
@@ -1,7 +1,78 @@
-from django.db import models
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.functions import Greatest
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from .realtime import publish_unread_counts
+
+def adjust_unread_counts(deltas):
+    # deltas: {user_id: change}, applied to every user in one UPDATE
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    change = Case(*[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()], default=Value(0))
+    get_user_model().objects.filter(pk__in=deltas).update(
+        unread_notifications=Greatest(F("unread_notifications") + change, Value(0))
+    )
+    transaction.on_commit(partial(publish_unread_counts, list(deltas)))
+
+
+class NotificationQuerySet(models.QuerySet):
+    def unread(self):
+        return self.filter(is_read=False)
+
+    def unread_count_for(self, recipient):
+        # Subquery counting `recipient`'s unread rows, e.g. with OuterRef("pk")
+        return (
+            self.unread().filter(recipient=recipient)
+            .order_by().values("recipient").annotate(count=Count("id")).values("count")
+        )
+
+    def unread_by_recipient(self):
+        return dict(
+            self.unread().order_by().values_list("recipient_id").annotate(count=Count("id"))
+        )
+
+    # Passing `recipient` scopes the operation to one user's inbox, so the
+    # affected row counts are the counter change and no GROUP BY is needed
+
+    def mark_read(self, recipient=None):
+        with transaction.atomic(using=self.db):
+            if recipient is not None:
+                updated = self.filter(recipient=recipient).unread().update(is_read=True)
+                adjust_unread_counts({recipient.pk: -updated})
+                return updated
+            counts = self.unread_by_recipient()
+            if not counts:
+                return 0
+            updated = self.unread().update(is_read=True)
+            adjust_unread_counts({pk: -count for pk, count in counts.items()})
+        return updated
+
+    def delete(self, recipient=None):
+        with transaction.atomic(using=self.db):
+            if recipient is not None:
+                rows = self.filter(recipient=recipient)
+                unread, _ = super(NotificationQuerySet, rows.unread()).delete()
+                read, _ = super(NotificationQuerySet, rows).delete()
+                adjust_unread_counts({recipient.pk: -unread})
+                return unread + read, {self.model._meta.label: unread + read}
+            counts = self.unread_by_recipient()
+            deleted = super().delete()
+            adjust_unread_counts({pk: -count for pk, count in counts.items()})
+        return deleted
+
+
+# The predicate of notification_unread_dedupe_uniq as the database renders it.
+# The upsert in alerts.services repeats it after ON CONFLICT to pick that index
+UNREAD_DEDUPE_CONDITION = 'NOT "is_read" AND NOT ("dedupe_key" = \'\')'
+
 
 # Create your models here.
 class Notification(models.Model):
@@ -34,6 +105,93 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     dedupe_key = models.CharField(max_length=120, blank=True, db_index=True)
+    # How many notifications have been coalesced into this row through dedupe_key
+    occurrences = models.PositiveIntegerField(default=1)
+
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            # Inbox pages: a recipient's notifications newest first, keyset on (created_at, id)
+            models.Index(fields=["recipient", "-created_at", "-id"], name="notification_inbox_idx"),
+            # Unread lookups: mark-read, counter reconciliation
+            models.Index(fields=["recipient", "is_read", "created_at"], name="notification_unread_idx"),
+        ]
+        constraints = [
+            # At most one unread row per recipient and dedupe key, the target of the coalescing upsert.
+            # Keep UNREAD_DEDUPE_CONDITION in step with the condition
+            models.UniqueConstraint(
+                fields=["recipient", "dedupe_key"],
+                condition=models.Q(is_read=False) & ~models.Q(dedupe_key=""),
+                name="notification_unread_dedupe_uniq",
+            ),
+        ]
+
+    def mark_read(self):
+        if not self.is_read:
+            Notification.objects.filter(pk=self.pk).mark_read()
+            self.is_read = True
+
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic(using=using):
+            deleted = super().delete(using=using, keep_parents=keep_parents)
+            if not self.is_read:
+                adjust_unread_counts({self.recipient_id: -1})
+        return deleted
+
+class ArchivedNotification(models.Model):
+    # Notifications moved out of the live table by the retention rules
+    original_id = models.PositiveBigIntegerField(unique=True)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_notifications")
+    type = models.CharField(max_length=50, choices=Notification.Type.choices)
+    level = models.CharField(max_length=10, choices=Notification.Level.choices)
+    target_ct = models.ForeignKey(ContentType, on_delete=models.SET_NULL, null=True, blank=True)
+    target_id = models.PositiveIntegerField(null=True, blank=True)
+    message = models.TextField(blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ["-created_at"]
\ No newline at end of file
+        ordering = ["-created_at"]
+
+
+class OutboxEmail(models.Model):
+    # Outgoing mail written by alerts.outbox.OutboxBackend in the sender's
+    # transaction and delivered later by `manage.py deliver_outbox`
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        SENT = "sent"
+        FAILED = "failed"
+
+    subject = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.JSONField(default=list, blank=True)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    # [[content, mimetype], ...], e.g. the HTML part of the password reset email
+    alternatives = models.JSONField(default=list, blank=True)
+    # [[filename, base64 content, mimetype], ...]
+    attachments = models.JSONField(default=list, blank=True)
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["next_attempt_at", "id"]
+        indexes = [
+            # Delivery batches: pending rows whose retry time has come, oldest first
+            models.Index(fields=["status", "next_attempt_at", "id"], name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
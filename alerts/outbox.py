@@ -0,0 +1,160 @@
+import base64
+import logging
+from datetime import timedelta
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from tasks.queue import enqueue
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+# Email is queued, not sent, while a request is being served. OutboxBackend is
+# the EMAIL_BACKEND: send_mail(), PasswordResetView and friends write rows to
+# OutboxEmail in the current transaction (so a rolled-back request sends
+# nothing) and queue an alerts.deliver_outbox task. deliver_batch() drains the
+# table over one connection to settings.EMAIL_DELIVERY_BACKEND, retrying
+# failures with exponential backoff.
+
+DELIVERY_FIELDS = ["status", "attempts", "next_attempt_at", "last_error", "sent_at"]
+
+
+class OutboxBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        rows = [to_outbox(message) for message in email_messages if message.recipients()]
+        if rows:
+            OutboxEmail.objects.bulk_create(rows)
+            enqueue("alerts.deliver_outbox")
+        return len(rows)
+
+
+def to_outbox(message):
+    attachments = []
+    for attachment in message.attachments:
+        if isinstance(attachment, MIMEBase):
+            raise ValueError("MIME attachments cannot be queued in the outbox")
+        filename, content, mimetype = attachment
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, base64.b64encode(content).decode(), mimetype])
+
+    return OutboxEmail(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email or "",
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=dict(message.extra_headers),
+        alternatives=[list(alternative) for alternative in getattr(message, "alternatives", [])],
+        attachments=attachments,
+    )
+
+
+def to_message(email, connection=None):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or None,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+        connection=connection,
+    )
+    for content, mimetype in email.alternatives:
+        message.attach_alternative(content, mimetype)
+    for filename, content, mimetype in email.attachments:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+def retry_delay(attempts):
+    # 1, 2, 4, 8... times the base delay after each failed attempt
+    return timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _failed(email, error, now):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.Status.FAILED
+        logger.error("Giving up on outbox email %s after %s attempts: %s", email.pk, email.attempts, email.last_error)
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+
+
+def _claim(batch_size, now):
+    # Lock due rows with SKIP LOCKED and lease them by moving their next attempt
+    # out, so no other worker picks them up while they are sent outside any
+    # transaction. A worker that dies mid-batch leaves them due again once the
+    # lease runs out
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects
+            .filter(status=OutboxEmail.Status.PENDING, next_attempt_at__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if batch:
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+            )
+    return batch
+
+
+def deliver_batch(batch_size=50, now=None):
+    """
+    Send up to batch_size due emails over a single connection and return
+    (sent, failed). Rows are claimed and their results recorded in two short
+    transactions, with no locks held while talking to the mail server, so
+    several workers can drain the outbox at once without sending anything twice.
+    """
+    now = now or timezone.now()
+    batch = _claim(batch_size, now)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(settings.EMAIL_DELIVERY_BACKEND)
+    try:
+        connection.open()
+    except Exception as error:
+        # Mail server unreachable: the whole batch waits for its next attempt
+        for email in batch:
+            _failed(email, error, now)
+        failed = len(batch)
+    else:
+        index = 0
+        try:
+            for index, email in enumerate(batch):
+                try:
+                    connection.send_messages([to_message(email, connection)])
+                except Exception as error:
+                    _failed(email, error, now)
+                    failed += 1
+                    # The server may have dropped us; later messages get a fresh connection
+                    connection.close()
+                    connection.open()
+                else:
+                    email.status = OutboxEmail.Status.SENT
+                    email.attempts += 1
+                    email.sent_at = now
+                    sent += 1
+        except Exception as error:
+            # Reconnecting failed: whatever is left is retried later
+            for email in batch[index + 1:]:
+                _failed(email, error, now)
+                failed += 1
+        finally:
+            connection.close()
+
+    OutboxEmail.objects.bulk_update(batch, DELIVERY_FIELDS)
+    return sent, failed
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from functools import cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+# Live notification delivery. The creation path publishes events for a user
+# to the hub, and every open server-sent-events stream for that user (see
+# alerts.views.notification_stream) receives them. With the local backend
+# publishing is a no-op for users with no open stream in the process; the
+# PostgreSQL backend can't see other processes' streams, so it always sends.
+
+logger = logging.getLogger(__name__)
+
+# Events a slow browser may fall behind by before the oldest are dropped
+QUEUE_SIZE = 50
+# NOTIFY payloads must stay under 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+
+class LocalBackend:
+    """
+    In-process fan-out: streams and publishers must share a process. With
+    several workers each one only reaches its own streams, so a shared backend
+    (anything with the same subscribe/unsubscribe/subscribed/publish methods,
+    e.g. over Redis or PostgreSQL LISTEN/NOTIFY) can be swapped in through
+    settings.NOTIFICATION_HUB_BACKEND.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = defaultdict(set)
+
+    def subscribe(self, user_id):
+        # Called from the stream's event loop; publish() may come from any thread
+        stream = (asyncio.get_running_loop(), asyncio.Queue(maxsize=QUEUE_SIZE))
+        with self._lock:
+            self._streams[user_id].add(stream)
+        return stream[1]
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            streams = self._streams.get(user_id, set())
+            streams.difference_update({s for s in streams if s[1] is queue})
+            if not streams:
+                self._streams.pop(user_id, None)
+
+    def subscribed(self, user_ids):
+        with self._lock:
+            return {pk for pk in user_ids if pk in self._streams}
+
+    def publish(self, user_id, event):
+        with self._lock:
+            streams = list(self._streams.get(user_id, ()))
+        for loop, queue in streams:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The stream's event loop has gone away without unsubscribing
+                self.unsubscribe(user_id, queue)
+
+
+def _offer(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+class PostgresBackend(LocalBackend):
+    """
+    Fan-out across processes through PostgreSQL LISTEN/NOTIFY, so notifications
+    created by the task worker reach streams held by the web process. publish()
+    NOTIFYs on the default database (delivered when the publishing transaction
+    commits); each process holding streams runs one listener thread that hands
+    what it hears to its own streams, as LocalBackend would.
+    """
+
+    CHANNEL = "alerts_notifications"
+    RECONNECT_SECONDS = 5
+    # How often an idle listener checks its connection is still alive
+    POLL_SECONDS = 30
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+        self._stopped = threading.Event()
+        # Set once the listener is LISTENing
+        self.listening = threading.Event()
+
+    def stop(self):
+        # Ends the listener within POLL_SECONDS and closes its connection
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.join()
+
+    def subscribe(self, user_id):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="notification-listener", daemon=True)
+                self._listener.start()
+        return super().subscribe(user_id)
+
+    def subscribed(self, user_ids):
+        # Streams held by other processes are out of sight, so anyone may be listening
+        return set(user_ids)
+
+    def publish(self, user_id, event):
+        payload = json.dumps([user_id, event])
+        if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+            logger.warning("Dropping a %s byte live event for user %s", len(payload.encode()), user_id)
+            return
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.CHANNEL, payload])
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen_once()
+            except Exception:
+                self.listening.clear()
+                logger.exception("Notification listener lost its connection, reconnecting")
+                self._stopped.wait(self.RECONNECT_SECONDS)
+
+    def _listen_once(self):
+        # A connection of its own, outside Django's per-thread handling, kept in autocommit
+        db = connections[DEFAULT_DB_ALIAS]
+        listener = db.get_new_connection(db.get_connection_params())
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.CHANNEL}")
+            self.listening.set()
+            while not self._stopped.is_set():
+                select.select([listener], [], [], self.POLL_SECONDS)
+                listener.poll()
+                while listener.notifies:
+                    user_id, event = json.loads(listener.notifies.pop(0).payload)
+                    LocalBackend.publish(self, user_id, event)
+        finally:
+            listener.close()
+
+
+def get_hub():
+    return _hub(settings.NOTIFICATION_HUB_BACKEND)
+
+
+@cache
+def _hub(path):
+    return import_string(path)()
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def publish_notifications(notifications):
+    hub = get_hub()
+    listening = hub.subscribed({n.recipient_id for n in notifications})
+    for notification in notifications:
+        if notification.recipient_id in listening:
+            hub.publish(notification.recipient_id, format_event("notification", {
+                "id": notification.pk,
+                "type": notification.type,
+                "level": notification.level,
+                "message": notification.message,
+                "url": reverse("notification_detail", args=[notification.pk]),
+            }))
+
+
+def publish_unread_counts(user_ids):
+    hub = get_hub()
+    listening = hub.subscribed(user_ids)
+    if not listening:
+        return
+    counts = get_user_model().objects.filter(pk__in=listening).values_list("pk", "unread_notifications")
+    for pk, count in counts:
+        hub.publish(pk, format_event("unread", {"count": count}))
@@ -1,25 +1,212 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+from asgiref.local import Local
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from .models import Notification
+from .models import UNREAD_DEDUPE_CONDITION, Notification, adjust_unread_counts
+from .realtime import publish_notifications
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
 
 def fmt(dt):
     return timezone.localtime(dt).strftime("%H:%M %d/%m/%y")
 
-def create_notification(*, recipient, type, level=Notification.Level.INFO, target=None, message="", payload=None, dedupe_key=""):
-    payload = payload or {}
-    def _make():
-        Notification.objects.create(
-            recipient=recipient,
-            type=type,
-            level=level,
-            target=target,
-            message=message,
-            payload=payload,
-            dedupe_key=dedupe_key,
+# Notifications are buffered per transaction and written with one bulk_create
+# when it commits. Inside an atomic block every notification joins a single
+# _Flush callback registered for the current savepoint, so a rolled back
+# savepoint drops its notifications along with its other on_commit work.
+# notification_batch() extends the same batching to autocommit code such as
+# management commands, which would otherwise insert as they go.
+
+_batches = Local()
+
+
+class _Flush:
+    def __init__(self, savepoint_ids):
+        self.savepoint_ids = savepoint_ids
+        self.items = []
+        self.closed = False
+
+    def __call__(self):
+        self.closed = True
+        items, self.items = self.items, []
+        _write(items)
+
+
+def _write(items):
+    batch = getattr(_batches, "items", None)
+    if batch is not None:
+        batch.extend(items)
+        return
+    if not items:
+        return
+
+    now = timezone.now()
+    # One ContentType lookup per target model rather than one per notification
+    target_types = ContentType.objects.get_for_models(
+        *{type(item["target"]) for item in items if item.get("target") is not None}
+    )
+    notifications = [
+        Notification(
+            recipient_id=item["recipient_id"] if "recipient_id" in item else item["recipient"].pk,
+            type=item["type"],
+            level=item.get("level", Notification.Level.INFO),
+            target_ct=target_types[type(item["target"])] if item.get("target") is not None else None,
+            target_id=item["target"].pk if item.get("target") is not None else None,
+            message=item.get("message", ""),
+            payload=item.get("payload") or {},
+            dedupe_key=_windowed_key(item.get("dedupe_key", ""), now, item.get("dedupe_window")),
+        )
+        for item in items
+    ]
+    fresh = [n for n in notifications if not n.dedupe_key]
+    keyed = [n for n in notifications if n.dedupe_key]
+    with transaction.atomic():
+        Notification.objects.bulk_create(fresh)
+        inserted = Counter(n.recipient_id for n in fresh)
+        inserted.update(_upsert(keyed))
+        adjust_unread_counts(inserted)
+        # Keyed notifications merged into another in the same batch were never written
+        transaction.on_commit(partial(publish_notifications, fresh + [n for n in keyed if n.pk]))
+
+
+# Coalescing: notifications that share a recipient and dedupe_key within
+# NOTIFICATION_DEDUPE_WINDOW seconds collapse into the one unread row, which is
+# refreshed with the latest message and has its occurrences counted up. The
+# window is folded into the stored key so the partial unique index
+# notification_unread_dedupe_uniq can serve as the upsert's conflict target.
+
+UPSERT_FIELDS = [
+    "recipient", "type", "level", "target_ct", "target_id", "message",
+    "payload", "is_read", "created_at", "dedupe_key", "occurrences",
+]
+REFRESHED_FIELDS = ["type", "level", "target_ct", "target_id", "message", "payload", "created_at"]
+UPSERT_BATCH_SIZE = 500
+
+
+def _windowed_key(key, now, window=None):
+    if not key:
+        return ""
+    window = window or settings.NOTIFICATION_DEDUPE_WINDOW
+    return f"{key}@{int(now.timestamp()) // window}"
+
+
+def window_start(now, window):
+    # Start of the dedupe window containing `now`, matching _windowed_key's buckets
+    return datetime.fromtimestamp(int(now.timestamp()) // window * window, tz=dt_timezone.utc)
+
+
+def _conflict_target(connection):
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(Notification._meta.get_field(f).column) for f in ["recipient", "dedupe_key"])
+    return f"({columns}) WHERE {UNREAD_DEDUPE_CONDITION}"
+
+
+def _upsert(notifications):
+    """
+    INSERT ... ON CONFLICT DO UPDATE the keyed notifications and return a
+    Counter of newly inserted (i.e. newly unread) rows per recipient.
+    """
+    # A statement may only touch each row once, so coalesce within the batch first
+    merged = {}
+    for notification in notifications:
+        key = (notification.recipient_id, notification.dedupe_key)
+        if key in merged:
+            notification.occurrences += merged[key].occurrences
+        merged[key] = notification
+    notifications = list(merged.values())
+
+    connection = transaction.get_connection()
+    qn = connection.ops.quote_name
+    table = qn(Notification._meta.db_table)
+    fields = [Notification._meta.get_field(name) for name in UPSERT_FIELDS]
+    refreshed = [Notification._meta.get_field(name).column for name in REFRESHED_FIELDS]
+    assignments = ", ".join(f"{qn(c)} = EXCLUDED.{qn(c)}" for c in refreshed)
+    occurrences = qn("occurrences")
+
+    inserted = Counter()
+    for start in range(0, len(notifications), UPSERT_BATCH_SIZE):
+        batch = notifications[start:start + UPSERT_BATCH_SIZE]
+        placeholders = ", ".join(f"({', '.join(['%s'] * len(fields))})" for _ in batch)
+        params = [
+            field.get_db_prep_save(field.pre_save(notification, add=True), connection)
+            for notification in batch
+            for field in fields
+        ]
+        sql = (
+            f"INSERT INTO {table} ({', '.join(qn(f.column) for f in fields)}) VALUES {placeholders} "
+            f"ON CONFLICT {_conflict_target(connection)} DO UPDATE SET {assignments}, "
+            f"{occurrences} = {table}.{occurrences} + EXCLUDED.{occurrences} "
+            f"RETURNING {qn('id')}, {qn('recipient_id')}, {qn('dedupe_key')}, {occurrences}"
         )
-    transaction.on_commit(_make)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for pk, recipient_id, dedupe_key, count in cursor.fetchall():
+                notification = merged[(recipient_id, dedupe_key)]
+                # A row that already existed comes back with more occurrences than were sent
+                if count == notification.occurrences:
+                    inserted[recipient_id] += 1
+                notification.pk = pk
+    return inserted
+
+
+def _transaction_buffer(connection):
+    savepoint_ids = set(connection.savepoint_ids)
+    callback = _Flush(savepoint_ids)
+    for _, pending, _ in reversed(connection.run_on_commit):
+        if isinstance(pending, _Flush) and pending.savepoint_ids == savepoint_ids and not pending.closed:
+            # Take over the open flush's items and re-register at the end, so
+            # they still run after all the work that produced them
+            callback.items, pending.items = pending.items, []
+            pending.closed = True
+            break
+    transaction.on_commit(callback)
+    return callback
+
+
+def create_notifications(items):
+    items = list(items)
+    if not items:
+        return
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        _transaction_buffer(connection).items.extend(items)
+    else:
+        _write(items)
+
+
+def create_notification(*, recipient, type, level=Notification.Level.INFO, target=None, message="", payload=None, dedupe_key=""):
+    create_notifications([dict(
+        recipient=recipient,
+        type=type,
+        level=level,
+        target=target,
+        message=message,
+        payload=payload,
+        dedupe_key=dedupe_key,
+    )])
+
+
+@contextmanager
+def notification_batch():
+    """
+    Collect every notification created in the block, including those from
+    transactions committed inside it, and write them with one bulk_create on exit.
+    """
+    if getattr(_batches, "items", None) is not None:
+        # Nested batches share the outermost one
+        yield
+        return
+    _batches.items = []
+    try:
+        yield
+    finally:
+        items, _batches.items = _batches.items, None
+        create_notifications(items)
 
 def for_booking_created(booking):
     if not booking.created_by_id:
@@ -37,11 +224,29 @@ def for_booking_created(booking):
         payload={"status": booking.status},
     )
 
-def for_status_changed(booking, old, new):
-    if not booking.created_by_id:
+def for_series_created(series, bookings):
+    if not series.created_by_id or not bookings:
         return
+    statuses = {}
+    for booking in bookings:
+        statuses[booking.status] = statuses.get(booking.status, 0) + 1
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(statuses.items()))
     create_notification(
-        recipient=booking.created_by,
+        recipient=series.created_by,
+        type=Notification.Type.BOOKING_CREATED,
+        level=Notification.Level.WARNING if "conflicting" in statuses else Notification.Level.SUCCESS,
+        target=None,
+        message=(
+            f"{series.get_frequency_display()} booking for {series.pitch.name} from "
+            f"{fmt(bookings[0].start_time)} until {series.until:%d/%m/%y} was created: "
+            f"{len(bookings)} bookings ({summary})."
+        ),
+        payload={"series_id": series.id, "booking_ids": [b.id for b in bookings], "statuses": statuses},
+    )
+
+def _status_changed(booking, old, new):
+    return dict(
+        recipient_id=booking.created_by_id,
         type=Notification.Type.STATUS_CHANGED,
         level=Notification.Level.SUCCESS if new == "approved" else Notification.Level.WARNING if new == "conflicting" else Notification.Level.ERROR if new == "rejected" else Notification.Level.INFO,
         target=booking,
@@ -50,46 +255,150 @@ def for_status_changed(booking, old, new):
             f"to {fmt(booking.end_time)} has differnet status: {old} → {new}."
         ),
         payload={"old_status": old, "new_status": new},
+        dedupe_key=f"booking:{booking.pk}:status",
     )
 
-def for_booking_updated(booking, changed_fields):
+def for_status_changed(booking, old, new):
     if not booking.created_by_id:
         return
-    create_notification(
-        recipient=booking.created_by,
+    create_notifications([_status_changed(booking, old, new)])
+
+def for_status_changed_many(changes):
+    # changes: iterable of (booking, old_status, new_status)
+    create_notifications(
+        _status_changed(booking, old, new)
+        for booking, old, new in changes
+        if booking.created_by_id
+    )
+
+def _booking_updated(booking, changed_fields):
+    return dict(
+        recipient_id=booking.created_by_id,
         type=Notification.Type.BOOKING_UPDATED,
         level=Notification.Level.INFO,
         target=booking,
         message=f"Booking for {booking.pitch.name} from {fmt(booking.start_time)} to {fmt(booking.end_time)} was updated.",
         payload={"changed_fields": changed_fields},
+        dedupe_key=f"booking:{booking.pk}:updated",
     )
 
-def for_booking_deleted(booking_snapshot):
-    User = get_user_model()
-    user_id = booking_snapshot.get("user_id")
-    if not user_id:
+def for_booking_updated(booking, changed_fields):
+    if not booking.created_by_id:
         return
+    create_notifications([_booking_updated(booking, changed_fields)])
 
-    try:
-        recipient = User.objects.get(pk=user_id)
-    except User.DoesNotExist:
-        return
-    
+def for_booking_updated_many(changes):
+    # changes: iterable of (booking, changed_fields)
+    create_notifications(
+        _booking_updated(booking, changed_fields)
+        for booking, changed_fields in changes
+        if booking.created_by_id
+    )
+
+def _booking_deleted(booking_snapshot):
+    pitch_name = booking_snapshot.get("pitch_name", "this pitch")
     start_str = fmt(booking_snapshot.get("start_time"))
     end_str = fmt(booking_snapshot.get("end_time"))
-    pitch_name = booking_snapshot.get("pitch_name", "this pitch")
-    
+
     payload = booking_snapshot.copy()
     for key in ("start_time", "end_time"):
         val = payload.get(key)
         if isinstance(val, datetime):
             payload[key] = val.isoformat()
-    
-    create_notification(
-        recipient=recipient,
+
+    return dict(
+        recipient_id=booking_snapshot["user_id"],
         type=Notification.Type.BOOKING_DELETED,
         level=Notification.Level.ERROR,
         target=None,
         message=f"Booking for {pitch_name} from {start_str} to {end_str} was deleted.",
         payload=payload,
     )
+
+def for_booking_deleted(booking_snapshot):
+    for_bookings_deleted([booking_snapshot])
+
+def for_bookings_deleted(booking_snapshots):
+    snapshots = [snap for snap in booking_snapshots if snap.get("user_id")]
+    if not settings.NOTIFY_PAST_BOOKING_DELETIONS:
+        now = timezone.now()
+        snapshots = [snap for snap in snapshots if snap["end_time"] > now]
+    if not snapshots:
+        return
+
+    # One query confirms which owners still exist
+    User = get_user_model()
+    recipients = User.objects.only("pk").in_bulk({snap["user_id"] for snap in snapshots})
+    create_notifications(
+        _booking_deleted(snap) for snap in snapshots if snap["user_id"] in recipients
+    )
+
+def _conflicts_flagged(approver_id, pitch_name, booking_ids):
+    return dict(
+        recipient_id=approver_id,
+        type=Notification.Type.CONFLICT_FLAG,
+        level=Notification.Level.WARNING,
+        target=None,
+        message=f"{len(booking_ids)} upcoming {pitch_name} booking(s) clash with approved bookings.",
+        payload={"pitch_name": pitch_name, "booking_ids": booking_ids},
+        dedupe_key=f"conflict_flag:{pitch_name}",
+    )
+
+def for_conflicts_flagged_many(alerts):
+    # alerts: iterable of (approver_id, pitch_name, booking_ids)
+    create_notifications(
+        _conflicts_flagged(approver_id, pitch_name, booking_ids)
+        for approver_id, pitch_name, booking_ids in alerts
+    )
+
+def _breakdown(counts):
+    return ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+
+def _pending_approvals(approver_id, pitches, period):
+    total = sum(sum(counts.values()) for counts in pitches.values())
+    if len(pitches) == 1:
+        [(pitch_name, counts)] = pitches.items()
+        message = f"{total} upcoming {pitch_name} booking(s) awaiting your decision ({_breakdown(counts)})."
+    else:
+        summary = "; ".join(f"{pitch_name} ({_breakdown(counts)})" for pitch_name, counts in sorted(pitches.items()))
+        message = f"{total} upcoming booking(s) awaiting your decision: {summary}."
+    return dict(
+        recipient_id=approver_id,
+        type=Notification.Type.PENDING_APPROVALS,
+        level=(
+            Notification.Level.WARNING if any(counts.get("conflicting") for counts in pitches.values())
+            else Notification.Level.INFO
+        ),
+        target=None,
+        message=message,
+        payload={"pitches": pitches},
+        dedupe_key="pending_approvals",
+        dedupe_window=period,
+    )
+
+def for_pending_approvals_many(digests, period):
+    """
+    digests: iterable of (approver_id, {pitch_name: {status: count}}), one per
+    approver. Within one period a rerun refreshes the unread digest, and
+    approvers who have already read this period's digest are not sent another.
+    """
+    digests = [
+        (approver_id, {name: counts for name, counts in pitches.items() if sum(counts.values())})
+        for approver_id, pitches in digests
+    ]
+    digests = [(approver_id, pitches) for approver_id, pitches in digests if pitches]
+    if not digests:
+        return
+    already_read = set(
+        Notification.objects.filter(
+            type=Notification.Type.PENDING_APPROVALS,
+            recipient_id__in={approver_id for approver_id, _ in digests},
+            created_at__gte=window_start(timezone.now(), period),
+            is_read=True,
+        ).values_list("recipient_id", flat=True)
+    )
+    create_notifications(
+        _pending_approvals(approver_id, pitches, period)
+        for approver_id, pitches in digests
+        if approver_id not in already_read
+    )
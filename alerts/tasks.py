@@ -0,0 +1,23 @@
+from django.core.management import call_command
+
+from tasks.queue import task
+from .outbox import deliver_batch
+
+OUTBOX_BATCH_SIZE = 50
+
+
+@task("alerts.deliver_outbox")
+def deliver_outbox():
+    # Keep going while batches come back full
+    while sum(deliver_batch(batch_size=OUTBOX_BATCH_SIZE)) == OUTBOX_BATCH_SIZE:
+        pass
+
+
+@task("alerts.prune_notifications", max_attempts=1)
+def prune_notifications():
+    call_command("prune_notifications")
+
+
+@task("alerts.reconcile_unread_counts", max_attempts=1)
+def reconcile_unread_counts():
+    call_command("reconcile_unread_counts")
@@ -7,4 +7,5 @@ def unread_alerts_count(context):
     user = context.get("user")
     if not user or not user.is_authenticated:
         return 0
-    return user.notifications.filter(is_read=False).count()
\ No newline at end of file
+    # Denormalised on the user row, so the badge needs no query
+    return user.unread_notifications
\ No newline at end of file
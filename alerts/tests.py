@@ -1,3 +1,507 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives, send_mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ArchivedNotification, Notification, OutboxEmail
+from .outbox import deliver_batch
+from .realtime import _hub, get_hub
+from .retention import RetentionRule
+from .services import create_notification, notification_batch
+
+User = get_user_model()
 
 # Create your tests here.
+class NotificationBufferTests(TestCase):
+    def setUp(self):
+        """Set up a recipient"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+
+    def _notify(self, message):
+        create_notification(recipient=self.user, type=Notification.Type.BOOKING_CREATED, message=message)
+
+    def _inserts(self, queries):
+        return [q for q in queries if q['sql'].startswith('INSERT INTO "alerts_notification"')]
+
+    def test_notifications_in_a_transaction_are_written_together(self):
+        """Test every notification created in an atomic block is flushed with one INSERT on commit"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                for i in range(5):
+                    self._notify(f'Message {i}')
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        self.assertEqual(len(self._inserts(queries)), 1)
+        self.assertEqual(self.user.notifications.count(), 5)
+
+    def test_rolled_back_savepoint_drops_its_notifications(self):
+        """Test notifications from a rolled back savepoint are never written"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self._notify('Kept')
+                try:
+                    with transaction.atomic():
+                        self._notify('Dropped')
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                self._notify('Also kept')
+        messages = set(self.user.notifications.values_list('message', flat=True))
+        self.assertEqual(messages, {'Kept', 'Also kept'})
+
+    def test_batch_collects_notifications_across_commits(self):
+        """Test a notification batch writes everything from its transactions once, on exit"""
+        # The outer capture stands in for the autocommit write at the end of the batch
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            with notification_batch():
+                for i in range(3):
+                    with self.captureOnCommitCallbacks(execute=True):
+                        with transaction.atomic():
+                            self._notify(f'Message {i}')
+                self.assertFalse(self.user.notifications.exists())
+        self.assertEqual(len(self._inserts(queries)), 1)
+        self.assertEqual(self.user.notifications.count(), 3)
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        """Set up a recipient with three unread notifications"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                create_notification(recipient=self.user, type=Notification.Type.BOOKING_CREATED, message=f'Message {i}')
+        self.client.login(username='coach', password='pass1234')
+
+    def _counter(self):
+        self.user.refresh_from_db()
+        return self.user.unread_notifications
+
+    def test_creating_notifications_increments_counter(self):
+        """Test the counter follows notification creation"""
+        self.assertEqual(self._counter(), 3)
+
+    def test_opening_notification_decrements_counter_once(self):
+        """Test reading a notification marks it read and only counts it the first time"""
+        notification = self.user.notifications.first()
+        url = reverse('notification_detail', args=[notification.pk])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(self._counter(), 2)
+        self.assertContains(response, '<span class="badge bg-primary rounded-pill">2</span>', html=True)
+
+    def test_deleting_unread_notification_decrements_counter(self):
+        """Test deleting unread notifications, one or many, keeps the counter in step"""
+        self.client.post(reverse('notification_delete', args=[self.user.notifications.first().pk]))
+        self.assertEqual(self._counter(), 2)
+        self.user.notifications.all().delete()
+        self.assertEqual(self._counter(), 0)
+
+    def test_badge_is_rendered_without_counting(self):
+        """Test rendering the navbar badge does not query the notifications table"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+        self.assertFalse(any('alerts_notification' in q['sql'] for q in queries))
+
+    def test_reconcile_command_repairs_drift(self):
+        """Test the reconcile command resets counters that no longer match in one statement"""
+        User.objects.filter(pk=self.user.pk).update(unread_notifications=10)
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command('reconcile_unread_counts', stdout=out)
+        self.assertEqual(self._counter(), 3)
+        self.assertIn('Corrected 1', out.getvalue())
+
+
+class InboxBulkActionTests(TestCase):
+    def setUp(self):
+        """Set up two unread and one read notification for a recipient, plus another user's"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.other = User.objects.create_user(username='other', password='pass1234', role='coach')
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in (self.user, self.user, self.user, self.other):
+                create_notification(recipient=user, type=Notification.Type.BOOKING_CREATED, message='Message')
+        self.read = self.user.notifications.first()
+        self.read.mark_read()
+        self.client.login(username='coach', password='pass1234')
+
+    def _post(self, action, ids=()):
+        return self.client.post(reverse('notification_bulk_update'), {'action': action, 'notification_ids': list(ids)})
+
+    def _counter(self, user):
+        user.refresh_from_db()
+        return user.unread_notifications
+
+    def test_mark_all_read_is_one_update(self):
+        """Test mark-all-read updates the inbox in one statement and zeroes the counter"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post('mark_all_read')
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "alerts_notification"')]
+        self.assertEqual(len(updates), 1)
+        self.assertRedirects(response, reverse('notification_list'))
+        self.assertFalse(self.user.notifications.filter(is_read=False).exists())
+        self.assertEqual(self._counter(self.user), 0)
+        self.assertEqual(self._counter(self.other), 1)
+
+    def test_mark_selected_read(self):
+        """Test only the selected notifications are marked read"""
+        target = self.user.notifications.filter(is_read=False).first()
+        self._post('mark_read', [target.pk, self.read.pk])
+        self.assertEqual(self.user.notifications.filter(is_read=False).count(), 1)
+        self.assertEqual(self._counter(self.user), 1)
+
+    def test_delete_all_read_keeps_unread(self):
+        """Test delete-all-read removes read rows only and leaves the counter alone"""
+        with CaptureQueriesContext(connection) as queries:
+            self._post('delete_read')
+        self.assertFalse(Notification.objects.filter(pk=self.read.pk).exists())
+        self.assertFalse(any(q['sql'].startswith('SELECT') and 'alerts_notification' in q['sql'] for q in queries))
+        self.assertEqual(self.user.notifications.count(), 2)
+        self.assertEqual(self._counter(self.user), 2)
+
+    def test_delete_selected_adjusts_counter(self):
+        """Test deleting a mix of read and unread notifications keeps the counter in step"""
+        unread = self.user.notifications.filter(is_read=False).first()
+        self._post('delete', [unread.pk, self.read.pk])
+        self.assertEqual(self.user.notifications.count(), 1)
+        self.assertEqual(self._counter(self.user), 1)
+
+    def test_other_users_notifications_are_untouched(self):
+        """Test selected ids belonging to someone else are ignored"""
+        theirs = self.other.notifications.get()
+        self._post('delete', [theirs.pk])
+        self._post('mark_read', [theirs.pk])
+        theirs.refresh_from_db()
+        self.assertFalse(theirs.is_read)
+        self.assertEqual(self._counter(self.other), 1)
+
+    def test_unknown_action_is_rejected(self):
+        """Test an unknown action returns 400"""
+        self.assertEqual(self._post('archive').status_code, 400)
+
+    def test_single_delete_requires_post(self):
+        """Test a GET can no longer delete a notification"""
+        url = reverse('notification_delete', args=[self.read.pk])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertTrue(Notification.objects.filter(pk=self.read.pk).exists())
+        theirs = self.other.notifications.get()
+        self.assertEqual(self.client.post(reverse('notification_delete', args=[theirs.pk])).status_code, 404)
+
+
+class NotificationInboxTests(TestCase):
+    def setUp(self):
+        """Set up a recipient with more than a page of notifications"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(25):
+                create_notification(recipient=self.user, type=Notification.Type.BOOKING_CREATED, message=f'Message {i}')
+        self.client.login(username='coach', password='pass1234')
+
+    def _page(self, **params):
+        return self.client.get(reverse('notification_list'), params).context['page_obj']
+
+    def test_first_page_is_newest_first(self):
+        """Test the inbox opens on the newest page without counting the table"""
+        with CaptureQueriesContext(connection) as queries:
+            page = self._page()
+        self.assertEqual(len(page), 20)
+        self.assertEqual(page.object_list[0].message, 'Message 24')
+        self.assertTrue(page.has_next)
+        self.assertFalse(page.has_previous)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries))
+
+    def test_older_and_newer_cursors_walk_the_inbox(self):
+        """Test the older and newer links return adjacent pages"""
+        first = self._page()
+        older = self._page(older=first.next_cursor)
+        self.assertEqual([n.message for n in older], [f'Message {i}' for i in range(4, -1, -1)])
+        self.assertFalse(older.has_next)
+        newer = self._page(newer=older.previous_cursor)
+        self.assertEqual([n.pk for n in newer], [n.pk for n in first])
+
+    def test_invalid_cursor_is_not_found(self):
+        """Test a tampered cursor returns 404"""
+        response = self.client.get(reverse('notification_list'), {'older': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_inbox_query_uses_composite_index(self):
+        """Test the inbox page is planned against the recipient/created_at index"""
+        queryset = Notification.objects.filter(recipient=self.user).order_by('-created_at', '-id')[:21]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn('notification_inbox_idx', queryset.explain())
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        """Set up old and recent notifications in both read states"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        with self.captureOnCommitCallbacks(execute=True):
+            for message in ['old read', 'old unread', 'new read', 'new unread']:
+                create_notification(recipient=self.user, type=Notification.Type.BOOKING_CREATED, message=message)
+        Notification.objects.filter(message__startswith='old').update(created_at=timezone.now() - timedelta(days=400))
+        Notification.objects.filter(message__endswith=' read').mark_read()
+
+    def _prune(self, *args):
+        out = StringIO()
+        call_command('prune_notifications', *args, '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def test_rules_delete_and_archive_old_rows(self):
+        """Test old read rows are deleted, old unread rows archived and recent rows kept"""
+        output = self._prune()
+        self.assertEqual(set(self.user.notifications.values_list('message', flat=True)), {'new read', 'new unread'})
+        self.assertEqual(list(ArchivedNotification.objects.values_list('message', flat=True)), ['old unread'])
+        self.assertIn('Reclaimed 2 row(s)', output)
+
+    def test_pruning_unread_rows_updates_counter(self):
+        """Test archiving unread notifications takes them off the badge"""
+        self._prune()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 1)
+
+    def test_dry_run_changes_nothing(self):
+        """Test a dry run reports what it would reclaim and leaves every row"""
+        output = self._prune('--dry-run')
+        self.assertEqual(self.user.notifications.count(), 4)
+        self.assertIn('Would reclaim 2 row(s)', output)
+
+    def test_rules_reject_unknown_types(self):
+        """Test a misspelt notification type in the settings is refused"""
+        with self.assertRaises(ValueError):
+            RetentionRule(days=30, types=['booking_moved'])
+
+
+class NotificationDedupeTests(TestCase):
+    def setUp(self):
+        """Set up a recipient"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+
+    def _notify(self, message, key='booking:1:status'):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification(
+                recipient=self.user, type=Notification.Type.STATUS_CHANGED, message=message, dedupe_key=key
+            )
+
+    def test_repeats_coalesce_into_one_unread_row(self):
+        """Test notifications sharing a key update the unread row instead of adding rows"""
+        for status in ['pending', 'conflicting', 'approved']:
+            self._notify(f'Now {status}')
+        notification = self.user.notifications.get()
+        self.assertEqual(notification.message, 'Now approved')
+        self.assertEqual(notification.occurrences, 3)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 1)
+
+    def test_coalescing_is_a_single_statement(self):
+        """Test refreshing an existing unread row costs one upsert"""
+        self._notify('First')
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_notification(
+                recipient=self.user, type=Notification.Type.STATUS_CHANGED, message='Second', dedupe_key='booking:1:status'
+            )
+        with CaptureQueriesContext(connection) as queries:
+            callbacks[0]()
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('ON CONFLICT', statements[0])
+
+    def test_read_rows_are_not_reused(self):
+        """Test a notification after the row was read starts a new unread row"""
+        self._notify('First')
+        self.user.notifications.mark_read()
+        self._notify('Second')
+        self.assertEqual(self.user.notifications.count(), 2)
+        self.assertEqual(self.user.notifications.unread().get().message, 'Second')
+
+    def test_other_keys_and_unkeyed_notifications_are_separate(self):
+        """Test only matching keys coalesce"""
+        self._notify('One')
+        self._notify('Two', key='booking:2:status')
+        self._notify('Three', key='')
+        self._notify('Four', key='')
+        self.assertEqual(self.user.notifications.count(), 4)
+
+
+@override_settings(NOTIFICATION_HUB_BACKEND='alerts.realtime.LocalBackend')
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        """Set up a recipient with one unread notification"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification(recipient=self.user, type=Notification.Type.BOOKING_CREATED, message='Hello')
+
+    def test_wsgi_request_gets_count_and_retry(self):
+        """Test without ASGI the endpoint answers once with the count and a reconnect delay"""
+        self.client.login(username='coach', password='pass1234')
+        response = self.client.get(reverse('notification_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response.content.decode(), 'retry: 30000\nevent: unread\ndata: {"count": 1}\n\n')
+
+    def test_anonymous_stream_is_closed(self):
+        """Test anonymous visitors are told not to reconnect"""
+        self.assertEqual(self.client.get(reverse('notification_stream')).status_code, 204)
+
+    async def test_stream_pushes_new_notifications(self):
+        """Test an open stream receives the count, then new notifications and counts as they commit"""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('notification_stream'))
+        events = aiter(response.streaming_content)
+        self.assertIn(b'"count": 1', await anext(events))
+
+        await sync_to_async(self._notify_on_commit)('Second')
+        received = [await anext(events), await anext(events)]
+        self.assertIn(b'event: unread\ndata: {"count": 2}', received[0])
+        self.assertIn(b'"message": "Second"', received[1])
+
+        # A browser disconnecting cancels the task serving the stream
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertFalse(get_hub().subscribed({self.user.pk}))
+
+    def _notify_on_commit(self, message):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification(recipient=self.user, type=Notification.Type.BOOKING_CREATED, message=message)
+
+    def test_publishing_without_listeners_costs_no_query(self):
+        """Test users with no open stream are skipped without reading their counters"""
+        with CaptureQueriesContext(connection) as queries:
+            self._notify_on_commit('Unheard')
+        self.assertFalse(any('"unread_notifications" FROM' in q['sql'] for q in queries))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY needs PostgreSQL')
+@override_settings(NOTIFICATION_HUB_BACKEND='alerts.realtime.PostgresBackend')
+class PostgresHubTests(TransactionTestCase):
+    def setUp(self):
+        """Set up a recipient and a hub whose listener notices being stopped quickly"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.hub = get_hub()
+        self.hub.POLL_SECONDS = 0.1
+
+    def tearDown(self):
+        self.hub.stop()
+        _hub.cache_clear()
+
+    async def test_committed_notification_reaches_stream_through_database(self):
+        """Test a notification created outside the stream's process arrives via NOTIFY"""
+        queue = self.hub.subscribe(self.user.pk)
+        self.assertTrue(await sync_to_async(self.hub.listening.wait)(5))
+        await sync_to_async(create_notification)(
+            recipient=self.user, type=Notification.Type.BOOKING_CREATED, message='From the worker',
+        )
+        received = [await asyncio.wait_for(queue.get(), 5) for _ in range(2)]
+        self.assertTrue(any('"message": "From the worker"' in event for event in received))
+        self.assertTrue(any('event: unread\ndata: {"count": 1}' in event for event in received))
+
+
+class CountingBackend(LocmemBackend):
+    """Locmem delivery that counts connections and bounces one address"""
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        CountingBackend.atomic_depth = len(connection.atomic_blocks)
+        CountingBackend.due = OutboxEmail.objects.filter(next_attempt_at__lte=timezone.now()).count()
+        if any('bounce@example.com' in m.to for m in messages):
+            raise ConnectionError('Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='alerts.outbox.OutboxBackend',
+    EMAIL_DELIVERY_BACKEND='alerts.tests.CountingBackend',
+    EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+    EMAIL_OUTBOX_RETRY_DELAY=60,
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        CountingBackend.opened = 0
+
+    def test_sending_queues_instead_of_delivering(self):
+        """Test send_mail writes an outbox row and contacts no mail server"""
+        send_mail('Subject', 'Body', 'club@example.com', ['coach@example.com'])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(CountingBackend.opened, 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.to, email.status), (['coach@example.com'], OutboxEmail.Status.PENDING))
+
+    def test_rolled_back_request_sends_nothing(self):
+        """Test mail queued inside a transaction that rolls back is discarded with it"""
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            send_mail('Subject', 'Body', 'club@example.com', ['coach@example.com'])
+            raise RuntimeError
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_batch_is_delivered_over_one_connection(self):
+        """Test a batch is sent over a single connection and the HTML part survives"""
+        message = EmailMultiAlternatives('Reset', 'Text', 'club@example.com', ['a@example.com'])
+        message.attach_alternative('<p>HTML</p>', 'text/html')
+        message.send()
+        for address in ['b@example.com', 'c@example.com']:
+            send_mail('Subject', 'Body', 'club@example.com', [address])
+
+        self.assertEqual(deliver_batch(), (3, 0))
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][0], '<p>HTML</p>')
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.Status.SENT).exists())
+        self.assertEqual(deliver_batch(), (0, 0))
+
+    def test_sending_holds_no_transaction(self):
+        """Test messages are sent outside the claiming transaction with the batch leased"""
+        send_mail('Subject', 'Body', 'club@example.com', ['coach@example.com'])
+        depth = len(connection.atomic_blocks)
+        self.assertEqual(deliver_batch(), (1, 0))
+        self.assertEqual(CountingBackend.atomic_depth, depth)
+        self.assertEqual(CountingBackend.due, 0)
+
+    def test_failures_back_off_then_give_up(self):
+        """Test a failing message is retried after the backoff delay and marked failed at the limit"""
+        send_mail('Subject', 'Body', 'club@example.com', ['bounce@example.com'])
+        send_mail('Subject', 'Body', 'club@example.com', ['coach@example.com'])
+        now = timezone.now()
+
+        self.assertEqual(deliver_batch(now=now), (1, 1))
+        email = OutboxEmail.objects.get(to=['bounce@example.com'])
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.Status.PENDING, 1))
+        self.assertEqual(email.next_attempt_at, now + timedelta(seconds=60))
+        self.assertIn('Mailbox unavailable', email.last_error)
+
+        self.assertEqual(deliver_batch(now=now + timedelta(seconds=59)), (0, 0))
+        with self.assertLogs('alerts.outbox', 'ERROR'):
+            self.assertEqual(deliver_batch(now=now + timedelta(seconds=60)), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.Status.FAILED, 2))
+
+    def test_password_reset_goes_through_outbox(self):
+        """Test the password reset view only queues its email and the worker sends it"""
+        User.objects.create_user(username='coach', email='coach@example.com', password='pass1234', role='coach')
+        response = self.client.post(reverse('password_reset'), {'email': 'coach@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+
+        out = StringIO()
+        call_command('deliver_outbox', stdout=out)
+        self.assertIn('Sent 1 email(s)', out.getvalue())
+        self.assertEqual(mail.outbox[0].to, ['coach@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
@@ -1,6 +1,16 @@
+import asyncio
+
+from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.views.decorators.http import require_POST
+from config.pagination import InvalidCursor, KeysetPaginator
 from django.views.generic import ListView, DetailView, DeleteView
 from .models import Notification
+from .realtime import format_event, get_hub
 from django.urls import reverse_lazy
 
 # Create your views here.
@@ -14,9 +24,21 @@ class NotificationListView(LoginRequiredMixin, ListView):
         return (
             Notification.objects
             .filter(recipient=self.request.user)
-            .order_by("-created_at")
+            .order_by("-created_at", "-id")
         )
 
+    def paginate_queryset(self, queryset, page_size):
+        # Keyset pagination on (created_at, id), served by notification_inbox_idx
+        paginator = KeysetPaginator(queryset, ordering=["-created_at", "-id"], per_page=page_size)
+        try:
+            page = paginator.page(
+                after=self.request.GET.get("older"),
+                before=self.request.GET.get("newer"),
+            )
+        except InvalidCursor:
+            raise Http404("Invalid page cursor")
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 class NotificationDetailView(LoginRequiredMixin, DetailView):
     model = Notification
@@ -30,13 +52,76 @@ class NotificationDetailView(LoginRequiredMixin, DetailView):
         response = super().get(request, *args, **kwargs)
         
         if not self.object.is_read:
-            self.object.is_read = True
-            self.object.save(update_fields=["is_read"])
+            self.object.mark_read()
+            # The navbar badge renders from the counter on request.user
+            request.user.refresh_from_db(fields=["unread_notifications"])
         return response
 
 class NotificationDeleteView(LoginRequiredMixin, DeleteView):
         model = Notification
         success_url = reverse_lazy('notification_list')
+        http_method_names = ['post']
+
+        def get_queryset(self):
+            return Notification.objects.filter(recipient=self.request.user)
+
+
+INBOX_ACTIONS = ['mark_all_read', 'mark_read', 'delete_read', 'delete']
+
+@login_required
+@require_POST
+def bulk_update_notifications(request):
+    # Each action is one UPDATE/DELETE on the user's inbox plus the counter update
+    action = request.POST.get('action')
+    if action not in INBOX_ACTIONS:
+        return HttpResponseBadRequest("Unknown inbox action")
+    ids = [int(pk) for pk in request.POST.getlist('notification_ids') if pk.isdigit()]
+
+    inbox = Notification.objects.all()
+    if action == 'mark_all_read':
+        inbox.mark_read(recipient=request.user)
+    elif action == 'mark_read':
+        inbox.filter(pk__in=ids).mark_read(recipient=request.user)
+    elif action == 'delete_read':
+        inbox.filter(is_read=True).delete(recipient=request.user)
+    else:
+        inbox.filter(pk__in=ids).delete(recipient=request.user)
+    return redirect('notification_list')
+
+
+# Server-sent events: new notifications and unread counts pushed to open tabs
+KEEPALIVE_SECONDS = 15
+# How long browsers wait before reconnecting when the site is served over WSGI
+WSGI_RETRY_MS = 30000
+
+async def notification_stream(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        # 204 tells EventSource to stop reconnecting
+        return HttpResponse(status=204)
+
+    if not isinstance(request, ASGIRequest):
+        # A long-lived stream would hold a WSGI worker, so send the current
+        # count once and let the browser reconnect later, i.e. slow polling
+        body = f"retry: {WSGI_RETRY_MS}\n" + format_event("unread", {"count": user.unread_notifications})
+        return HttpResponse(body, content_type="text/event-stream")
+
+    response = StreamingHttpResponse(_stream(user.pk), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
-        def get(self, request, *args, **kwargs):
-            return self.delete(request, *args, **kwargs)
+async def _stream(user_id):
+    hub = get_hub()
+    queue = hub.subscribe(user_id)
+    try:
+        # Subscribe before reading the count so nothing in between is missed
+        count = await get_user_model().objects.filter(pk=user_id).values_list("unread_notifications", flat=True).aget()
+        yield format_event("unread", {"count": count})
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        hub.unsubscribe(user_id, queue)
@@ -1,18 +1,29 @@
 from django.contrib import admin
-from .models import Pitch, Booking
+from .models import ApprovalRule, Pitch, Booking, BookingSeries
 
 # Register your models here.
 @admin.register(Pitch)
 class PitchAdmin(admin.ModelAdmin):
-    list_display = ('name', 'description', 'is_public')
+    list_display = ('name', 'category', 'description', 'is_public')
+    list_filter = ('category',)
     search_fields = ('name',)
 
+@admin.register(ApprovalRule)
+class ApprovalRuleAdmin(admin.ModelAdmin):
+    list_display = ('category', 'role', 'can_book', 'on_submit', 'can_approve')
+    list_filter = ('category', 'role')
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = (
         'pitch', 'name', 'start_time', 'end_time', 'status', 'method', 'submitted_at'
     )
-    list_filter = ('pitch', 'status', 'method', 'start_time')
+    list_filter = ('pitch', 'status', 'method', 'team', 'start_time')
     search_fields = ('name', 'email', 'phone')
     date_hierarchy = 'start_time'
-    ordering = ('-submitted_at',)
\ No newline at end of file
+    ordering = ('-submitted_at',)
+
+@admin.register(BookingSeries)
+class BookingSeriesAdmin(admin.ModelAdmin):
+    list_display = ('pitch', 'created_by', 'start_time', 'frequency', 'until', 'created_at')
+    list_filter = ('pitch', 'frequency')
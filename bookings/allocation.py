@@ -0,0 +1,255 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from teams.models import Team
+from .models import Booking, BookingSeries, Pitch
+from .services import create_series, team_weekly_hours, week_bounds
+
+# Season training-slot allocation. The week is cut into SLOT_MINUTES slots and
+# each pitch-day is an integer bitmask of the slots already taken, so testing a
+# candidate session against a pitch, or against its coach's other sessions, is
+# a single AND however many bookings there are.
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# Dead ends the solver may back out of before it settles for a greedy finish
+BACKTRACK_LIMIT = 1000
+
+
+def _slot(value, round_up=False):
+    # The slot a time of day falls in, or with round_up the first slot starting at or after it
+    slot, remainder = divmod(value.hour * 60 + value.minute, SLOT_MINUTES)
+    if round_up and (remainder or value.second or value.microsecond):
+        slot += 1
+    return slot
+
+
+def _mask(first, last):
+    # Bits first..last-1
+    return ((1 << (last - first)) - 1) << first
+
+
+def slot_time(slot):
+    return time(*divmod(slot * SLOT_MINUTES, 60))
+
+
+def busy_masks(pitch_ids, start_day, until):
+    """
+    {(pitch_id, weekday): mask} of the slots an approved booking takes up in
+    any week of the season, from one range query.
+    """
+    season_start = timezone.make_aware(datetime.combine(start_day, time.min))
+    season_end = timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min))
+    rows = (
+        Booking.objects.approved()
+        .filter(pitch_id__in=pitch_ids, start_time__lt=season_end, end_time__gt=season_start)
+        .values_list('pitch_id', 'start_time', 'end_time')
+    )
+    busy = {}
+    for pitch_id, start_time, end_time in rows:
+        start = timezone.localtime(max(start_time, season_start))
+        end = timezone.localtime(min(end_time, season_end))
+        day = start.date()
+        # Split anything running past midnight into one piece per day
+        while day <= end.date():
+            first = _slot(start) if day == start.date() else 0
+            last = _slot(end, round_up=True) if day == end.date() else SLOTS_PER_DAY
+            if last > first:
+                key = (pitch_id, day.weekday())
+                busy[key] = busy.get(key, 0) | _mask(first, last)
+            day += timedelta(days=1)
+    return busy
+
+
+def candidates(team, windows, pitch_ids):
+    """
+    Every (preference, weekday, start_slot, pitch_id, mask) the team could
+    train in, best first. A team without windows can use any opening hours.
+    """
+    opening_hour, closing_hour = settings.PITCH_OPENING_HOURS
+    opens = opening_hour * 60 // SLOT_MINUTES
+    closes = closing_hour * 60 // SLOT_MINUTES
+    length = -(-team.session_minutes // SLOT_MINUTES)
+    if not windows:
+        windows = [(1, weekday, opens, closes, None) for weekday in range(7)]
+    found = []
+    for preference, weekday, first, last, pitch_id in windows:
+        if pitch_id is not None and pitch_id not in pitch_ids:
+            continue
+        first, last = max(first, opens), min(last, closes)
+        for start in range(first, last - length + 1):
+            mask = _mask(start, start + length)
+            for pid in [pitch_id] if pitch_id is not None else pitch_ids:
+                found.append((preference, weekday, start, pid, mask))
+    found.sort(key=lambda c: (c[0], c[1], c[2], pitch_ids.index(c[3])))
+    return found
+
+
+def session_count(team, booked=timedelta()):
+    # Never plan more than the team's weekly quota allows on top of the time
+    # it already has booked in its busiest week
+    sessions = team.training_sessions
+    if team.weekly_hours_quota is not None and team.session_minutes:
+        free = timedelta(hours=team.weekly_hours_quota) - booked
+        sessions = max(min(sessions, free // timedelta(minutes=team.session_minutes)), 0)
+    return sessions
+
+
+def solve(demands, busy, limit=BACKTRACK_LIMIT):
+    """
+    Place each demand, (team, coach_id, candidates), on one of its candidates
+    so no two sessions share pitch slots, no coach is in two places at once
+    and no team trains twice in a day. Demands are taken most constrained
+    first; when one has nowhere to go the solver backs out of the previous
+    placement and tries that demand's next candidate. Once `limit` dead ends
+    have been hit it stops backing out and leaves what doesn't fit unplaced.
+    Returns [(demand, candidate or None)].
+    """
+    # Candidates clashing with existing bookings are dropped up front, so the
+    # ordering sees how constrained each demand really is
+    order = sorted(
+        (
+            (team, coach_id, [c for c in options if not busy.get((c[3], c[1]), 0) & c[4]])
+            for team, coach_id, options in demands
+        ),
+        key=lambda d: (len(d[2]), d[0].pk),
+    )
+    busy = dict(busy)
+    coaches = {}
+    team_days = {}
+    placed = [None] * len(order)
+    tried = [0] * len(order)
+    dead_ends = 0
+    i = 0
+
+    def fits(team, coach_id, candidate):
+        _, weekday, _, pitch_id, mask = candidate
+        return (
+            not busy.get((pitch_id, weekday), 0) & mask
+            and not (coach_id and coaches.get((coach_id, weekday), 0) & mask)
+            and weekday not in team_days.get(team.pk, ())
+        )
+
+    def toggle(team, coach_id, candidate):
+        # XOR both places and removes a placement
+        _, weekday, _, pitch_id, mask = candidate
+        busy[pitch_id, weekday] = busy.get((pitch_id, weekday), 0) ^ mask
+        if coach_id:
+            coaches[coach_id, weekday] = coaches.get((coach_id, weekday), 0) ^ mask
+        team_days.setdefault(team.pk, set()).symmetric_difference_update({weekday})
+
+    while i < len(order):
+        team, coach_id, options = order[i]
+        for index in range(tried[i], len(options)):
+            if fits(team, coach_id, options[index]):
+                placed[i] = options[index]
+                tried[i] = index + 1
+                toggle(team, coach_id, placed[i])
+                i += 1
+                break
+        else:
+            tried[i] = 0
+            previous = i - 1
+            while previous >= 0 and placed[previous] is None:
+                previous -= 1
+            dead_ends += 1
+            if dead_ends > limit or previous < 0:
+                # Out of budget (or nothing left to undo): leave it unplaced
+                placed[i] = None
+                tried[i] = len(options)
+                i += 1
+                continue
+            # Undo everything back to the last placement and move it on
+            for j in range(previous, i):
+                if placed[j] is not None:
+                    toggle(order[j][0], order[j][1], placed[j])
+                    placed[j] = None
+                if j > previous:
+                    tried[j] = 0
+            i = previous
+    return list(zip(order, placed))
+
+
+class SeasonPlan:
+    def __init__(self, start_day, until, pitches, results):
+        self.start_day = start_day
+        self.until = until
+        self.pitches = pitches
+        # (team, pitch, weekday, start time, end time), by pitch, day and time
+        self.sessions = []
+        # {team: sessions that could not be placed}
+        self.unplaced = {}
+        for (team, _, _), candidate in results:
+            if candidate is None:
+                self.unplaced[team] = self.unplaced.get(team, 0) + 1
+                continue
+            _, weekday, start, pitch_id, _ = candidate
+            start_time = slot_time(start)
+            end_time = (datetime.combine(start_day, start_time) + timedelta(minutes=team.session_minutes)).time()
+            self.sessions.append((team, pitches[pitch_id], weekday, start_time, end_time))
+        self.sessions.sort(key=lambda s: (s[1].name, s[2], s[3], str(s[0])))
+
+    def first_day(self, weekday):
+        return self.start_day + timedelta(days=(weekday - self.start_day.weekday()) % 7)
+
+    def book(self, user):
+        """
+        Create a weekly BookingSeries for every planned session, booked
+        through create_series so statuses follow the approval policy and the
+        team quotas are checked again. Raises ValidationError, booking
+        nothing, if a team has booked more time since the plan was made.
+        """
+        created = []
+        with transaction.atomic():
+            for team, pitch, weekday, start_time, end_time in self.sessions:
+                day = self.first_day(weekday)
+                if day > self.until:
+                    continue
+                start = timezone.make_aware(datetime.combine(day, start_time))
+                series = BookingSeries.objects.create(
+                    pitch=pitch, team=team, created_by=user, frequency='weekly', until=self.until,
+                    start_time=start, end_time=start + timedelta(minutes=team.session_minutes),
+                )
+                created.extend(create_series(series, user))
+        return created
+
+
+def plan_season(start_day, until, pitches=None, limit=BACKTRACK_LIMIT):
+    """
+    Allocate weekly training sessions to every team that asks for them on the
+    given pitches (by default the main and astro pitches), around the approved
+    bookings already in the season and within what each team's quota has left.
+    """
+    if pitches is None:
+        pitches = Pitch.objects.filter(category__in=[Pitch.Category.MAIN, Pitch.Category.ASTRO])
+    pitches = {pitch.pk: pitch for pitch in pitches.order_by('category', 'name')}
+    pitch_ids = list(pitches)
+
+    teams = list(
+        Team.objects.filter(training_sessions__gt=0)
+        .prefetch_related('training_windows')
+        .order_by('pk')
+    )
+    # The most time each team already has booked in any week of the season
+    season_start, season_end = (timezone.make_aware(datetime.combine(day, time.min)) for day in (start_day, until))
+    weeks = team_weekly_hours([team.pk for team in teams], week_bounds(season_start)[0], week_bounds(season_end)[1])
+    busiest = {}
+    for (team_id, _), booked in weeks.items():
+        busiest[team_id] = max(busiest.get(team_id, booked), booked)
+
+    demands = []
+    for team in teams:
+        windows = [
+            (w.preference, w.weekday, _slot(w.start_time, round_up=True), _slot(w.end_time), w.pitch_id)
+            for w in team.training_windows.all()
+        ]
+        options = candidates(team, windows, pitch_ids)
+        sessions = session_count(team, busiest.get(team.pk, timedelta()))
+        demands.extend((team, team.coach_id, options) for _ in range(sessions))
+
+    results = solve(demands, busy_masks(pitch_ids, start_day, until), limit)
+    return SeasonPlan(start_day, until, pitches, results)
@@ -0,0 +1,107 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Booking
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(pitch_id, day):
+    return f"bookings:availability:{pitch_id}:{day.isoformat()}"
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _days(start_day, end_day):
+    day = start_day
+    while day <= end_day:
+        yield day
+        day += timedelta(days=1)
+
+
+def merge_intervals(intervals):
+    # Sweep-line pass over intervals sorted by start, folding overlapping or touching ones together
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def free_intervals(busy, window_start, window_end):
+    free = []
+    cursor = window_start
+    for start, end in busy:
+        if start > cursor:
+            free.append((cursor, min(start, window_end)))
+        cursor = max(cursor, end)
+        if cursor >= window_end:
+            break
+    if cursor < window_end:
+        free.append((cursor, window_end))
+    return [(start, end) for start, end in free if start < end]
+
+
+def _compute_day(day, intervals):
+    opening_hour, closing_hour = settings.PITCH_OPENING_HOURS
+    day_start = _day_start(day)
+    day_end = day_start + timedelta(days=1)
+    clipped = [
+        (max(start, day_start), min(end, day_end))
+        for start, end in intervals
+        if start < day_end and end > day_start
+    ]
+    busy = merge_intervals(clipped)
+    free = free_intervals(
+        busy,
+        day_start + timedelta(hours=opening_hour),
+        day_start + timedelta(hours=closing_hour),
+    )
+    return {
+        "date": day.isoformat(),
+        "busy": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in busy],
+        "free": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in free],
+    }
+
+
+def pitch_availability(pitch_id, start_day, end_day):
+    days = list(_days(start_day, end_day))
+    keys = {day: _cache_key(pitch_id, day) for day in days}
+    cached = cache.get_many(keys.values())
+
+    missing = [day for day in days if keys[day] not in cached]
+    if missing:
+        # One range query covers every uncached day
+        range_start = _day_start(missing[0])
+        range_end = _day_start(missing[-1]) + timedelta(days=1)
+        intervals = list(
+            Booking.objects
+            .overlapping(pitch_id, range_start, range_end)
+            .approved()
+            .values_list("start_time", "end_time")
+        )
+        computed = {keys[day]: _compute_day(day, intervals) for day in missing}
+        cache.set_many(computed, CACHE_TIMEOUT)
+        cached.update(computed)
+
+    return [cached[keys[day]] for day in days]
+
+
+def invalidate_availability(windows):
+    keys = set()
+    for pitch_id, start_time, end_time in windows:
+        first = timezone.localtime(start_time).date()
+        last = timezone.localtime(end_time - timedelta(microseconds=1)).date()
+        keys.update(_cache_key(pitch_id, day) for day in _days(first, last))
+    if keys:
+        # Drop after commit so a concurrent reader cannot re-cache the pre-commit state
+        transaction.on_commit(lambda: cache.delete_many(list(keys)))
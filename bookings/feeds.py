@@ -0,0 +1,196 @@
+import hashlib
+from datetime import timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import Booking, Pitch
+from .policy import get_policy
+from .services import OPEN_STATUSES
+
+FEED_SALT = 'bookings.feeds'
+CHUNK_SIZE = 500
+# How far back personal feeds reach, so a subscription does not grow forever
+HISTORY = timedelta(days=30)
+
+ICS_STATUS = {
+    'approved': 'CONFIRMED',
+    'pending': 'TENTATIVE',
+    'conflicting': 'TENTATIVE',
+    'rejected': 'CANCELLED',
+}
+
+
+def feed_token(user, kind):
+    return signing.dumps({'u': user.pk, 'k': kind}, salt=FEED_SALT, compress=True)
+
+
+def _user_for_token(token, kind):
+    try:
+        data = signing.loads(token, salt=FEED_SALT)
+    except signing.BadSignature:
+        raise Http404("Unknown calendar feed")
+    if data.get('k') != kind:
+        raise Http404("Unknown calendar feed")
+    return get_object_or_404(get_user_model(), pk=data['u'], is_active=True)
+
+
+def feed_links(user):
+    links = [('My bookings', reverse('user_feed', args=[feed_token(user, 'user')]))]
+    if get_policy().approvable(user.role):
+        links.append(('Bookings awaiting my approval', reverse('approver_feed', args=[feed_token(user, 'approver')])))
+    return links
+
+
+# iCalendar text helpers
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\n', '\\n')
+    )
+
+
+def _fold(line):
+    # RFC 5545 lines are limited to 75 octets, continuation lines start with a space
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Never split a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _utc(dt):
+    return dt.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _event(booking, summary):
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:booking-{booking.id}@bailebeag',
+        f'DTSTAMP:{_utc(booking.submitted_at)}',
+        f'DTSTART:{_utc(booking.start_time)}',
+        f'DTEND:{_utc(booking.end_time)}',
+        f'SUMMARY:{_escape(summary)}',
+        f'LOCATION:{_escape(booking.pitch.name)}',
+        f'STATUS:{ICS_STATUS.get(booking.status, "TENTATIVE")}',
+        'END:VEVENT',
+    ]
+    return ''.join(_fold(line) for line in lines)
+
+
+def _calendar(name, bookings, summary):
+    yield ''.join(_fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Baile Beag GAA//Pitch Bookings//EN',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_escape(name)}',
+    ])
+    for booking in bookings.iterator(chunk_size=CHUNK_SIZE):
+        yield _event(booking, summary(booking))
+    yield _fold('END:VCALENDAR')
+
+
+def _ics_response(name, bookings, summary):
+    response = StreamingHttpResponse(
+        _calendar(name, bookings, summary), content_type='text/calendar; charset=utf-8'
+    )
+    response['Content-Disposition'] = 'inline; filename="bookings.ics"'
+    return response
+
+
+def _feed_columns(queryset):
+    return queryset.select_related('pitch').only(
+        'id', 'name', 'start_time', 'end_time', 'status', 'submitted_at', 'pitch__name'
+    ).order_by('start_time')
+
+
+# Conditional GET: ETag and Last-Modified come from the pitch change counters
+# bumped in bookings_changed(), so an unchanged feed answers 304 without
+# reading any booking rows.
+
+def _versions(request, pitch_filter):
+    if not hasattr(request, '_feed_versions'):
+        request._feed_versions = list(
+            Pitch.objects.filter(**pitch_filter)
+            .order_by('pk')
+            .values_list('pk', 'schedule_version', 'schedule_changed_at')
+        )
+    return request._feed_versions
+
+
+def _etag(request, scope, pitch_filter):
+    versions = [(pk, version) for pk, version, _ in _versions(request, pitch_filter)]
+    return hashlib.sha1(repr((scope, versions)).encode()).hexdigest()
+
+
+def _last_modified(request, pitch_filter):
+    changed = [changed_at for _, _, changed_at in _versions(request, pitch_filter) if changed_at]
+    return max(changed) if changed else None
+
+
+@condition(
+    etag_func=lambda request, pk: _etag(request, f'pitch-{pk}', {'pk': pk}),
+    last_modified_func=lambda request, pk: _last_modified(request, {'pk': pk}),
+)
+def pitch_feed(request, pk):
+    pitch = get_object_or_404(Pitch, pk=pk)
+    bookings = _feed_columns(
+        Booking.objects.approved().filter(pitch=pitch, end_time__gte=timezone.now() - HISTORY)
+    )
+    return _ics_response(pitch.name, bookings, lambda booking: f'{pitch.name} booked')
+
+
+@condition(
+    etag_func=lambda request, token: _etag(request, f'user-{token}', {}),
+    last_modified_func=lambda request, token: _last_modified(request, {}),
+)
+def user_feed(request, token):
+    user = _user_for_token(token, 'user')
+    bookings = _feed_columns(
+        Booking.objects.filter(created_by=user, end_time__gte=timezone.now() - HISTORY)
+        .exclude(status='rejected')
+    )
+    return _ics_response(
+        'My pitch bookings', bookings,
+        lambda booking: f'{booking.pitch.name} ({booking.get_status_display()})',
+    )
+
+
+@condition(
+    etag_func=lambda request, token: _etag(request, f'approver-{token}', {}),
+    last_modified_func=lambda request, token: _last_modified(request, {}),
+)
+def approver_feed(request, token):
+    user = _user_for_token(token, 'approver')
+    policy = get_policy()
+    pitch_ids = policy.approvable(user.role)
+    if not pitch_ids:
+        raise Http404("Unknown calendar feed")
+    bookings = _feed_columns(
+        Booking.objects.filter(
+            pitch_id__in=pitch_ids, status__in=OPEN_STATUSES, end_time__gte=timezone.now()
+        )
+    )
+    pitch_names = ', '.join(sorted(policy.pitch_names[pk] for pk in pitch_ids))
+    return _ics_response(
+        f'{pitch_names} approvals', bookings,
+        lambda booking: f'{booking.get_status_display()}: {booking.name}',
+    )
@@ -1,13 +1,17 @@
+from datetime import date, timedelta
 from django import forms
-from .models import Booking, Pitch
+from django.db import transaction
+from teams.models import Team
+from .models import Booking, BookingSeries, Pitch
+from .policy import get_policy
+from .services import quota_error, save_booking
 
-from django import forms
-from .models import Booking, Pitch
+TEAM_ROLES = ['manager', 'chairman', 'secretary']
 
 class BookingForm(forms.ModelForm):
     class Meta:
         model = Booking
-        fields = ['pitch', 'name', 'email', 'phone', 'start_time', 'end_time', 'method']
+        fields = ['pitch', 'team', 'name', 'email', 'phone', 'start_time', 'end_time', 'method']
         widgets = {
             'start_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
             # Restricts User from changing the JS formatted end time of start time plus one hour
@@ -18,14 +22,21 @@ class BookingForm(forms.ModelForm):
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
 
-        # Restricts pitch options based on user
-        if self.user and self.user.is_authenticated:
+        # Restricts pitch options to the pitches the approval policy lets this user book
+        authenticated = self.user and self.user.is_authenticated
+        bookable = get_policy().bookable(self.user.role if authenticated else None)
+        self.fields['pitch'].queryset = Pitch.objects.filter(pk__in=bookable)
+
+        if authenticated:
             role = getattr(self.user, 'role', None)
-            
-            if role in ['coach', 'chairman', 'secretary', 'manager']:
-                self.fields['pitch'].queryset = Pitch.objects.all()
+
+            # Coaches book for their own teams, officials for any team
+            if role == 'coach':
+                self.fields['team'].queryset = self.user.coached_teams.all()
+            elif role in TEAM_ROLES:
+                self.fields['team'].queryset = Team.objects.all()
             else:
-                self.fields['pitch'].queryset = Pitch.objects.filter(name__icontains='Astro')
+                del self.fields['team']
 
             # Restricts method choice only to manager, all other users are default web in views, so don't need this choice
             if role == 'manager':
@@ -43,4 +54,103 @@ class BookingForm(forms.ModelForm):
         else:
             self.fields['method'].widget = forms.HiddenInput()
             self.fields['method'].initial = 'web'
-            self.fields['pitch'].queryset = Pitch.objects.filter(name__icontains='Astro')
\ No newline at end of file
+            del self.fields['team']
+
+    def clean(self):
+        cleaned = super().clean()
+        team, start, end = cleaned.get('team'), cleaned.get('start_time'), cleaned.get('end_time')
+        if team and start and end:
+            error = quota_error(team, start, end, exclude=self.instance.pk)
+            if error:
+                self.add_error('team', error)
+        return cleaned
+
+    def save_within_quota(self, booking):
+        """
+        Save the booking, checking its team's quota again with the team row
+        locked so two submissions can't both take the last hours of a week.
+        Returns False, with the error on the form, if the quota filled up since
+        the form was validated.
+        """
+        with transaction.atomic():
+            if booking.team_id:
+                team = Team.objects.select_for_update().get(pk=booking.team_id)
+                error = quota_error(team, booking.start_time, booking.end_time, exclude=booking.pk)
+                if error:
+                    self.add_error('team', error)
+                    return False
+            save_booking(booking)
+        return True
+
+
+class BookingSeriesForm(forms.ModelForm):
+    MAX_OCCURRENCES = 52
+
+    skip_dates = forms.CharField(
+        required=False,
+        help_text='Comma separated dates to leave out, e.g. 2025-12-26, 2026-01-02',
+    )
+
+    class Meta:
+        model = BookingSeries
+        fields = ['pitch', 'start_time', 'end_time', 'frequency', 'until', 'skip_dates']
+        widgets = {
+            'start_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+            'end_time': forms.DateTimeInput(attrs={'type': 'datetime-local', 'readonly': 'readonly'}),
+            'until': forms.DateInput(attrs={'type': 'date'}),
+        }
+        labels = {
+            'start_time': 'First session start',
+            'end_time': 'First session end',
+            'until': 'Repeat until',
+        }
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+
+        # Same pitch restriction as BookingForm, a series is just many bookings
+        bookable = get_policy().bookable(self.user.role)
+        self.fields['pitch'].queryset = Pitch.objects.filter(pk__in=bookable)
+
+    def clean_skip_dates(self):
+        value = self.cleaned_data.get('skip_dates') or ''
+        try:
+            return [date.fromisoformat(d.strip()).isoformat() for d in value.split(',') if d.strip()]
+        except ValueError:
+            raise forms.ValidationError('Enter dates as YYYY-MM-DD separated by commas.')
+
+    def clean(self):
+        cleaned = super().clean()
+        start, end, until = cleaned.get('start_time'), cleaned.get('end_time'), cleaned.get('until')
+        if start and end and not (start < end <= start + timedelta(days=1)):
+            self.add_error('end_time', 'Each session must end after it starts and last no more than a day.')
+        if start and until:
+            if until < start.date():
+                self.add_error('until', 'The series must end on or after the first session.')
+            else:
+                step = BookingSeries.FREQUENCY_DAYS.get(cleaned.get('frequency'), 7)
+                if (until - start.date()).days // step + 1 > self.MAX_OCCURRENCES:
+                    self.add_error('until', f'A series can contain at most {self.MAX_OCCURRENCES} sessions.')
+        return cleaned
+
+
+class UtilisationReportForm(forms.Form):
+    MAX_DAYS = 366 * 3
+
+    start = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    pitch = forms.ModelChoiceField(queryset=Pitch.objects.all(), required=False, empty_label='All pitches')
+    status = forms.MultipleChoiceField(
+        choices=Booking._meta.get_field('status').choices,
+        required=False,
+        widget=forms.CheckboxSelectMultiple,
+        help_text='Leave all unticked for every status.',
+    )
+
+    def clean(self):
+        cleaned = super().clean()
+        start, end = cleaned.get('start'), cleaned.get('end')
+        if start and end and not (start <= end <= start + timedelta(days=self.MAX_DAYS)):
+            self.add_error('end', 'The report must end on or after its start and cover at most three years.')
+        return cleaned
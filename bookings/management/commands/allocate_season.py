@@ -0,0 +1,63 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.allocation import BACKTRACK_LIMIT, plan_season
+from bookings.models import Pitch
+from teams.models import TrainingWindow
+
+DAYS = dict(TrainingWindow.WEEKDAY_CHOICES)
+
+
+class Command(BaseCommand):
+    help = (
+        "Allocate each team's weekly training sessions for a season. Prints the "
+        "plan; with --commit it is booked as weekly series."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", type=date.fromisoformat, help="First day of the season (YYYY-MM-DD).")
+        parser.add_argument("until", type=date.fromisoformat, help="Last day of the season (YYYY-MM-DD).")
+        parser.add_argument(
+            "--pitch", type=int, action="append", dest="pitches",
+            help="Pitch id to allocate on, repeat for more. Defaults to the main and astro pitches.",
+        )
+        parser.add_argument("--limit", type=int, default=BACKTRACK_LIMIT, help="Backtracking budget.")
+        parser.add_argument("--commit", action="store_true", help="Book the plan instead of only printing it.")
+        parser.add_argument("--user", help="Username the bookings are made as, required with --commit.")
+
+    def handle(self, *args, **options):
+        start, until = options["start"], options["until"]
+        if until < start:
+            raise CommandError("The season must end on or after its first day.")
+        user = None
+        if options["commit"]:
+            if not options["user"]:
+                raise CommandError("--commit needs --user.")
+            try:
+                user = get_user_model().objects.get(username=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user called {options['user']!r}.")
+        pitches = Pitch.objects.filter(pk__in=options["pitches"]) if options["pitches"] else None
+
+        plan = plan_season(start, until, pitches=pitches, limit=options["limit"])
+        for team, pitch, weekday, start_time, end_time in plan.sessions:
+            self.stdout.write(
+                f"{pitch.name:<20} {DAYS[weekday]:<10} {start_time:%H:%M}-{end_time:%H:%M}  {team}"
+            )
+        for team, missing in plan.unplaced.items():
+            self.stdout.write(self.style.WARNING(f"Could not place {missing} session(s) for {team}."))
+
+        if user is None:
+            self.stdout.write(f"Planned {len(plan.sessions)} session(s). Nothing was booked, use --commit to book them.")
+            return
+        try:
+            bookings = plan.book(user)
+        except ValidationError as error:
+            raise CommandError(f"Nothing was booked: {error.messages[0]}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Booked {len(bookings)} booking(s) across {len(plan.sessions)} weekly session(s)."
+        ))
+
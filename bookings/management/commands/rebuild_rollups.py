@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bookings.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the pitch utilisation rollups from the bookings."
+
+    def handle(self, *args, **options):
+        rows = rebuild()
+        self.stdout.write(f"Rebuilt {rows} utilisation row(s).")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bookings.services import send_approval_digests
+
+
+class Command(BaseCommand):
+    help = "Notify each approver of the upcoming bookings waiting on their decision."
+
+    def handle(self, *args, **options):
+        sent = send_approval_digests()
+        self.stdout.write(f"Sent pending-approval digests to {sent} approver(s).")
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+OVERLAP_CONSTRAINT = 'booking_no_overlap_approved'
+
+
+def add_overlap_constraint(apps, schema_editor):
+    # Only PostgreSQL can enforce interval exclusion, and only when the mode is switched on
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    if not getattr(settings, 'BOOKING_EXCLUSION_CONSTRAINT', False):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f'ALTER TABLE bookings_booking ADD CONSTRAINT {OVERLAP_CONSTRAINT} '
+        "EXCLUDE USING gist (pitch_id WITH =, tstzrange(start_time, end_time, '[)') WITH &&) "
+        "WHERE (status = 'approved')"
+    )
+
+
+def drop_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'ALTER TABLE bookings_booking DROP CONSTRAINT IF EXISTS {OVERLAP_CONSTRAINT}'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0003_alter_pitch_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['pitch', 'status', 'start_time', 'end_time'], name='booking_pitch_status_time_idx'),
+        ),
+        migrations.RunPython(add_overlap_constraint, drop_overlap_constraint),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_booking_start_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pitch',
+            name='schedule_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='pitch',
+            name='schedule_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:50
+
+from django.db import migrations, models
+from django.db.models import Q
+
+# The rules the booking views used to hard-code:
+# (category, role, can_book, on_submit, can_approve)
+DEFAULT_RULES = [
+    ('main', 'chairman', True, 'approve', True),
+    ('main', 'secretary', True, 'approve', True),
+    ('main', 'manager', True, 'approve_unless_conflict', False),
+    ('main', 'coach', True, 'approve_unless_conflict', False),
+    ('astro', 'manager', True, 'approve', True),
+    ('astro', 'chairman', True, 'pending', False),
+    ('astro', 'secretary', True, 'pending', False),
+    ('astro', 'coach', True, 'pending', False),
+    ('astro', '', True, 'pending', False),
+    ('other', 'chairman', True, 'pending', False),
+    ('other', 'secretary', True, 'pending', False),
+    ('other', 'manager', True, 'pending', False),
+    ('other', 'coach', True, 'pending', False),
+]
+
+
+def categorise_pitches(apps, schema_editor):
+    Pitch = apps.get_model('bookings', 'Pitch')
+    Pitch.objects.filter(name__icontains='astro').update(category='astro')
+    Pitch.objects.filter(~Q(name__icontains='astro'), name__icontains='main').update(category='main')
+    Pitch.objects.filter(category='').update(category='other')
+
+
+def create_default_rules(apps, schema_editor):
+    ApprovalRule = apps.get_model('bookings', 'ApprovalRule')
+    ApprovalRule.objects.bulk_create([
+        ApprovalRule(category=category, role=role, can_book=can_book, on_submit=on_submit, can_approve=can_approve)
+        for category, role, can_book, on_submit, can_approve in DEFAULT_RULES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_pitch_schedule_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pitch',
+            name='category',
+            field=models.CharField(blank=True, choices=[('main', 'Main pitch'), ('astro', 'Astro pitch'), ('other', 'Other')], help_text='Left blank, it is worked out from the name when the pitch is saved.', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='ApprovalRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('main', 'Main pitch'), ('astro', 'Astro pitch'), ('other', 'Other')], max_length=10)),
+                ('role', models.CharField(blank=True, help_text='Blank for the public.', max_length=20)),
+                ('can_book', models.BooleanField(default=True)),
+                ('on_submit', models.CharField(choices=[('pending', 'Wait for an approver'), ('approve', 'Approve straight away'), ('approve_unless_conflict', 'Approve unless it clashes with an approved booking')], default='pending', max_length=25)),
+                ('can_approve', models.BooleanField(default=False)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'role'), name='approval_rule_category_role_uniq')],
+            },
+        ),
+        migrations.RunPython(categorise_pitches, migrations.RunPython.noop),
+        migrations.RunPython(create_default_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_approval_policy'),
+        ('teams', '0003_team_weekly_hours_quota'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bookings', to='teams.team'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['team', 'start_time'], name='booking_team_start_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0009_booking_team'),
+        ('teams', '0003_team_weekly_hours_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookingseries',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='booking_series', to='teams.team'),
+        ),
+    ]
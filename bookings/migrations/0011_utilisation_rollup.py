@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_rollups(apps, schema_editor):
+    from bookings.rollups import rebuild
+    rebuild(
+        apps.get_model('bookings', 'Booking'),
+        apps.get_model('bookings', 'UtilisationRollup'),
+        using=schema_editor.connection.alias,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0010_bookingseries_team'),
+        ('teams', '0004_training_windows'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtilisationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('method', models.CharField(max_length=20)),
+                ('status', models.CharField(max_length=11)),
+                ('minutes', models.IntegerField(default=0)),
+                ('starts', models.IntegerField(default=0)),
+                ('pitch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bookings.pitch')),
+                ('team', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='teams.team')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='utilisation_date_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('team__isnull', False)), fields=('pitch', 'date', 'hour', 'team', 'method', 'status'), name='utilisation_team_bucket_uniq'), models.UniqueConstraint(condition=models.Q(('team__isnull', True)), fields=('pitch', 'date', 'hour', 'method', 'status'), name='utilisation_bucket_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,20 +1,215 @@
-from django.db import models
+from datetime import date, datetime, timedelta
+
+from django.db import models, transaction
 from django.conf import settings
+from django.dispatch import Signal
+from django.utils import timezone
+
+# Sent after a tracked QuerySet.update() with changes=[(old_state, booking), ...]
+bookings_bulk_updated = Signal()
+# Sent after QuerySet.delete() with snapshots=[{DELETED_FIELDS...}, ...]
+bookings_bulk_deleted = Signal()
+
+# Columns snapshotted when a booking is loaded so saves and bulk updates can be
+# diffed without re-reading the row
+TRACKED_FIELDS = ['id', 'status', 'pitch_id', 'start_time', 'end_time', 'team_id', 'method']
+# What a bulk delete reads up front to notify owners and re-check conflicts
+DELETED_FIELDS = TRACKED_FIELDS + ['created_by_id', 'pitch__name']
+
+
+class PitchQuerySet(models.QuerySet):
+    def delete(self):
+        # Remove the bookings through their bulk path first, so the cascade
+        # does not load and signal every booking one at a time
+        with transaction.atomic(using=self.db):
+            bookings, booking_rows = Booking.objects.filter(pitch__in=self).delete()
+            count, rows = super().delete()
+        return bookings + count, {**booking_rows, **rows}
 
 # Create your models here.
 class Pitch(models.Model):
+    class Category(models.TextChoices):
+        MAIN = 'main', 'Main pitch'
+        ASTRO = 'astro', 'Astro pitch'
+        OTHER = 'other', 'Other'
+
     name = models.CharField(max_length=100)
     description = models.CharField(max_length=255, blank=True)
     is_public = models.BooleanField(default=False)
+    # Decides who can book the pitch and who approves it, through ApprovalRule
+    category = models.CharField(
+        max_length=10, choices=Category.choices, blank=True,
+        help_text='Left blank, it is worked out from the name when the pitch is saved.',
+    )
+
+    # Bumped whenever any booking on the pitch changes, drives calendar feed ETags
+    schedule_version = models.PositiveIntegerField(default=0, editable=False)
+    schedule_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = PitchQuerySet.as_manager()
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        if not self.category:
+            self.category = guess_category(self.name)
+        super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic(using=using):
+            bookings, booking_rows = Booking.objects.filter(pitch=self).delete()
+            count, rows = super().delete(using=using, keep_parents=keep_parents)
+        return bookings + count, {**booking_rows, **rows}
     
     class Meta:
         verbose_name = "Pitch"
         verbose_name_plural = "Pitches"
 
 
+def guess_category(name):
+    name = name.lower()
+    if 'astro' in name:
+        return Pitch.Category.ASTRO
+    if 'main' in name:
+        return Pitch.Category.MAIN
+    return Pitch.Category.OTHER
+
+
+class ApprovalRule(models.Model):
+    # What one role may do on one category of pitch, compiled into
+    # bookings.policy.ApprovalPolicy. A missing rule means no booking and no approving
+    PUBLIC = ''  # role of visitors without an account or a role
+
+    class OnSubmit(models.TextChoices):
+        PENDING = 'pending', 'Wait for an approver'
+        APPROVE = 'approve', 'Approve straight away'
+        APPROVE_UNLESS_CONFLICT = 'approve_unless_conflict', 'Approve unless it clashes with an approved booking'
+
+    category = models.CharField(max_length=10, choices=Pitch.Category.choices)
+    role = models.CharField(max_length=20, blank=True, help_text='Blank for the public.')
+    can_book = models.BooleanField(default=True)
+    on_submit = models.CharField(max_length=25, choices=OnSubmit.choices, default=OnSubmit.PENDING)
+    can_approve = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'role'], name='approval_rule_category_role_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.role or 'public'} on {self.get_category_display()}"
+
+
+class BookingSeries(models.Model):
+    FREQUENCY_CHOICES = [
+        ('weekly', 'Weekly'),
+        ('fortnightly', 'Fortnightly'),
+    ]
+    FREQUENCY_DAYS = {'weekly': 7, 'fortnightly': 14}
+
+    pitch = models.ForeignKey(Pitch, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    # Passed on to every booking in the series
+    team = models.ForeignKey(
+        'teams.Team',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='booking_series'
+    )
+
+    # First occurrence, later ones repeat at the same time of day
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+
+    frequency = models.CharField(max_length=11, choices=FREQUENCY_CHOICES, default='weekly')
+    until = models.DateField()
+    # ISO formatted dates (YYYY-MM-DD) that should not be booked, e.g. bank holidays
+    skip_dates = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Booking Series"
+        verbose_name_plural = "Booking Series"
+
+    def __str__(self):
+        return f"{self.get_frequency_display()} {self.pitch.name} booking until {self.until:%Y-%m-%d}"
+
+    def occurrences(self):
+        # Step in local wall-clock time so a season keeps its slot across clock changes
+        step = timedelta(days=self.FREQUENCY_DAYS[self.frequency])
+        skip = {date.fromisoformat(d) for d in self.skip_dates}
+        first = timezone.localtime(self.start_time)
+        duration = self.end_time - self.start_time
+        day = first.date()
+        while day <= self.until:
+            if day not in skip:
+                start = timezone.make_aware(datetime.combine(day, first.time()))
+                yield start, start + duration
+            day += step
+
+
+class BookingQuerySet(models.QuerySet):
+    def overlapping(self, pitch, start_time, end_time):
+        # Half-open interval test, served by the (pitch, status, start_time, end_time) index
+        return self.filter(
+            pitch=pitch,
+            start_time__lt=end_time,
+            end_time__gt=start_time,
+        )
+
+    def approved(self):
+        return self.filter(status='approved')
+
+    def update(self, **kwargs):
+        # Bulk-aware path: status/time/pitch changes made with QuerySet.update()
+        # still reach the notification and conflict receivers, with one read
+        # before and one after the UPDATE however many rows are touched
+        if not {'status', 'pitch', 'pitch_id', 'start_time', 'end_time', 'team', 'team_id', 'method'} & kwargs.keys():
+            return super().update(**kwargs)
+        if self.query.is_sliced:
+            raise TypeError("Cannot update a query once a slice has been taken.")
+
+        with transaction.atomic(using=self.db):
+            before = {
+                row['id']: row
+                for row in self.select_for_update().values(*TRACKED_FIELDS)
+            }
+            if not before:
+                return 0
+            rows = self.model.objects.filter(pk__in=before)
+            count = rows.update_untracked(**kwargs)
+            after = rows.select_related('pitch', 'created_by')
+            bookings_bulk_updated.send(
+                sender=self.model,
+                changes=[(before[booking.pk], booking) for booking in after],
+            )
+        return count
+
+    def update_untracked(self, **kwargs):
+        # Plain UPDATE for callers that handle notifications themselves
+        return super().update(**kwargs)
+
+    def delete(self):
+        # Bulk path: one read snapshots every row, then the per-instance delete
+        # receivers stand aside (they see this queryset as the origin) and
+        # bookings_bulk_deleted handles notifications and conflicts in one go
+        with transaction.atomic(using=self.db):
+            snapshots = list(self.values(*DELETED_FIELDS))
+            if not snapshots:
+                return 0, {}
+            deleted = super().delete()
+            bookings_bulk_deleted.send(sender=self.model, snapshots=snapshots)
+        return deleted
+
+
 class Booking(models.Model):
     pitch = models.ForeignKey(Pitch, on_delete=models.CASCADE)
 
@@ -49,5 +244,99 @@ class Booking(models.Model):
 
     submitted_at = models.DateTimeField(auto_now_add=True)
 
+    series = models.ForeignKey(
+        BookingSeries,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='bookings'
+    )
+
+    # The team the pitch time is for, counted against its weekly quota
+    team = models.ForeignKey(
+        'teams.Team',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='bookings'
+    )
+
+    objects = BookingQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_state = instance.tracked_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        refreshed = self.tracked_state()
+        if fields is not None:
+            names = {self._meta.get_field(f).attname for f in fields}
+            refreshed = {f: v for f, v in refreshed.items() if f in names}
+        self._loaded_state = {**getattr(self, '_loaded_state', {}), **refreshed}
+
+    def tracked_state(self):
+        # Read from __dict__ so deferred fields are never fetched
+        return {f: self.__dict__[f] for f in TRACKED_FIELDS if f in self.__dict__}
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['pitch', 'status', 'start_time', 'end_time'],
+                name='booking_pitch_status_time_idx',
+            ),
+            models.Index(fields=['start_time', 'id'], name='booking_start_id_idx'),
+            # Weekly quota sums and team schedules
+            models.Index(fields=['team', 'start_time'], name='booking_team_start_idx'),
+        ]
+
     def __str__(self):
         return f"{self.pitch.name} booking on {self.start_time.strftime('%Y-%m-%d %H:%M')}"
+
+
+# The predicates of UtilisationRollup's partial unique constraints as SQL. The
+# upsert in bookings.rollups repeats them after ON CONFLICT to pick each index
+ROLLUP_BUCKET_CONDITIONS = {
+    'utilisation_team_bucket_uniq': '"team_id" IS NOT NULL',
+    'utilisation_bucket_uniq': '"team_id" IS NULL',
+}
+
+
+class UtilisationRollup(models.Model):
+    # Booked minutes per pitch, local date and hour, team, method and status,
+    # kept in step with every booking write by bookings.rollups so reports
+    # never have to scan the bookings themselves
+    pitch = models.ForeignKey(Pitch, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    team = models.ForeignKey('teams.Team', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    method = models.CharField(max_length=20)
+    status = models.CharField(max_length=11)
+
+    minutes = models.IntegerField(default=0)
+    # Bookings starting in this hour, so counts add up without double counting long bookings
+    starts = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Targets of the incremental upsert, one for each side of the nullable team.
+            # Keep ROLLUP_BUCKET_CONDITIONS in step with the conditions
+            models.UniqueConstraint(
+                fields=['pitch', 'date', 'hour', 'team', 'method', 'status'],
+                condition=models.Q(team__isnull=False),
+                name='utilisation_team_bucket_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['pitch', 'date', 'hour', 'method', 'status'],
+                condition=models.Q(team__isnull=True),
+                name='utilisation_bucket_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='utilisation_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.pitch_id} {self.date} {self.hour:02}:00 {self.status}: {self.minutes} min"
@@ -0,0 +1,106 @@
+from asgiref.local import Local
+
+from config.cache import bump, get_version
+
+from .models import ApprovalRule, Pitch
+
+# Who can book which pitch, what a new booking's status is and who approves
+# it, answered from lookup tables built once per process from the
+# ApprovalRule rows and pitch categories. Saving or deleting either bumps a
+# shared version key once the change commits (see bookings.signals), and
+# every process rebuilds its tables on its next lookup. With the
+# DatabaseCache reading the version is a query, so a request reads it once
+# (see the request receivers in bookings.signals); outside a request every
+# lookup does.
+
+NAMESPACE = 'policy'
+
+_compiled = None  # (version, ApprovalPolicy)
+
+# .version is the version the current request read, None before its first
+# lookup and unset outside a request
+_request = Local()
+
+
+class ApprovalPolicy:
+    def __init__(self, pitches, rules):
+        # pitches: {pitch_id: (name, category)}
+        self.pitch_names = {pk: name for pk, (name, _) in pitches.items()}
+        by_category = {(rule.category, rule.role): rule for rule in rules}
+        self._on_submit = {}
+        bookable = {}
+        approvable = {}
+        approver_roles = {}
+        for pk, (_, category) in pitches.items():
+            for role in {rule.role for rule in rules}:
+                rule = by_category.get((category, role))
+                if rule is None:
+                    continue
+                if rule.can_book:
+                    bookable.setdefault(role, set()).add(pk)
+                    self._on_submit[role, pk] = rule.on_submit
+                if rule.can_approve:
+                    approvable.setdefault(role, set()).add(pk)
+                    approver_roles.setdefault(pk, set()).add(role)
+        self._bookable = {role: frozenset(pks) for role, pks in bookable.items()}
+        self._approvable = {role: frozenset(pks) for role, pks in approvable.items()}
+        # {pitch_id: roles that approve it}
+        self.approver_roles = {pk: frozenset(roles) for pk, roles in approver_roles.items()}
+
+    def bookable(self, role):
+        return self._bookable.get(role or ApprovalRule.PUBLIC, frozenset())
+
+    def approvable(self, role):
+        return self._approvable.get(role or ApprovalRule.PUBLIC, frozenset())
+
+    def can_approve(self, role, pitch_id):
+        return pitch_id in self.approvable(role)
+
+    def initial_status(self, role, pitch_id, has_conflict):
+        # `has_conflict` is a callable so the conflict lookup only runs for the
+        # rules that actually depend on it
+        on_submit = self._on_submit.get((role or ApprovalRule.PUBLIC, pitch_id))
+        if on_submit == ApprovalRule.OnSubmit.APPROVE:
+            return 'approved'
+        if on_submit == ApprovalRule.OnSubmit.APPROVE_UNLESS_CONFLICT:
+            return 'conflicting' if has_conflict() else 'approved'
+        return 'pending'
+
+
+def compile_policy():
+    pitches = {pk: (name, category) for pk, name, category in Pitch.objects.values_list('pk', 'name', 'category')}
+    return ApprovalPolicy(pitches, list(ApprovalRule.objects.all()))
+
+
+def get_policy():
+    global _compiled
+    version = getattr(_request, 'version', None)
+    if version is None:
+        version = get_version(NAMESPACE)
+        if hasattr(_request, 'version'):
+            _request.version = version
+    if _compiled is None or _compiled[0] != version:
+        _compiled = (version, compile_policy())
+    return _compiled[1]
+
+
+def start_request():
+    _request.version = None
+
+
+def finish_request():
+    if hasattr(_request, 'version'):
+        del _request.version
+
+
+def _forget():
+    global _compiled
+    _compiled = None
+    if hasattr(_request, 'version'):
+        _request.version = None
+
+
+def invalidate_policy():
+    # Not before the commit: a lookup in between would rebuild from the
+    # uncommitted rows and keep them under the old version
+    bump(NAMESPACE, after=_forget)
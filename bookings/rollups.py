@@ -0,0 +1,219 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import ExtractIsoWeekDay, TruncMonth
+from django.utils import timezone
+
+from teams.models import Team, TrainingWindow
+from .models import ROLLUP_BUCKET_CONDITIONS, Booking, UtilisationRollup
+from .policy import get_policy
+
+# Pitch utilisation rollups. Every booking write already funnels its (old, new)
+# snapshots through bookings_changed, which hands them here: each snapshot is
+# cut into the local-time hours it covers and the difference is added to the
+# matching UtilisationRollup rows with one upsert per side of the nullable team.
+# Hours are stepped on the UTC clock, so the repeated hour when the clocks go
+# back simply adds to the same local bucket.
+
+KEY_FIELDS = ['pitch_id', 'date', 'hour', 'team_id', 'method', 'status']
+STATE_FIELDS = ['pitch_id', 'start_time', 'end_time', 'team_id', 'method', 'status']
+UPSERT_BATCH_SIZE = 500
+
+
+def buckets(state):
+    """
+    Yield (key, minutes, starts) for every hour the booking touches, `starts`
+    being 1 for the hour it starts in.
+    """
+    start, end = state['start_time'], state['end_time']
+    if end <= start:
+        return
+    hour = start.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        following = hour + timedelta(hours=1)
+        local = timezone.localtime(hour)
+        key = (state['pitch_id'], local.date(), local.hour, state['team_id'], state['method'], state['status'])
+        minutes = int((min(end, following) - max(start, hour)).total_seconds() // 60)
+        yield key, minutes, int(hour <= start < following)
+        hour = following
+
+
+def deltas(changes):
+    # {key: [minutes, starts]} to add for the given (old, new) snapshots, zero entries dropped
+    totals = {}
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if not state:
+                continue
+            for key, minutes, starts in buckets(state):
+                total = totals.setdefault(key, [0, 0])
+                total[0] += sign * minutes
+                total[1] += sign * starts
+    return {key: total for key, total in totals.items() if total != [0, 0]}
+
+
+def _conflict_target(connection, name):
+    constraint = next(c for c in UtilisationRollup._meta.constraints if c.name == name)
+    qn = connection.ops.quote_name
+    columns = ", ".join(qn(UtilisationRollup._meta.get_field(f).column) for f in constraint.fields)
+    return f"({columns}) WHERE {ROLLUP_BUCKET_CONDITIONS[name]}"
+
+
+def apply(totals):
+    """
+    Add {key: [minutes, starts]} to the rollups with INSERT ... ON CONFLICT DO
+    UPDATE. Keys go in sorted order so concurrent writers lock rows alike.
+    """
+    if not totals:
+        return
+    connection = transaction.get_connection()
+    qn = connection.ops.quote_name
+    table = qn(UtilisationRollup._meta.db_table)
+    fields = [UtilisationRollup._meta.get_field(name) for name in KEY_FIELDS + ['minutes', 'starts']]
+    columns = ", ".join(qn(f.column) for f in fields)
+    increments = ", ".join(f"{qn(c)} = {table}.{qn(c)} + EXCLUDED.{qn(c)}" for c in ['minutes', 'starts'])
+
+    for with_team, name in ((True, 'utilisation_team_bucket_uniq'), (False, 'utilisation_bucket_uniq')):
+        rows = sorted((key, total) for key, total in totals.items() if (key[3] is not None) == with_team)
+        target = _conflict_target(connection, name)
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            placeholders = ", ".join(f"({', '.join(['%s'] * len(fields))})" for _ in batch)
+            params = [
+                field.get_db_prep_save(value, connection)
+                for key, total in batch
+                for field, value in zip(fields, key + tuple(total))
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) VALUES {placeholders} "
+                    f"ON CONFLICT {target} DO UPDATE SET {increments}",
+                    params,
+                )
+
+
+def record(changes):
+    apply(deltas(changes))
+
+
+def fold_team(team_id):
+    # A deleted team's bookings keep their hours but lose the team, so move its
+    # totals onto the no-team rows before its own rows cascade away
+    totals = {}
+    rows = UtilisationRollup.objects.filter(team_id=team_id).values_list(*KEY_FIELDS, 'minutes', 'starts')
+    for pitch_id, day, hour, _, method, status, minutes, starts in rows:
+        total = totals.setdefault((pitch_id, day, hour, None, method, status), [0, 0])
+        total[0] += minutes
+        total[1] += starts
+    apply(totals)
+
+
+# Recomputes the whole table in one statement. Hours come from generate_series
+# on UTC timestamps, as in buckets(), and minutes are floored per booking and
+# hour before summing so the result matches the incremental path exactly.
+REBUILD_SQL = """
+INSERT INTO {rollup} (pitch_id, date, hour, team_id, method, status, minutes, starts)
+SELECT b.pitch_id, (h AT TIME ZONE %(tz)s)::date, EXTRACT(HOUR FROM h AT TIME ZONE %(tz)s)::int,
+       b.team_id, b.method, b.status,
+       SUM(FLOOR(EXTRACT(EPOCH FROM LEAST(b.end_time, h + INTERVAL '1 hour') - GREATEST(b.start_time, h)) / 60))::int,
+       SUM(CASE WHEN b.start_time >= h AND b.start_time < h + INTERVAL '1 hour' THEN 1 ELSE 0 END)
+FROM {booking} b
+CROSS JOIN LATERAL generate_series(
+    date_trunc('hour', b.start_time AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    b.end_time - INTERVAL '1 microsecond',
+    INTERVAL '1 hour'
+) AS h
+WHERE b.end_time > b.start_time
+GROUP BY 1, 2, 3, 4, 5, 6
+"""
+
+
+def rebuild(booking_model=Booking, rollup_model=UtilisationRollup, using=None):
+    """
+    Throw the rollups away and recompute them from the bookings. Takes the
+    models so migrations can pass their historical ones. Returns the row count.
+    """
+    using = using or router.db_for_write(rollup_model)
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        rollup_model.objects.using(using).all().delete()
+        if connection.vendor == 'postgresql':
+            sql = REBUILD_SQL.format(
+                rollup=connection.ops.quote_name(rollup_model._meta.db_table),
+                booking=connection.ops.quote_name(booking_model._meta.db_table),
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, {'tz': settings.TIME_ZONE})
+                return cursor.rowcount
+        # Elsewhere, one streamed pass over the bookings and a bulk insert
+        rows = booking_model.objects.using(using).filter(end_time__gt=F('start_time')).values(*STATE_FIELDS)
+        totals = deltas((None, row) for row in rows.iterator(chunk_size=2000))
+        rollup_model.objects.using(using).bulk_create(
+            [
+                rollup_model(**dict(zip(KEY_FIELDS, key)), minutes=minutes, starts=starts)
+                for key, (minutes, starts) in totals.items()
+            ],
+            batch_size=UPSERT_BATCH_SIZE,
+        )
+        return len(totals)
+
+
+def _rows(rollups, *group):
+    return rollups.values(*group).annotate(minutes=Sum('minutes'), starts=Sum('starts')).order_by(*group)
+
+
+def _entries(rows, field, label):
+    return [
+        {'label': label(row[field]), 'hours': row['minutes'] / 60, 'bookings': row['starts']}
+        for row in rows
+        if row['minutes'] or row['starts']
+    ]
+
+
+def report(start, end, pitch=None, statuses=()):
+    """
+    Booked hours and booking counts between two dates (inclusive), broken down
+    by pitch, hour of day, weekday, month, team, method and status, read from
+    the rollups with one GROUP BY per breakdown.
+    """
+    rollups = UtilisationRollup.objects.filter(date__range=(start, end))
+    if pitch is not None:
+        rollups = rollups.filter(pitch=pitch)
+    # Every status is still shown in the status breakdown
+    by_status = _rows(rollups, 'status')
+    if statuses:
+        rollups = rollups.filter(status__in=statuses)
+
+    pitch_names = get_policy().pitch_names
+    opening_hour, closing_hour = settings.PITCH_OPENING_HOURS
+    open_hours = ((end - start).days + 1) * (closing_hour - opening_hour)
+    by_pitch = _entries(_rows(rollups, 'pitch_id'), 'pitch_id', lambda pk: pitch_names.get(pk, 'Deleted pitch'))
+    for entry in by_pitch:
+        entry['occupancy'] = 100 * entry['hours'] / open_hours if open_hours else 0
+    by_pitch.sort(key=lambda entry: entry['label'])
+
+    by_team = list(_rows(rollups, 'team_id'))
+    teams = Team.objects.in_bulk([row['team_id'] for row in by_team if row['team_id']])
+    by_team = _entries(by_team, 'team_id', lambda pk: str(teams[pk]) if pk in teams else 'No team')
+    by_team.sort(key=lambda entry: -entry['hours'])
+
+    methods = dict(Booking._meta.get_field('method').choices)
+    status_names = dict(Booking._meta.get_field('status').choices)
+    weekdays = dict(TrainingWindow.WEEKDAY_CHOICES)
+    return {
+        'by_pitch': by_pitch,
+        'by_hour': _entries(_rows(rollups, 'hour'), 'hour', lambda hour: f'{hour:02}:00'),
+        'by_weekday': _entries(
+            _rows(rollups.annotate(weekday=ExtractIsoWeekDay('date')), 'weekday'),
+            'weekday', lambda day: weekdays[day - 1],
+        ),
+        'by_month': _entries(
+            _rows(rollups.annotate(month=TruncMonth('date')), 'month'),
+            'month', lambda month: f'{month:%B %Y}',
+        ),
+        'by_team': by_team,
+        'by_method': _entries(_rows(rollups, 'method'), 'method', lambda method: methods.get(method, method)),
+        'by_status': _entries(by_status, 'status', lambda status: status_names.get(status, status)),
+    }
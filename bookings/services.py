@@ -0,0 +1,401 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DurationField, Exists, F, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+from .availability import invalidate_availability, merge_intervals
+from .models import TRACKED_FIELDS, Booking, Pitch
+from .policy import get_policy
+from . import rollups
+from config.cache import bump
+from teams.models import Team
+from tasks.queue import enqueue
+from alerts.services import (
+    for_conflicts_flagged_many, for_pending_approvals_many, for_series_created, for_status_changed_many,
+)
+
+OVERLAP_CONSTRAINT = 'booking_no_overlap_approved'
+
+# Statuses that are still waiting on an approver and so can be flagged as conflicting
+OPEN_STATUSES = ['pending', 'conflicting']
+
+CORE_FIELDS = ['pitch_id', 'start_time', 'end_time']
+
+APPROVERS_CACHE_KEY = 'bookings:approvers'
+APPROVERS_CACHE_TIMEOUT = 60 * 60
+
+
+def _users_by_role():
+    # {role: [user ids]} for active users, cached and cleared by the user
+    # save/delete receivers in bookings.signals
+    users = cache.get(APPROVERS_CACHE_KEY)
+    if users is None:
+        users = {}
+        rows = get_user_model().objects.filter(is_active=True).exclude(role='').order_by('pk')
+        for pk, role in rows.values_list('pk', 'role'):
+            users.setdefault(role, []).append(pk)
+        cache.set(APPROVERS_CACHE_KEY, users, APPROVERS_CACHE_TIMEOUT)
+    return users
+
+
+def approvers_by_pitch():
+    # {pitch_id: [user ids]} of the active users whose role approves each pitch
+    users = _users_by_role()
+    return {
+        pitch_id: sorted(pk for role in roles for pk in users.get(role, []))
+        for pitch_id, roles in get_policy().approver_roles.items()
+    }
+
+
+def invalidate_approvers():
+    cache.delete(APPROVERS_CACHE_KEY)
+
+
+def week_bounds(moment):
+    # Monday 00:00 up to the next Monday 00:00, local time
+    day = timezone.localtime(moment).date()
+    monday = day - timedelta(days=day.weekday())
+    return (
+        timezone.make_aware(datetime.combine(monday, time.min)),
+        timezone.make_aware(datetime.combine(monday + timedelta(days=7), time.min)),
+    )
+
+
+def team_hours_booked(team_id, week_start, week_end, exclude=None):
+    # One SUM(end_time - start_time) over the (team, start_time) index; rejected bookings don't count
+    bookings = Booking.objects.filter(
+        team_id=team_id, start_time__gte=week_start, start_time__lt=week_end,
+    ).exclude(status='rejected')
+    if exclude:
+        bookings = bookings.exclude(pk=exclude)
+    total = bookings.aggregate(
+        total=Sum(F('end_time') - F('start_time'), output_field=DurationField())
+    )['total']
+    return total or timedelta()
+
+
+def quota_error(team, start_time, end_time, exclude=None):
+    # Why a booking would take the team past its weekly quota, or None if it fits
+    if team.weekly_hours_quota is None:
+        return None
+    booked = team_hours_booked(team.pk, *week_bounds(start_time), exclude=exclude)
+    if booked + (end_time - start_time) <= timedelta(hours=team.weekly_hours_quota):
+        return None
+    hours = booked.total_seconds() / 3600
+    return f'{team} already has {hours:g} of its {team.weekly_hours_quota} weekly hours booked that week.'
+
+
+def team_weekly_hours(team_ids, start, end):
+    # {(team_id, local Monday): time booked} for bookings starting in [start, end),
+    # one GROUP BY for any number of teams and weeks; rejected bookings don't count
+    rows = (
+        Booking.objects
+        .filter(team_id__in=team_ids, start_time__gte=start, start_time__lt=end)
+        .exclude(status='rejected')
+        .annotate(week=TruncWeek('start_time'))
+        .order_by()
+        .values_list('team_id', 'week')
+        .annotate(total=Sum(F('end_time') - F('start_time'), output_field=DurationField()))
+    )
+    return {(team_id, timezone.localtime(week).date()): total for team_id, week, total in rows}
+
+
+def series_quota_error(team, occurrences):
+    # quota_error for every week a series' occurrences fall in, or None if they all fit
+    if team.weekly_hours_quota is None:
+        return None
+    adding = {}
+    for start_time, end_time in occurrences:
+        monday = week_bounds(start_time)[0].date()
+        adding[monday] = adding.get(monday, timedelta()) + (end_time - start_time)
+    booked = team_weekly_hours([team.pk], week_bounds(occurrences[0][0])[0], week_bounds(occurrences[-1][0])[1])
+    quota = timedelta(hours=team.weekly_hours_quota)
+    for monday, hours in sorted(adding.items()):
+        already = booked.get((team.pk, monday), timedelta())
+        if already + hours > quota:
+            return (
+                f'{team} already has {already.total_seconds() / 3600:g} of its {team.weekly_hours_quota} '
+                f'weekly hours booked in the week of {monday:%d %b %Y}.'
+            )
+    return None
+
+
+def snapshot(booking):
+    return {f: getattr(booking, f) for f in TRACKED_FIELDS}
+
+
+def has_approved_conflict(booking):
+    conflicts = Booking.objects.overlapping(
+        booking.pitch_id, booking.start_time, booking.end_time
+    ).approved()
+    if booking.pk:
+        conflicts = conflicts.exclude(pk=booking.pk)
+    return conflicts.exists()
+
+
+def save_booking(booking):
+    # With the PostgreSQL exclusion constraint enabled an overlapping approval is
+    # rejected by the database, in which case the booking is kept as conflicting
+    try:
+        with transaction.atomic():
+            booking.save()
+    except IntegrityError as exc:
+        if booking.status != 'approved' or OVERLAP_CONSTRAINT not in str(exc):
+            raise
+        booking.status = 'conflicting'
+        booking.save()
+
+
+def _approved_overlap():
+    return Exists(Booking.objects.approved().filter(
+        pitch_id=OuterRef('pitch_id'),
+        start_time__lt=OuterRef('end_time'),
+        end_time__gt=OuterRef('start_time'),
+    ))
+
+
+def approvable_together(bookings):
+    # Ids of the given bookings that can all be approved at once: none overlaps
+    # an approved booking or an earlier one of the same selection. One query
+    rows = (
+        bookings
+        .annotate(has_conflict=_approved_overlap())
+        .order_by('pitch_id', 'start_time', 'pk')
+        .values_list('pk', 'pitch_id', 'start_time', 'end_time', 'has_conflict')
+    )
+    ids = []
+    taken_until = {}
+    for pk, pitch_id, start_time, end_time, has_conflict in rows:
+        if has_conflict or start_time < taken_until.get(pitch_id, start_time):
+            continue
+        ids.append(pk)
+        taken_until[pitch_id] = end_time
+    return ids
+
+
+# Recompute pending/conflicting state for open bookings overlapping any of the
+# given (pitch_id, start_time, end_time) windows with one SELECT and one UPDATE.
+# Returns {pk: new_status} for the rows that changed.
+def refresh_conflicts(windows, exclude=(), flagged=None, transitions=None):
+    # `flagged`, if given, collects {pitch_id: [booking ids]} newly marked conflicting,
+    # `transitions` the (old, new) snapshots of the rows it flips, else they go
+    # straight to the rollups
+    window_q = Q()
+    for pitch_id, start_time, end_time in windows:
+        window_q |= Q(pitch_id=pitch_id, start_time__lt=end_time, end_time__gt=start_time)
+    if not window_q:
+        return {}
+
+    candidates = (
+        Booking.objects
+        .filter(window_q, status__in=OPEN_STATUSES)
+        .exclude(pk__in=exclude)
+        .annotate(has_conflict=_approved_overlap())
+        .select_related('pitch')
+        .only('id', 'status', 'pitch_id', 'start_time', 'end_time', 'team_id', 'method', 'created_by_id', 'pitch__name')
+    )
+
+    changed = {}
+    notifications = []
+    for booking in candidates:
+        new_status = 'conflicting' if booking.has_conflict else 'pending'
+        if new_status != booking.status:
+            changed[booking.pk] = new_status
+            notifications.append((booking, booking.status, new_status))
+    if not changed:
+        return changed
+
+    to_conflicting = [pk for pk, status in changed.items() if status == 'conflicting']
+    if flagged is not None:
+        for booking, _, new_status in notifications:
+            if new_status == 'conflicting':
+                flagged.setdefault(booking.pitch_id, []).append(booking.pk)
+    # The candidate rows already give us the before/after state, so skip the tracked update
+    Booking.objects.filter(pk__in=changed).update_untracked(
+        status=Case(
+            When(pk__in=to_conflicting, then=Value('conflicting')),
+            default=Value('pending'),
+        )
+    )
+    flips = [
+        (snapshot(booking), {**snapshot(booking), 'status': new_status})
+        for booking, _, new_status in notifications
+    ]
+    if transitions is None:
+        rollups.record(flips)
+    else:
+        transitions.extend(flips)
+    for_status_changed_many(notifications)
+    return changed
+
+
+# Single entry point for keeping derived booking state in step with writes.
+# `changes` is an iterable of (old, new) snapshots, old is None for creates and
+# new is None for deletes.
+def bookings_changed(changes):
+    changes = list(changes)
+    approved_windows = []
+    moved_windows = []
+    exclude = set()
+    pitch_ids = set()
+    flagged = {}
+    for old, new in changes:
+        pitch_ids.update(state['pitch_id'] for state in (old, new) if state)
+        if new and new['status'] == 'conflicting' and (not old or old['status'] != 'conflicting'):
+            flagged.setdefault(new['pitch_id'], []).append(new['id'])
+        old_approved = bool(old) and old['status'] == 'approved'
+        new_approved = bool(new) and new['status'] == 'approved'
+        moved = bool(old and new) and any(old[f] != new[f] for f in CORE_FIELDS)
+
+        # Anything whose status was just decided by a person keeps that status
+        if not old or not new or old['status'] != new['status']:
+            exclude.add((new or old)['id'])
+
+        if old_approved and (not new_approved or moved):
+            approved_windows.append((old['pitch_id'], old['start_time'], old['end_time']))
+        if new_approved and (not old_approved or moved):
+            approved_windows.append((new['pitch_id'], new['start_time'], new['end_time']))
+        if moved and not new_approved:
+            # A moved open booking may have walked into (or out of) an approved slot
+            moved_windows.append((new['pitch_id'], new['start_time'], new['end_time']))
+
+    bump_schedule_versions(pitch_ids)
+    bump('bookings')
+    invalidate_availability(approved_windows)
+    transitions = []
+    changed = refresh_conflicts(
+        approved_windows + moved_windows, exclude=exclude, flagged=flagged, transitions=transitions,
+    )
+    # One rollup upsert covers the writes and the conflict flips they caused
+    rollups.record(changes + transitions)
+    if flagged:
+        # Approver fan-out is left to the task worker
+        enqueue('bookings.alert_approvers', sorted(flagged))
+    return changed
+
+
+def alert_approvers(flagged):
+    # One CONFLICT_FLAG per approver and pitch, listing every upcoming booking
+    # on that pitch that is currently conflicting, however many were just flagged
+    if not flagged:
+        return
+    approvers = approvers_by_pitch()
+    conflicts = {}
+    rows = (
+        Booking.objects
+        .filter(pitch_id__in=flagged, status='conflicting', end_time__gte=timezone.now())
+        .order_by('start_time', 'id')
+        .values_list('pitch_id', 'id')
+    )
+    for pitch_id, booking_id in rows:
+        conflicts.setdefault(pitch_id, []).append(booking_id)
+    pitch_names = get_policy().pitch_names
+    for_conflicts_flagged_many(
+        (approver_id, pitch_names[pitch_id], booking_ids)
+        for pitch_id, booking_ids in conflicts.items()
+        for approver_id in approvers.get(pitch_id, [])
+    )
+
+
+def bump_schedule_versions(pitch_ids):
+    if pitch_ids:
+        Pitch.objects.filter(pk__in=pitch_ids).update(
+            schedule_version=F('schedule_version') + 1,
+            schedule_changed_at=timezone.now(),
+        )
+
+
+def _overlapping_indexes(occurrences, intervals):
+    # Both lists are sorted and `intervals` is already merged, so a single
+    # forward sweep finds every occurrence that hits an approved interval
+    hits = set()
+    j = 0
+    for index, (start_time, end_time) in enumerate(occurrences):
+        while j < len(intervals) and intervals[j][1] <= start_time:
+            j += 1
+        if j < len(intervals) and intervals[j][0] < end_time:
+            hits.add(index)
+    return hits
+
+
+def create_series(series, user):
+    # Expand a recurring series and book every occurrence in one pass: a single
+    # query for the pitch's approved intervals, one bulk insert and one summary
+    # notification instead of a round trip per week. A series for a team is
+    # checked against its weekly quota with the team row locked, as in
+    # BookingForm.save_within_quota, and raises ValidationError if any week
+    # would go over
+    occurrences = list(series.occurrences())
+    if not occurrences:
+        return []
+
+    approved = merge_intervals(
+        Booking.objects
+        .overlapping(series.pitch_id, occurrences[0][0], occurrences[-1][1])
+        .approved()
+        .values_list('start_time', 'end_time')
+    )
+    clashes = _overlapping_indexes(occurrences, approved)
+
+    policy = get_policy()
+    bookings = []
+    for index, (start_time, end_time) in enumerate(occurrences):
+        bookings.append(Booking(
+            pitch=series.pitch,
+            series=series,
+            team_id=series.team_id,
+            created_by=user,
+            name=user.get_full_name(),
+            email=user.email,
+            start_time=start_time,
+            end_time=end_time,
+            method='web',
+            status=policy.initial_status(user.role, series.pitch_id, lambda: index in clashes),
+        ))
+
+    with transaction.atomic():
+        if series.team_id:
+            team = Team.objects.select_for_update().get(pk=series.team_id)
+            error = series_quota_error(team, occurrences)
+            if error:
+                raise ValidationError(error)
+        Booking.objects.bulk_create(bookings)
+        bookings_changed((None, snapshot(booking)) for booking in bookings)
+        for_series_created(series, bookings)
+    return bookings
+
+
+def pending_approval_counts(now=None):
+    # {pitch_id: {status: count}} for upcoming open bookings, one GROUP BY query
+    counts = {}
+    rows = (
+        Booking.objects
+        .filter(status__in=OPEN_STATUSES, start_time__gte=now or timezone.now())
+        .order_by()
+        .values_list('pitch_id', 'status')
+        .annotate(count=Count('id'))
+    )
+    for pitch_id, status, count in rows:
+        counts.setdefault(pitch_id, {})[status] = count
+    return counts
+
+
+def send_approval_digests(now=None):
+    """
+    Send each approver one summary of the open bookings on their pitches.
+    Returns the number of approvers with something waiting.
+    """
+    counts = pending_approval_counts(now)
+    pitch_names = get_policy().pitch_names
+    digests = {}
+    for pitch_id, approver_ids in approvers_by_pitch().items():
+        if pitch_id in counts:
+            for approver_id in approver_ids:
+                digests.setdefault(approver_id, {})[pitch_names[pitch_id]] = counts[pitch_id]
+    for_pending_approvals_many(digests.items(), period=settings.APPROVAL_DIGEST_PERIOD)
+    return len(digests)
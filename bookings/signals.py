@@ -1,8 +1,19 @@
-from django.db.models.signals import pre_save, post_save, pre_delete
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.conf import settings
 from django.dispatch import receiver
-from .models import Booking
+from .models import (
+    TRACKED_FIELDS, ApprovalRule, Booking, BookingQuerySet, Pitch, bookings_bulk_deleted, bookings_bulk_updated,
+)
+from config.cache import bump
+from .policy import finish_request, invalidate_policy, start_request
+from .rollups import fold_team
+from .services import bookings_changed, invalidate_approvers, snapshot
+from .tasks import notify_deleted
+from teams.models import Team
 from alerts.services import (
-    for_booking_created, for_status_changed, for_booking_updated, for_booking_deleted
+    for_booking_created, for_status_changed, for_booking_updated,
+    for_status_changed_many, for_booking_updated_many,
 )
 
 CORE_FIELDS = ["pitch_id", "start_time", "end_time"]
@@ -10,44 +21,71 @@ CORE_FIELDS = ["pitch_id", "start_time", "end_time"]
 def _diff_core(old, new):
     changed = []
     for f in CORE_FIELDS:
-        if getattr(old, f) != getattr(new, f):
+        if old[f] != getattr(new, f):
             changed.append("pitch" if f == "pitch_id" else f)
     return changed
 
 @receiver(pre_save, sender=Booking)
 def booking_pre_save(sender, instance: Booking, **kwargs):
-    if instance.pk:
-        try:
-            instance._old = sender.objects.only(
-                "status", "pitch_id", "start_time", "end_time"
-            ).get(pk=instance.pk)
-        except sender.DoesNotExist:
-            instance._old = None
-    else:
-        instance._old = None
+    instance._old = None
+    if not instance.pk:
+        return
+
+    # Instances loaded from the database carry a snapshot of the tracked
+    # columns (see Booking.from_db), so the diff needs no extra query
+    loaded = getattr(instance, "_loaded_state", {})
+    if len(loaded) == len(TRACKED_FIELDS):
+        instance._old = dict(loaded)
+        return
+
+    # Hand-built or partially deferred instances fall back to reading the row
+    instance._old = sender.objects.filter(pk=instance.pk).values(*TRACKED_FIELDS).first()
 
 @receiver(post_save, sender=Booking)
 def booking_post_save(sender, instance: Booking, created, **kwargs):
     if created:
         for_booking_created(instance)
+        _sync_conflicts(instance, None)
         return
 
     old = getattr(instance, "_old", None)
     if not old:
         return
 
-    if old.status != instance.status:
-        for_status_changed(instance, old.status, instance.status)
+    if old["status"] != instance.status:
+        for_status_changed(instance, old["status"], instance.status)
 
     changed_core = _diff_core(old, instance)
     if changed_core:
         for_booking_updated(instance, changed_core)
 
+    _sync_conflicts(instance, old)
+
     if hasattr(instance, "_old"):
         delattr(instance, "_old")
 
+@receiver(bookings_bulk_updated, sender=Booking)
+def booking_bulk_updated(sender, changes, **kwargs):
+    for_status_changed_many(
+        (booking, old["status"], booking.status)
+        for old, booking in changes
+        if old["status"] != booking.status
+    )
+    for_booking_updated_many(
+        (booking, changed_core)
+        for old, booking in changes
+        if (changed_core := _diff_core(old, booking))
+    )
+    bookings_changed((old, snapshot(booking)) for old, booking in changes)
+
+def _deleted_in_bulk(origin):
+    # BookingQuerySet.delete() reports through bookings_bulk_deleted instead
+    return isinstance(origin, BookingQuerySet)
+
 @receiver(pre_delete, sender=Booking)
-def booking_pre_delete(sender, instance: Booking, **kwargs):
+def booking_pre_delete(sender, instance: Booking, origin=None, **kwargs):
+    if _deleted_in_bulk(origin):
+        return
     snap = {
         "id": instance.id,
         "user_id": instance.created_by_id,
@@ -56,5 +94,74 @@ def booking_pre_delete(sender, instance: Booking, **kwargs):
         "end_time": instance.end_time,
         "status": instance.status,
     }
-    for_booking_deleted(snap)
+    # Owners are told by the task worker, once the delete has committed
+    if snap["user_id"]:
+        notify_deleted.enqueue([snap])
+
+@receiver(post_delete, sender=Booking)
+def booking_post_delete(sender, instance: Booking, origin=None, **kwargs):
+    if _deleted_in_bulk(origin):
+        return
+    bookings_changed([(snapshot(instance), None)])
+
+@receiver(bookings_bulk_deleted, sender=Booking)
+def booking_bulk_deleted(sender, snapshots, **kwargs):
+    owned = [
+        {
+            "id": row["id"],
+            "user_id": row["created_by_id"],
+            "pitch_name": row["pitch__name"],
+            "start_time": row["start_time"],
+            "end_time": row["end_time"],
+            "status": row["status"],
+        }
+        for row in snapshots
+        if row["created_by_id"]
+    ]
+    if owned:
+        notify_deleted.enqueue(owned)
+    bookings_changed(({f: row[f] for f in TRACKED_FIELDS}, None) for row in snapshots)
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, update_fields=None, **kwargs):
+    # A role or active flag may have changed, so rebuild the approver lookup
+    invalidate_approvers()
+    # Names and roles show up in cached pages, a login's last_login stamp doesn't
+    if update_fields is None or set(update_fields) != {"last_login"}:
+        bump("users")
+
+@receiver(post_save, sender=Pitch)
+@receiver(post_delete, sender=Pitch)
+@receiver(post_save, sender=ApprovalRule)
+@receiver(post_delete, sender=ApprovalRule)
+def policy_changed(sender, **kwargs):
+    # Every process, this one included, rebuilds once the change commits
+    invalidate_policy()
+    if sender is Pitch:
+        bump("pitches")
+
+@receiver(request_started)
+def policy_request_started(sender, **kwargs):
+    start_request()
+
+@receiver(request_finished)
+def policy_request_finished(sender, **kwargs):
+    finish_request()
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def team_changed(sender, **kwargs):
+    bump("teams")
+
+@receiver(pre_delete, sender=Team)
+def team_pre_delete(sender, instance, **kwargs):
+    # The team's bookings are about to lose their team, carry its utilisation with them
+    fold_team(instance.pk)
 
+def _sync_conflicts(instance, old):
+    # Re-evaluate the bookings around this one and keep the in-memory status current
+    changed = bookings_changed([(old, snapshot(instance))])
+    if instance.pk in changed:
+        instance.status = changed[instance.pk]
+    instance._loaded_state = instance.tracked_state()
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from django.utils import timezone
+
+from alerts.services import for_bookings_deleted
+from tasks.queue import task
+from . import rollups, services
+
+
+@task("bookings.send_approval_digests", max_attempts=1)
+def send_approval_digests():
+    services.send_approval_digests(timezone.now())
+
+
+@task("bookings.alert_approvers")
+def alert_approvers(pitch_ids):
+    # Reads the conflicts as they stand when the worker gets to it
+    services.alert_approvers(set(pitch_ids))
+
+
+@task("bookings.rebuild_rollups", max_attempts=1)
+def rebuild_rollups():
+    # Catches any drift, e.g. from a booking deleted through a stale instance
+    rollups.rebuild()
+
+
+@task("bookings.notify_deleted")
+def notify_deleted(snapshots):
+    for snap in snapshots:
+        for key in ("start_time", "end_time"):
+            snap[key] = datetime.fromisoformat(snap[key])
+    for_bookings_deleted(snapshots)
@@ -1,9 +1,27 @@
 
-from django.test import TestCase
+from datetime import datetime, time
+from io import StringIO
+from unittest import skipUnless
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from bookings.models import Booking, Pitch
+from bookings.allocation import plan_season
+from bookings.availability import merge_intervals
+from bookings.feeds import _fold, feed_token
+from bookings.models import ApprovalRule, Booking, BookingSeries, Pitch, UtilisationRollup
+from bookings.forms import BookingForm
+from bookings.policy import get_policy
+from bookings.rollups import rebuild
+from bookings.services import create_series, has_approved_conflict, pending_approval_counts, save_booking, team_hours_booked, week_bounds
+from tasks.queue import run_pending
+from teams.models import Team, TrainingWindow
 
 User = get_user_model()
 
@@ -525,3 +543,1195 @@ class PitchListViewTests(TestCase):
         self.client.login(username='normal', password='pass1234')
         response = self.client.get(reverse('pitch_list'))
         self.assertNotContains(response, 'Astro Pitch')
+
+
+class BookingOverlapIndexTests(TestCase):
+    def setUp(self):
+        """Set up a pitch with an approved booking and neighbouring bookings"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        self.approved = Booking.objects.create(
+            pitch=self.pitch,
+            name='Approved',
+            start_time=self.start,
+            end_time=self.start + timezone.timedelta(hours=1),
+            status='approved'
+        )
+        Booking.objects.create(
+            pitch=self.pitch,
+            name='Pending',
+            start_time=self.start + timezone.timedelta(hours=2),
+            end_time=self.start + timezone.timedelta(hours=3),
+            status='pending'
+        )
+
+    def _candidate(self, offset_minutes):
+        start = self.start + timezone.timedelta(minutes=offset_minutes)
+        return Booking(pitch=self.pitch, start_time=start, end_time=start + timezone.timedelta(hours=1))
+
+    def test_overlapping_approved_booking_is_a_conflict(self):
+        """Test a booking overlapping an approved booking is detected"""
+        self.assertTrue(has_approved_conflict(self._candidate(30)))
+
+    def test_adjacent_booking_is_not_a_conflict(self):
+        """Test intervals are half-open so back to back bookings do not conflict"""
+        self.assertFalse(has_approved_conflict(self._candidate(60)))
+
+    def test_pending_booking_is_not_a_conflict(self):
+        """Test only approved bookings count as conflicts"""
+        self.assertFalse(has_approved_conflict(self._candidate(150)))
+
+    def test_booking_does_not_conflict_with_itself(self):
+        """Test an existing approved booking is not its own conflict"""
+        self.assertFalse(has_approved_conflict(self.approved))
+
+    def test_overlap_query_uses_composite_index(self):
+        """Test the conflict query is planned against the composite overlap index"""
+        candidate = self._candidate(30)
+        queryset = Booking.objects.overlapping(
+            candidate.pitch_id, candidate.start_time, candidate.end_time
+        ).approved()
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn('booking_pitch_status_time_idx', plan)
+
+    @skipUnless(
+        connection.vendor == 'postgresql' and settings.BOOKING_EXCLUSION_CONSTRAINT,
+        'Exclusion constraint mode is only available on PostgreSQL'
+    )
+    def test_exclusion_constraint_downgrades_overlapping_approval(self):
+        """Test the database rejects an overlapping approval and it is saved as conflicting"""
+        booking = self._candidate(30)
+        booking.name = 'Overlap'
+        booking.status = 'approved'
+        save_booking(booking)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'conflicting')
+
+
+class ConflictMaintenanceTests(TestCase):
+    def setUp(self):
+        """Set up an approved booking with pending bookings around it"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.other_pitch = Pitch.objects.create(name='Astro Pitch')
+        self.chairman = User.objects.create_user(username='chairman', password='pass1234', role='chairman')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        self.approved = self._book(self.pitch, 0, 'approved')
+        self.conflicting = self._book(self.pitch, 0, 'conflicting')
+        self.pending = self._book(self.pitch, 3, 'pending')
+        self.elsewhere = self._book(self.other_pitch, 3, 'pending')
+
+    def _book(self, pitch, hour, status):
+        start = self.start + timezone.timedelta(hours=hour)
+        return Booking.objects.create(
+            pitch=pitch, name='Booker', start_time=start,
+            end_time=start + timezone.timedelta(hours=1), status=status
+        )
+
+    def _status(self, booking):
+        booking.refresh_from_db()
+        return booking.status
+
+    def test_rejecting_approved_booking_clears_conflicts(self):
+        """Test withdrawing the approval returns its conflicts to pending"""
+        self.approved.status = 'rejected'
+        self.approved.save()
+        self.assertEqual(self._status(self.conflicting), 'pending')
+
+    def test_approving_conflicting_booking_keeps_others_flagged(self):
+        """Test approving one of the conflicting bookings does not clear the other approval's conflicts"""
+        other = self._book(self.pitch, 0, 'pending')
+        self.client.login(username='chairman', password='pass1234')
+        self.client.post(reverse('booking_approve', kwargs={'booking_id': self.conflicting.id}))
+        self.assertEqual(self._status(self.conflicting), 'approved')
+        self.assertEqual(self._status(other), 'conflicting')
+
+    def test_deleting_approved_booking_clears_conflicts(self):
+        """Test deleting the approved booking returns its conflicts to pending"""
+        self.approved.delete()
+        self.assertEqual(self._status(self.conflicting), 'pending')
+
+    def test_approving_booking_flags_overlapping_pending(self):
+        """Test approving a booking flags open bookings in the same slot only"""
+        overlapping = self._book(self.pitch, 3, 'pending')
+        self.client.login(username='chairman', password='pass1234')
+        self.client.post(reverse('booking_approve', kwargs={'booking_id': self.pending.id}))
+        self.assertEqual(self._status(self.pending), 'approved')
+        self.assertEqual(self._status(overlapping), 'conflicting')
+        self.assertEqual(self._status(self.elsewhere), 'pending')
+
+    def test_moving_approved_booking_clears_old_slot(self):
+        """Test moving the approved booking re-evaluates both old and new slots"""
+        self.approved.start_time += timezone.timedelta(hours=3)
+        self.approved.end_time += timezone.timedelta(hours=3)
+        self.approved.save()
+        self.assertEqual(self._status(self.conflicting), 'pending')
+        self.assertEqual(self._status(self.pending), 'conflicting')
+
+    def test_moving_pending_booking_into_approved_slot_flags_it(self):
+        """Test an open booking moved onto an approved slot becomes conflicting"""
+        self.pending.start_time = self.approved.start_time
+        self.pending.end_time = self.approved.end_time
+        self.pending.save()
+        self.assertEqual(self.pending.status, 'conflicting')
+        self.assertEqual(self._status(self.pending), 'conflicting')
+
+    def test_refresh_cost_is_bounded_by_the_window(self):
+        """Test a status change costs the same number of queries however many bookings exist"""
+        for hour in range(10, 40):
+            self._book(self.pitch, hour, 'pending')
+        # UPDATE, pitch version bump, candidate SELECT, bulk UPDATE, rollup upsert
+        with self.assertNumQueries(5):
+            self.approved.status = 'rejected'
+            self.approved.save()
+
+
+class ChangeTrackingTests(TestCase):
+    def setUp(self):
+        """Set up an approved booking owned by a coach and one flagged against it"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        self.approved = self._book('approved')
+        self.pending = self._book('conflicting')
+
+    def _book(self, status):
+        return Booking.objects.create(
+            pitch=self.pitch, name='Booker', created_by=self.coach, status=status,
+            start_time=self.start, end_time=self.start + timezone.timedelta(hours=1)
+        )
+
+    def test_loaded_booking_saves_without_refetching(self):
+        """Test a booking read from the database is diffed against its loaded state"""
+        booking = Booking.objects.get(pk=self.approved.pk)
+        with CaptureQueriesContext(connection) as queries:
+            booking.status = 'rejected'
+            booking.save()
+        # The first statement is the write itself, not a read of the old row
+        self.assertTrue(queries[0]['sql'].startswith('UPDATE "bookings_booking"'))
+
+    def test_unsaved_changes_are_not_part_of_the_snapshot(self):
+        """Test refresh_from_db resets the snapshot to the stored values"""
+        booking = Booking.objects.get(pk=self.pending.pk)
+        booking.status = 'rejected'
+        booking.refresh_from_db()
+        self.assertEqual(booking._loaded_state['status'], 'conflicting')
+        self.assertEqual(booking.tracked_state(), booking._loaded_state)
+
+    def test_queryset_update_notifies_and_refreshes_conflicts(self):
+        """Test a bulk status update sends status notifications and re-evaluates conflicts"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.filter(pk=self.approved.pk).update(status='rejected')
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, 'pending')
+        payloads = list(self.coach.notifications.filter(type='status_changed').values_list('payload', flat=True))
+        self.assertIn({'old_status': 'approved', 'new_status': 'rejected'}, payloads)
+        self.assertIn({'old_status': 'conflicting', 'new_status': 'pending'}, payloads)
+
+    def test_untracked_update_fields_skip_the_signal(self):
+        """Test updates that touch no tracked column do not refresh conflicts"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                Booking.objects.filter(pk=self.pending.pk).update(name='Renamed')
+        self.assertFalse(self.coach.notifications.filter(type='booking_updated').exists())
+
+
+class BulkDeleteTests(TestCase):
+    def setUp(self):
+        """Set up a pitch with a coach's upcoming and past bookings"""
+        self.pitch = Pitch.objects.create(name='Astro Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+
+    def _book(self, hour, status='pending', pitch=None):
+        start = self.start + timezone.timedelta(hours=hour)
+        return Booking.objects.create(
+            pitch=pitch or self.pitch, name='Booker', created_by=self.coach, status=status,
+            start_time=start, end_time=start + timezone.timedelta(hours=1)
+        )
+
+    def _delete_pitch_queries(self, bookings):
+        pitch = Pitch.objects.create(name='Astro Pitch')
+        for hour in range(bookings):
+            self._book(hour, pitch=pitch)
+        with CaptureQueriesContext(connection) as queries:
+            pitch.delete()
+        return len(queries)
+
+    def test_pitch_delete_cost_does_not_grow_with_bookings(self):
+        """Test retiring a pitch costs the same number of queries for 3 or 30 bookings"""
+        self.assertEqual(self._delete_pitch_queries(3), self._delete_pitch_queries(30))
+
+    def test_pitch_delete_notifies_each_owner_once(self):
+        """Test the cascade removes the bookings and sends one deletion notice per booking"""
+        for hour in range(4):
+            self._book(hour)
+        with self.captureOnCommitCallbacks(execute=True):
+            Pitch.objects.filter(pk=self.pitch.pk).delete()
+            self.assertEqual(run_pending(), (1, 0))
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.coach.notifications.filter(type='booking_deleted').count(), 4)
+
+    @override_settings(NOTIFY_PAST_BOOKING_DELETIONS=False)
+    def test_past_bookings_can_be_deleted_quietly(self):
+        """Test no notice is sent for finished bookings when configured"""
+        self._book(-72)
+        self._book(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pitch.delete()
+            run_pending()
+        self.assertEqual(self.coach.notifications.filter(type='booking_deleted').count(), 1)
+
+    def test_queryset_delete_clears_conflicts(self):
+        """Test deleting the approved booking in bulk returns its conflicts to pending"""
+        approved = self._book(0, 'approved')
+        conflicting = self._book(0, 'conflicting')
+        Booking.objects.filter(pk=approved.pk).delete()
+        conflicting.refresh_from_db()
+        self.assertEqual(conflicting.status, 'pending')
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        """Set up a pitch with overlapping approved bookings on one day"""
+        cache.clear()
+        self.pitch = Pitch.objects.create(name='Astro Pitch')
+        self.day = (timezone.now() + timezone.timedelta(days=2)).date()
+        self.day_start = timezone.make_aware(datetime.combine(self.day, time.min))
+        self._book(18, 19, 'approved')
+        self._book(18, 20, 'approved')
+        self._book(12, 13, 'pending')
+
+    def _book(self, start_hour, end_hour, status):
+        return Booking.objects.create(
+            pitch=self.pitch, name='Booker', status=status,
+            start_time=self.day_start + timezone.timedelta(hours=start_hour),
+            end_time=self.day_start + timezone.timedelta(hours=end_hour),
+        )
+
+    def _get(self, **params):
+        params.setdefault('pitch', self.pitch.id)
+        params.setdefault('start', self.day.isoformat())
+        return self.client.get(reverse('pitch_availability'), params)
+
+    def test_merge_intervals_folds_overlapping_and_touching(self):
+        """Test the sweep-line merge joins overlapping and back to back intervals"""
+        self.assertEqual(
+            merge_intervals([(5, 6), (1, 3), (2, 4), (4, 5), (8, 9)]),
+            [(1, 6), (8, 9)]
+        )
+
+    def test_busy_and_free_slots_for_day(self):
+        """Test approved bookings are merged into busy slots and the rest of opening hours is free"""
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        day = response.json()['days'][0]
+        at = lambda hour: (self.day_start + timezone.timedelta(hours=hour)).isoformat()
+        self.assertEqual(day['busy'], [{'start': at(18), 'end': at(20)}])
+        self.assertEqual(day['free'], [{'start': at(9), 'end': at(18)}, {'start': at(20), 'end': at(22)}])
+
+    def test_repeat_requests_are_served_from_cache(self):
+        """Test a cached week only costs the pitch lookup and one read of the shared cache"""
+        self._get(end=(self.day + timezone.timedelta(days=6)).isoformat())
+        with self.assertNumQueries(2) as queries:
+            response = self._get(end=(self.day + timezone.timedelta(days=6)).isoformat())
+        self.assertFalse([q for q in queries.captured_queries if 'bookings_booking' in q['sql']])
+        self.assertEqual(len(response.json()['days']), 7)
+
+    def test_approval_invalidates_cached_day(self):
+        """Test approving a booking drops the cached availability for its day"""
+        self._get()
+        pending = Booking.objects.get(status='pending')
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.status = 'approved'
+            pending.save()
+        busy = self._get().json()['days'][0]['busy']
+        self.assertEqual(len(busy), 2)
+
+    def test_invalid_parameters_rejected(self):
+        """Test missing or oversized ranges return a 400"""
+        self.assertEqual(self._get(start='not-a-date').status_code, 400)
+        self.assertEqual(self._get(end=(self.day + timezone.timedelta(days=40)).isoformat()).status_code, 400)
+        self.assertEqual(self._get(pitch=999).status_code, 404)
+
+
+class BookingSeriesTests(TestCase):
+    def setUp(self):
+        """Set up a coach, a public user and a Main pitch with one approved booking"""
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.public_user = User.objects.create_user(username='public', password='pass1234')
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        Booking.objects.create(
+            pitch=self.pitch, name='Existing', status='approved',
+            start_time=self.start + timezone.timedelta(weeks=2),
+            end_time=self.start + timezone.timedelta(weeks=2, hours=1),
+        )
+
+    def _post(self, weeks, **extra):
+        data = {
+            'pitch': self.pitch.id,
+            'start_time': self.start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (self.start + timezone.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'frequency': 'weekly',
+            'until': (self.start + timezone.timedelta(weeks=weeks - 1)).date().isoformat(),
+        }
+        data.update(extra)
+        return self.client.post(reverse('create_booking_series'), data)
+
+    def test_occurrences_respect_frequency_and_skip_dates(self):
+        """Test a fortnightly series steps two weeks and leaves out skipped dates"""
+        series = BookingSeries(
+            pitch=self.pitch, start_time=self.start, end_time=self.start + timezone.timedelta(hours=1),
+            frequency='fortnightly', until=(self.start + timezone.timedelta(weeks=6)).date(),
+            skip_dates=[(self.start + timezone.timedelta(weeks=2)).date().isoformat()],
+        )
+        starts = [start for start, end in series.occurrences()]
+        self.assertEqual(starts, [self.start + timezone.timedelta(weeks=w) for w in (0, 4, 6)])
+
+    def test_coach_series_applies_rules_per_occurrence(self):
+        """Test each session is approved unless it clashes with an approved booking"""
+        self.client.login(username='coach', password='pass1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._post(weeks=4)
+        self.assertRedirects(response, reverse('booking_list'))
+        series = BookingSeries.objects.get()
+        statuses = list(series.bookings.order_by('start_time').values_list('status', flat=True))
+        self.assertEqual(statuses, ['approved', 'approved', 'conflicting', 'approved'])
+        self.assertEqual(self.coach.notifications.count(), 1)
+
+    def test_query_count_does_not_grow_with_series_length(self):
+        """Test booking a season costs the same number of queries as booking a month"""
+        other_pitch = Pitch.objects.create(name='Main Pitch 2')
+        Booking.objects.create(
+            pitch=other_pitch, name='Existing', status='approved',
+            start_time=self.start + timezone.timedelta(weeks=2),
+            end_time=self.start + timezone.timedelta(weeks=2, hours=1),
+        )
+        self.client.login(username='coach', password='pass1234')
+        cache.clear()
+        with CaptureQueriesContext(connection) as short:
+            self._post(weeks=4, pitch=other_pitch.id)
+        cache.clear()
+        with CaptureQueriesContext(connection) as season:
+            self._post(weeks=30)
+        self.assertEqual(len(short.captured_queries), len(season.captured_queries))
+
+    def test_skip_dates_must_be_valid(self):
+        """Test badly formatted skip dates are reported on the form"""
+        self.client.login(username='coach', password='pass1234')
+        response = self._post(weeks=4, skip_dates='next tuesday')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Enter dates as YYYY-MM-DD separated by commas.')
+
+    def test_series_only_offers_bookable_pitches(self):
+        """Test a pitch the approval rules close to coaches cannot be booked as a series"""
+        rule = ApprovalRule.objects.get(category='main', role='coach')
+        rule.can_book = False
+        rule.save()
+        self.client.login(username='coach', password='pass1234')
+        self.assertNotContains(self.client.get(reverse('create_booking_series')), 'Main Pitch')
+        response = self._post(weeks=4)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pitch', response.context['form'].errors)
+        self.assertFalse(BookingSeries.objects.exists())
+
+    def test_user_without_role_cannot_book_series(self):
+        """Test registered users without a club role are refused"""
+        self.client.login(username='public', password='pass1234')
+        response = self._post(weeks=4)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(BookingSeries.objects.exists())
+
+
+class BookingListTests(TestCase):
+    def setUp(self):
+        """Set up pitches, a user and more than a page of upcoming bookings"""
+        self.user = User.objects.create_user(username='coach', password='pass1234', role='coach', first_name='Cora')
+        self.main = Pitch.objects.create(name='Main Pitch')
+        self.astro = Pitch.objects.create(name='Astro Pitch')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        for hour in range(30):
+            self._book(self.main if hour % 2 else self.astro, hour, 'approved' if hour % 3 else 'pending')
+        self._book(self.main, -48, 'approved')
+        self.client.login(username='coach', password='pass1234')
+
+    def _book(self, pitch, hour, status):
+        start = self.start + timezone.timedelta(hours=hour)
+        return Booking.objects.create(
+            pitch=pitch, name='Booker', created_by=self.user, status=status,
+            start_time=start, end_time=start + timezone.timedelta(hours=1)
+        )
+
+    def test_first_page_is_limited_and_ordered(self):
+        """Test only upcoming bookings are listed, in start order, one page at a time"""
+        response = self.client.get(reverse('booking_list'))
+        bookings = list(response.context['bookings'])
+        self.assertEqual(len(bookings), 25)
+        self.assertEqual(bookings[0].start_time, self.start)
+        self.assertTrue(response.context['page_obj'].has_next)
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+    def test_cursor_walks_forwards_and_back(self):
+        """Test the later and earlier cursors return adjacent pages"""
+        first = self.client.get(reverse('booking_list')).context['page_obj']
+        second = self.client.get(reverse('booking_list'), {'after': first.next_cursor}).context['page_obj']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next)
+        back = self.client.get(reverse('booking_list'), {'before': second.previous_cursor}).context['page_obj']
+        self.assertEqual([b.id for b in back], [b.id for b in first])
+
+    def test_server_side_filters(self):
+        """Test pitch and status filters are applied in the query"""
+        response = self.client.get(reverse('booking_list'), {'pitch': self.main.id, 'status': 'pending'})
+        bookings = list(response.context['bookings'])
+        self.assertEqual(len(bookings), 5)
+        self.assertTrue(all(b.pitch_id == self.main.id and b.status == 'pending' for b in bookings))
+
+    def test_date_filter_limits_range(self):
+        """Test the date range filter only returns bookings on the chosen days"""
+        day = (self.start + timezone.timedelta(days=1)).date()
+        response = self.client.get(reverse('booking_list'), {'date_from': day, 'date_to': day})
+        self.assertTrue(all(timezone.localtime(b.start_time).date() == day for b in response.context['bookings']))
+
+    def test_query_count_is_flat(self):
+        """Test rendering the table does not query per row"""
+        # Sets up the policy and the cache versions, leaving both measured tables uncached
+        self.client.get(reverse('booking_list'), {'status': 'approved'})
+        with CaptureQueriesContext(connection) as full_page:
+            self.client.get(reverse('booking_list'))
+        with CaptureQueriesContext(connection) as filtered:
+            self.client.get(reverse('booking_list'), {'status': 'pending', 'pitch': self.main.id})
+        self.assertEqual(len(full_page.captured_queries), len(filtered.captured_queries))
+
+    def test_invalid_cursor_returns_404(self):
+        """Test a tampered cursor is rejected"""
+        response = self.client.get(reverse('booking_list'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_repeat_render_skips_booking_query(self):
+        """Test a cached table is served without reading the bookings"""
+        self.client.get(reverse('booking_list'))
+        with CaptureQueriesContext(connection) as repeat:
+            response = self.client.get(reverse('booking_list'))
+        self.assertFalse([q for q in repeat.captured_queries if 'bookings_booking' in q['sql']])
+        self.assertContains(response, 'id="bookings_table"')
+
+    def test_booking_change_refreshes_cached_table(self):
+        """Test a status change shows up in the next render of a cached table"""
+        self.client.get(reverse('booking_list'), {'status': 'pending'})
+        booking = Booking.objects.filter(status='pending').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'rejected'
+            booking.save()
+        response = self.client.get(reverse('booking_list'), {'status': 'pending'})
+        self.assertEqual(len(response.context['bookings']), 9)
+        self.assertNotContains(response, f'href="{reverse("booking_detail", args=[booking.id])}"')
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        """Set up a pitch, a coach and an approver with some bookings"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.chairman = User.objects.create_user(username='chairman', password='pass1234', role='chairman')
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        self.approved = Booking.objects.create(
+            pitch=self.pitch, name='Coach, Senior; Training', created_by=self.coach, status='approved',
+            start_time=start, end_time=start + timezone.timedelta(hours=1)
+        )
+        self.pending = Booking.objects.create(
+            pitch=self.pitch, name='Public Booker', status='pending',
+            start_time=start + timezone.timedelta(hours=2), end_time=start + timezone.timedelta(hours=3)
+        )
+
+    def _content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_pitch_feed_lists_approved_bookings(self):
+        """Test the pitch feed streams a calendar with only approved bookings"""
+        response = self.client.get(reverse('pitch_feed', kwargs={'pk': self.pitch.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = self._content(response)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn(f'UID:booking-{self.approved.id}@bailebeag', body)
+        self.assertNotIn(f'UID:booking-{self.pending.id}@bailebeag', body)
+
+    def test_unchanged_feed_returns_304_without_reading_bookings(self):
+        """Test a matching ETag is answered from the pitch change counter alone"""
+        url = reverse('pitch_feed', kwargs={'pk': self.pitch.pk})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_booking_change_changes_etag(self):
+        """Test any booking change on the pitch bumps the feed ETag"""
+        url = reverse('pitch_feed', kwargs={'pk': self.pitch.pk})
+        etag = self.client.get(url)['ETag']
+        self.pending.status = 'approved'
+        self.pending.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_user_feed_uses_signed_token(self):
+        """Test the personal feed shows the user's bookings and rejects forged tokens"""
+        response = self.client.get(reverse('user_feed', kwargs={'token': feed_token(self.coach, 'user')}))
+        body = self._content(response)
+        self.assertIn('SUMMARY:Main Pitch (Approved)', body)
+        forged = self.client.get(reverse('user_feed', kwargs={'token': 'forged'}))
+        self.assertEqual(forged.status_code, 404)
+        wrong_kind = self.client.get(reverse('user_feed', kwargs={'token': feed_token(self.coach, 'approver')}))
+        self.assertEqual(wrong_kind.status_code, 404)
+
+    def test_approver_feed_lists_open_bookings(self):
+        """Test the approver feed lists pending bookings on the approver's pitch with escaped text"""
+        response = self.client.get(reverse('approver_feed', kwargs={'token': feed_token(self.chairman, 'approver')}))
+        body = self._content(response)
+        self.assertIn(f'UID:booking-{self.pending.id}@bailebeag', body)
+        self.assertIn('SUMMARY:Pending: Public Booker', body)
+        self.assertNotIn(f'UID:booking-{self.approved.id}@bailebeag', body)
+
+    def test_long_lines_are_folded(self):
+        """Test lines over 75 octets are folded with a leading space"""
+        folded = _fold('SUMMARY:' + 'x' * 100)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in folded.split('\r\n')))
+        self.assertIn('\r\n ', folded)
+
+
+class BulkApprovalTests(TestCase):
+    def setUp(self):
+        """Set up approvers and a batch of open bookings on each pitch"""
+        self.astro = Pitch.objects.create(name='Astro Pitch')
+        self.main = Pitch.objects.create(name='Main Pitch')
+        self.manager = User.objects.create_user(username='manager', password='pass1234', role='manager')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        self.astro_bookings = [self._book(self.astro, hour, 'pending') for hour in range(6)]
+        self.main_booking = self._book(self.main, 0, 'pending')
+
+    def _book(self, pitch, hour, status):
+        start = self.start + timezone.timedelta(hours=hour)
+        return Booking.objects.create(
+            pitch=pitch, name='Booker', created_by=self.coach, status=status,
+            start_time=start, end_time=start + timezone.timedelta(hours=1)
+        )
+
+    def _post(self, bookings, action='approve'):
+        return self.client.post(reverse('booking_bulk_update'), {
+            'action': action, 'booking_ids': [b.id for b in bookings],
+        })
+
+    def test_manager_bulk_approves_astro_bookings(self):
+        """Test every selected open booking is approved and its owner notified in one batch"""
+        self.client.login(username='manager', password='pass1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._post(self.astro_bookings)
+        self.assertRedirects(response, reverse('booking_list'))
+        self.assertEqual(Booking.objects.filter(pitch=self.astro, status='approved').count(), 6)
+        self.assertEqual(self.coach.notifications.filter(type='status_changed').count(), 6)
+
+    def test_bulk_reject_skips_bookings_already_decided(self):
+        """Test bookings that are no longer open are left alone"""
+        decided = self.astro_bookings[0]
+        decided.status = 'approved'
+        decided.save()
+        self.client.login(username='manager', password='pass1234')
+        self._post(self.astro_bookings, action='reject')
+        decided.refresh_from_db()
+        self.assertEqual(decided.status, 'approved')
+        self.assertEqual(Booking.objects.filter(pitch=self.astro, status='rejected').count(), 5)
+
+    def test_bulk_action_outside_approver_pitch_is_denied(self):
+        """Test a selection that includes another pitch's booking is refused as a whole"""
+        self.client.login(username='manager', password='pass1234')
+        response = self._post(self.astro_bookings + [self.main_booking])
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Booking.objects.filter(status='approved').exists())
+
+    def test_non_approver_cannot_bulk_approve(self):
+        """Test coaches are sent to login by the approver check"""
+        self.client.login(username='coach', password='pass1234')
+        response = self._post(self.astro_bookings)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Booking.objects.filter(status='approved').exists())
+
+    def _assert_overlaps_left_conflicting(self):
+        approved = self._book(self.astro, 0, 'approved')
+        conflicting = Booking.objects.get(pk=self.astro_bookings[0].pk)
+        clash = self._book(self.astro, 2, 'pending')
+        self.client.login(username='manager', password='pass1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._post(self.astro_bookings + [clash])
+        self.assertRedirects(response, reverse('booking_list'))
+        statuses = dict(Booking.objects.filter(pitch=self.astro).values_list('pk', 'status'))
+        self.assertEqual(statuses[approved.pk], 'approved')
+        self.assertEqual(statuses[conflicting.pk], 'conflicting')
+        self.assertEqual(statuses[self.astro_bookings[2].pk], 'approved')
+        self.assertEqual(statuses[clash.pk], 'conflicting')
+        self.assertEqual(sum(status == 'approved' for status in statuses.values()), 6)
+
+    @override_settings(BOOKING_EXCLUSION_CONSTRAINT=True)
+    def test_exclusion_mode_only_approves_bookings_that_fit(self):
+        """Test bookings overlapping an approval or each other are left conflicting"""
+        self._assert_overlaps_left_conflicting()
+
+    @skipUnless(
+        connection.vendor == 'postgresql' and settings.BOOKING_EXCLUSION_CONSTRAINT,
+        'Exclusion constraint mode is only available on PostgreSQL'
+    )
+    def test_exclusion_constraint_accepts_bulk_approval(self):
+        """Test the database constraint accepts what a bulk approval writes"""
+        self._assert_overlaps_left_conflicting()
+
+    def test_query_count_does_not_grow_with_selection(self):
+        """Test approving six bookings costs the same as approving two"""
+        self.client.login(username='manager', password='pass1234')
+        get_policy()
+        with CaptureQueriesContext(connection) as few:
+            self._post(self.astro_bookings[:2])
+        with CaptureQueriesContext(connection) as many:
+            self._post(self.astro_bookings[2:])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+
+class ApprovalDigestTests(TestCase):
+    def setUp(self):
+        """Set up approvers for each pitch and a mix of open and decided bookings"""
+        self.main = Pitch.objects.create(name='Main Pitch')
+        self.astro = Pitch.objects.create(name='Astro Pitch')
+        self.chairman = User.objects.create_user(username='chairman', password='pass1234', role='chairman')
+        self.secretary = User.objects.create_user(username='secretary', password='pass1234', role='secretary')
+        self.manager = User.objects.create_user(username='manager', password='pass1234', role='manager')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        for hour, status in enumerate(['pending', 'pending', 'conflicting', 'approved']):
+            self._book(self.main, hour, status)
+        self._book(self.astro, 0, 'pending')
+        self._book(self.astro, -48, 'pending')
+
+    def _book(self, pitch, hour, status):
+        start = self.start + timezone.timedelta(hours=hour)
+        return Booking.objects.create(
+            pitch=pitch, name='Booker', status=status,
+            start_time=start, end_time=start + timezone.timedelta(hours=1)
+        )
+
+    def _send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            out = StringIO()
+            call_command('send_approval_digests', stdout=out)
+        return out.getvalue()
+
+    def test_counts_come_from_one_grouped_query(self):
+        """Test open upcoming bookings are counted per pitch and status in one query"""
+        with self.assertNumQueries(1):
+            counts = pending_approval_counts()
+        self.assertEqual(counts, {
+            self.main.pk: {'pending': 2, 'conflicting': 1},
+            self.astro.pk: {'pending': 1},
+        })
+
+    def test_each_approver_gets_their_pitch_summary(self):
+        """Test chairman and secretary hear about Main Pitch, the manager about Astro, coaches nothing"""
+        self.assertIn('3 approver(s)', self._send())
+        for user, pitch in [(self.chairman, 'Main Pitch'), (self.secretary, 'Main Pitch'), (self.manager, 'Astro Pitch')]:
+            digest = user.notifications.get(type='pending_approvals')
+            self.assertEqual(list(digest.payload['pitches']), [pitch])
+        self.assertFalse(self.coach.notifications.exists())
+        digest = self.chairman.notifications.get(type='pending_approvals')
+        self.assertEqual(digest.payload['pitches']['Main Pitch'], {'pending': 2, 'conflicting': 1})
+
+    def test_approver_of_several_pitches_gets_one_digest(self):
+        """Test an approver covering two pitches gets a single digest counting both"""
+        second_main = Pitch.objects.create(name='Main Pitch 2')
+        self._book(second_main, 0, 'pending')
+        self.assertIn('3 approver(s)', self._send())
+        digest = self.chairman.notifications.get(type='pending_approvals')
+        self.assertEqual(digest.payload['pitches'], {
+            'Main Pitch': {'pending': 2, 'conflicting': 1},
+            'Main Pitch 2': {'pending': 1},
+        })
+        self.assertIn('4 upcoming booking(s)', digest.message)
+        self.assertIn('Main Pitch 2 (1 pending)', digest.message)
+
+    def test_rerun_refreshes_the_unread_digest(self):
+        """Test a second run in the same period updates the digest rather than adding one"""
+        self._send()
+        self._book(self.astro, 5, 'pending')
+        self._send()
+        digest = self.manager.notifications.get(type='pending_approvals')
+        self.assertEqual(digest.payload['pitches'], {'Astro Pitch': {'pending': 2}})
+
+    def test_read_digest_is_not_resent_in_the_same_period(self):
+        """Test an approver who has read this period's digest is not sent another"""
+        self._send()
+        self.manager.notifications.mark_read()
+        self._send()
+        self.assertEqual(self.manager.notifications.filter(type='pending_approvals').count(), 1)
+
+
+class ConflictAlertTests(TestCase):
+    def setUp(self):
+        """Set up approvers and an approved Main Pitch booking"""
+        cache.clear()
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.chairman = User.objects.create_user(username='chairman', password='pass1234', role='chairman')
+        self.secretary = User.objects.create_user(username='secretary', password='pass1234', role='secretary')
+        self.manager = User.objects.create_user(username='manager', password='pass1234', role='manager')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(days=1)
+        self._book('approved')
+
+    def _book(self, status):
+        return Booking.objects.create(
+            pitch=self.pitch, name='Booker', status=status,
+            start_time=self.start, end_time=self.start + timezone.timedelta(hours=1)
+        )
+
+    def _alerts(self, user):
+        return user.notifications.filter(type='conflict_flag')
+
+    def test_burst_becomes_one_alert_per_approver(self):
+        """Test several conflicting submissions in one transaction send each approver one alert"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                ids = [self._book('conflicting').pk for _ in range(3)]
+            run_pending()
+        for approver in (self.chairman, self.secretary):
+            self.assertEqual(self._alerts(approver).get().payload['booking_ids'], ids)
+        self.assertFalse(self._alerts(self.manager).exists())
+
+    def test_separate_submissions_coalesce(self):
+        """Test conflicts flagged in separate requests refresh the approver's unread alert"""
+        ids = []
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                ids.append(self._book('conflicting').pk)
+                run_pending()
+        alert = self._alerts(self.chairman).get()
+        self.assertEqual(alert.payload['booking_ids'], ids)
+        self.assertEqual(alert.occurrences, 3)
+
+    def test_bookings_flagged_by_an_approval_are_reported(self):
+        """Test open bookings flagged when a booking is approved over them are reported too"""
+        later = self.start + timezone.timedelta(hours=3)
+        pending = Booking.objects.create(
+            pitch=self.pitch, name='Pending', status='pending',
+            start_time=later, end_time=later + timezone.timedelta(hours=1),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(
+                pitch=self.pitch, name='Approved', status='approved',
+                start_time=later, end_time=later + timezone.timedelta(hours=1),
+            )
+            run_pending()
+        self.assertEqual(self._alerts(self.chairman).get().payload['booking_ids'], [pending.pk])
+
+    def test_approver_lookup_is_cached(self):
+        """Test later conflicts resolve approvers without querying users"""
+        self._book('conflicting')
+        run_pending()
+        with CaptureQueriesContext(connection) as queries:
+            self._book('conflicting')
+            run_pending()
+        self.assertFalse(any('users_customuser' in q['sql'] for q in queries))
+
+    def test_role_change_refreshes_approvers(self):
+        """Test a new approver is picked up once their role changes"""
+        self._book('conflicting')
+        coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        coach.role = 'chairman'
+        coach.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._book('conflicting')
+            run_pending()
+        self.assertTrue(self._alerts(coach).exists())
+
+
+class ApprovalPolicyTests(TestCase):
+    def setUp(self):
+        """Set up both pitches and a coach"""
+        self.main = Pitch.objects.create(name='Main Pitch')
+        self.astro = Pitch.objects.create(name='Astro Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.start = timezone.now() + timezone.timedelta(days=1)
+
+    def _book(self, pitch):
+        self.client.login(username='coach', password='pass1234')
+        self.client.post(reverse('create_booking'), {
+            'pitch': pitch.id,
+            'start_time': self.start.isoformat(),
+            'end_time': (self.start + timezone.timedelta(hours=1)).isoformat(),
+            'method': 'web',
+        })
+        return Booking.objects.latest('id')
+
+    def test_category_is_worked_out_from_the_name(self):
+        """Test new pitches are categorised once, when saved"""
+        self.assertEqual((self.main.category, self.astro.category), ('main', 'astro'))
+        self.assertEqual(Pitch.objects.create(name='Back Field').category, 'other')
+
+    def test_policy_is_compiled_once(self):
+        """Test bookings and forms are decided without reading the rules again"""
+        get_policy()
+        with CaptureQueriesContext(connection) as queries:
+            self._book(self.main)
+            self.client.get(reverse('create_booking'))
+        self.assertFalse(any('bookings_approvalrule' in q['sql'] for q in queries))
+
+    def test_rule_change_applies_straight_away(self):
+        """Test editing a rule changes what the next booking starts as"""
+        self.assertEqual(self._book(self.astro).status, 'pending')
+        rule = ApprovalRule.objects.get(category='astro', role='coach')
+        rule.on_submit = ApprovalRule.OnSubmit.APPROVE
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.save()
+        self.start += timezone.timedelta(hours=2)
+        self.assertEqual(self._book(self.astro).status, 'approved')
+
+    def test_pitch_save_updates_bookable_pitches(self):
+        """Test recategorising a pitch changes who may book it"""
+        with self.captureOnCommitCallbacks(execute=True):
+            field = Pitch.objects.create(name='Back Field')
+        self.assertNotIn(field.pk, get_policy().bookable(None))
+        field.category = Pitch.Category.ASTRO
+        with self.captureOnCommitCallbacks(execute=True):
+            field.save()
+        self.assertIn(field.pk, get_policy().bookable(None))
+        self.assertIn(field.pk, get_policy().approvable('manager'))
+
+    def test_change_is_picked_up_once_committed(self):
+        """Test a rule change is not compiled from the open transaction, only after it commits"""
+        get_policy()
+        rule = ApprovalRule.objects.get(category='astro', role='coach')
+        rule.can_book = False
+        with self.captureOnCommitCallbacks() as callbacks:
+            rule.save()
+            self.assertIn(self.astro.pk, get_policy().bookable('coach'))
+        for callback in callbacks:
+            callback()
+        self.assertNotIn(self.astro.pk, get_policy().bookable('coach'))
+
+    def test_version_is_read_once_per_request(self):
+        """Test a request making several policy lookups reads the shared version once"""
+        get_policy()
+        with CaptureQueriesContext(connection) as queries:
+            self._book(self.main)
+        self.assertEqual(sum('version:policy' in q['sql'] for q in queries), 1)
+
+
+class UtilisationRollupTests(TestCase):
+    def setUp(self):
+        """Set up a main pitch, a team and a Monday evening next week"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.team = Team.objects.create(age_group='U12', gender='boys', sport='football')
+        today = timezone.localdate()
+        self.day = today + timezone.timedelta(days=7 - today.weekday())
+        self.evening = timezone.make_aware(datetime.combine(self.day, time(18, 30)))
+
+    def _book(self, start, minutes=90, **kwargs):
+        return Booking.objects.create(
+            pitch=self.pitch, name='Booker', start_time=start, end_time=start + timezone.timedelta(minutes=minutes), **kwargs
+        )
+
+    def _rollups(self):
+        return {
+            (row.pitch_id, row.date, row.hour, row.team_id, row.method, row.status): (row.minutes, row.starts)
+            for row in UtilisationRollup.objects.all()
+            if row.minutes or row.starts
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self._rollups()
+        rebuild()
+        self.assertEqual(incremental, self._rollups())
+
+    def test_booking_is_split_into_hours(self):
+        """Test a booking adds its minutes to each local hour it covers and counts once where it starts"""
+        self._book(self.evening, team=self.team, status='approved')
+        self.assertEqual(self._rollups(), {
+            (self.pitch.pk, self.day, 18, self.team.pk, 'web', 'approved'): (30, 1),
+            (self.pitch.pk, self.day, 19, self.team.pk, 'web', 'approved'): (60, 0),
+        })
+        self.assertMatchesRebuild()
+
+    def test_every_kind_of_write_keeps_rollups_in_step(self):
+        """Test saves, moves, bulk updates, conflict flips, series, deletes and team deletion match a rebuild"""
+        coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        pending = self._book(self.evening + timezone.timedelta(hours=1), method='phone')
+        approved = self._book(self.evening, status='approved', team=self.team)
+        self.assertEqual(self._status(pending), 'conflicting')
+
+        approved.start_time += timezone.timedelta(hours=3)
+        approved.end_time += timezone.timedelta(hours=3)
+        approved.save()
+        self.assertEqual(self._status(pending), 'pending')
+        self.assertMatchesRebuild()
+
+        Booking.objects.filter(pk=pending.pk).update(status='approved', team=self.team)
+        Booking.objects.filter(pk=approved.pk).update(method='email')
+        self.assertMatchesRebuild()
+
+        start = self.evening + timezone.timedelta(days=1)
+        series = BookingSeries.objects.create(
+            pitch=self.pitch, created_by=coach, team=self.team, start_time=start,
+            end_time=start + timezone.timedelta(hours=1), until=self.day + timezone.timedelta(weeks=3),
+        )
+        create_series(series, coach)
+        self.assertMatchesRebuild()
+
+        Booking.objects.filter(series=series).delete()
+        Booking.objects.get(pk=pending.pk).delete()
+        self.assertMatchesRebuild()
+
+        self.team.delete()
+        self.assertMatchesRebuild()
+
+    def _status(self, booking):
+        return Booking.objects.values_list('status', flat=True).get(pk=booking.pk)
+
+    def test_rebuild_command(self):
+        """Test the rebuild command restores rollups that were lost"""
+        self._book(self.evening, status='approved')
+        expected = self._rollups()
+        UtilisationRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertEqual(self._rollups(), expected)
+        self.assertIn('Rebuilt 2 utilisation row(s)', out.getvalue())
+
+    def test_report_is_for_officials_and_reads_only_rollups(self):
+        """Test the report is refused to coaches and never queries the bookings table"""
+        self._book(self.evening, status='approved', team=self.team)
+        self._book(self.evening + timezone.timedelta(hours=2), status='rejected')
+        User.objects.create_user(username='coach', password='pass1234', role='coach')
+        User.objects.create_user(username='secretary', password='pass1234', role='secretary')
+        url = reverse('utilisation_report')
+        params = {'start': self.day.isoformat(), 'end': self.day.isoformat(), 'status': 'approved'}
+
+        self.client.login(username='coach', password='pass1234')
+        self.assertEqual(self.client.get(url, params).status_code, 403)
+
+        self.client.login(username='secretary', password='pass1234')
+        get_policy()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'bookings_booking' in q['sql']])
+        self.assertEqual(response.context['by_pitch'][0]['hours'], 1.5)
+        self.assertEqual(response.context['by_team'], [{'label': str(self.team), 'hours': 1.5, 'bookings': 1}])
+        self.assertEqual(
+            {entry['label']: entry['bookings'] for entry in response.context['by_status']},
+            {'Approved': 1, 'Rejected': 1},
+        )
+        self.assertEqual([entry['label'] for entry in response.context['by_hour']], ['18:00', '19:00'])
+        self.assertEqual(response.context['by_weekday'][0]['label'], 'Monday')
+
+
+class SeasonAllocationTests(TestCase):
+    def setUp(self):
+        """Set up a main and an astro pitch, a coach and a season starting next Monday"""
+        self.main = Pitch.objects.create(name='Main Pitch')
+        self.astro = Pitch.objects.create(name='Astro Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        today = timezone.localdate()
+        self.start = today + timezone.timedelta(days=7 - today.weekday())
+        self.until = self.start + timezone.timedelta(weeks=4, days=-1)
+
+    def _team(self, age_group, sessions=1, coach=None, **kwargs):
+        return Team.objects.create(age_group=age_group, gender='boys', sport='football', coach=coach, training_sessions=sessions, **kwargs)
+
+    def _window(self, team, weekday, start, end, pitch=None, preference=1):
+        return TrainingWindow.objects.create(
+            team=team, weekday=weekday, start_time=time(*start), end_time=time(*end), pitch=pitch, preference=preference,
+        )
+
+    def _slots(self, plan):
+        return {str(team): (pitch.name, weekday, start.strftime('%H:%M')) for team, pitch, weekday, start, _ in plan.sessions}
+
+    def test_sessions_avoid_approved_bookings(self):
+        """Test a session is placed in its window after an approved booking already there"""
+        team = self._team('U12')
+        self._window(team, 1, (18, 0), (20, 0), pitch=self.main)
+        tuesday = timezone.make_aware(datetime.combine(self.start + timezone.timedelta(days=8), time(18)))
+        Booking.objects.create(pitch=self.main, name='Match', status='approved', start_time=tuesday, end_time=tuesday + timezone.timedelta(minutes=50))
+        plan = plan_season(self.start, self.until)
+        self.assertEqual(self._slots(plan), {str(team): ('Main Pitch', 1, '19:00')})
+
+    def test_solver_backtracks_out_of_a_dead_end(self):
+        """Test an earlier team is moved to its second choice when a later one has nowhere else to go"""
+        first = self._team('U10', coach=self.coach)
+        self._window(first, 0, (18, 0), (19, 0), pitch=self.main)
+        self._window(first, 1, (18, 0), (19, 0), pitch=self.main, preference=2)
+        second = self._team('U11', coach=self.coach)
+        self._window(second, 0, (18, 0), (19, 0), pitch=self.main)
+        self._window(second, 0, (18, 0), (19, 0), pitch=self.astro, preference=2)
+
+        plan = plan_season(self.start, self.until)
+        self.assertEqual(self._slots(plan), {
+            str(first): ('Main Pitch', 1, '18:00'),
+            str(second): ('Main Pitch', 0, '18:00'),
+        })
+        self.assertEqual(plan.unplaced, {})
+
+        greedy = plan_season(self.start, self.until, limit=0)
+        self.assertEqual(self._slots(greedy), {str(first): ('Main Pitch', 0, '18:00')})
+        self.assertEqual(greedy.unplaced, {second: 1})
+
+    def test_sessions_are_capped_by_quota_and_spread_over_days(self):
+        """Test a team gets no more sessions than its quota allows and never two on one day"""
+        team = self._team('U14', sessions=3, weekly_hours_quota=2)
+        plan = plan_season(self.start, self.until)
+        days = [weekday for _, _, weekday, _, _ in plan.sessions]
+        self.assertEqual(len(days), 2)
+        self.assertEqual(len(set(days)), 2)
+
+    def test_time_already_booked_counts_against_quota(self):
+        """Test a team's existing bookings in its busiest week leave room for fewer sessions"""
+        team = self._team('U15', sessions=2, weekly_hours_quota=2)
+        thursday = timezone.make_aware(datetime.combine(self.start + timezone.timedelta(days=10), time(10)))
+        Booking.objects.create(
+            pitch=Pitch.objects.create(name='Back Field'), name='Match', team=team, status='approved',
+            start_time=thursday, end_time=thursday + timezone.timedelta(hours=1),
+        )
+        self.assertEqual(len(plan_season(self.start, self.until).sessions), 1)
+
+    def test_booking_a_plan_checks_quota_again(self):
+        """Test a plan is not booked if the team took up its quota after it was made"""
+        team = self._team('U17', weekly_hours_quota=1)
+        plan = plan_season(self.start, self.until)
+        thursday = timezone.make_aware(datetime.combine(self.start + timezone.timedelta(days=17), time(10)))
+        Booking.objects.create(
+            pitch=Pitch.objects.create(name='Back Field'), name='Match', team=team, status='approved',
+            start_time=thursday, end_time=thursday + timezone.timedelta(hours=1),
+        )
+        with self.assertRaises(ValidationError):
+            plan.book(self.coach)
+        self.assertFalse(BookingSeries.objects.exists())
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_hundreds_of_teams_get_clash_free_slots(self):
+        """Test a full club is allocated without any two sessions sharing a pitch or a coach"""
+        coaches = [User.objects.create_user(username=f'coach{i}', password='pass1234', role='coach') for i in range(40)]
+        Team.objects.bulk_create(
+            Team(age_group='U12', gender='mixed', sport='football', coach=coaches[i % 40], training_sessions=1, session_minutes=60)
+            for i in range(160)
+        )
+        plan = plan_season(self.start, self.until)
+        self.assertEqual(len(plan.sessions), 160)
+        taken = {}
+        for team, pitch, weekday, start, end in plan.sessions:
+            for key in [('pitch', pitch.pk, weekday), ('coach', team.coach_id, weekday)]:
+                for other_start, other_end in taken.get(key, []):
+                    self.assertFalse(start < other_end and other_start < end)
+                taken.setdefault(key, []).append((start, end))
+
+    def test_command_prints_plan_and_books_it_on_commit(self):
+        """Test the command is a dry run by default and books weekly series for the team with --commit"""
+        secretary = User.objects.create_user(username='secretary', password='pass1234', role='secretary')
+        team = self._team('U16')
+        self._window(team, 2, (19, 0), (20, 0), pitch=self.main)
+        out = StringIO()
+        call_command('allocate_season', self.start.isoformat(), self.until.isoformat(), stdout=out)
+        self.assertIn('Wednesday', out.getvalue())
+        self.assertIn('19:00-20:00', out.getvalue())
+        self.assertFalse(Booking.objects.exists())
+
+        call_command('allocate_season', self.start.isoformat(), self.until.isoformat(), '--commit', '--user', 'secretary', stdout=out)
+        series = BookingSeries.objects.get()
+        self.assertEqual((series.team, series.created_by, series.pitch), (team, secretary, self.main))
+        bookings = Booking.objects.filter(series=series)
+        self.assertEqual(bookings.count(), 4)
+        self.assertEqual(set(bookings.values_list('team', 'status')), {(team.pk, 'approved')})
+
+
+class TeamQuotaTests(TestCase):
+    def setUp(self):
+        """Set up a coach's team with a four hour weekly quota and two hours booked on a Monday"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.team = Team.objects.create(age_group='U12', gender='boys', sport='football', coach=self.coach, weekly_hours_quota=4)
+        today = timezone.localdate()
+        monday = today - timezone.timedelta(days=today.weekday()) + timezone.timedelta(weeks=1)
+        self.monday = timezone.make_aware(datetime.combine(monday, time(18)))
+        self._book(self.monday, 2)
+        self.client.login(username='coach', password='pass1234')
+
+    def _book(self, start, hours, status='approved'):
+        return Booking.objects.create(
+            pitch=self.pitch, name='Coach', team=self.team, status=status,
+            start_time=start, end_time=start + timezone.timedelta(hours=hours),
+        )
+
+    def _form(self, start, hours, instance=None):
+        return BookingForm(data={
+            'pitch': self.pitch.id,
+            'team': self.team.id,
+            'start_time': start.isoformat(),
+            'end_time': (start + timezone.timedelta(hours=hours)).isoformat(),
+            'method': 'web',
+        }, user=self.coach, instance=instance)
+
+    def test_booking_within_quota_is_accepted(self):
+        """Test a booking that fits the remaining weekly hours is valid"""
+        self.assertTrue(self._form(self.monday + timezone.timedelta(days=2), 2).is_valid())
+
+    def test_booking_over_quota_is_rejected(self):
+        """Test a booking taking the team past its quota is refused with the hours used"""
+        form = self._form(self.monday + timezone.timedelta(days=2), 3)
+        self.assertFalse(form.is_valid())
+        self.assertIn('already has 2 of its 4 weekly hours', form.errors['team'][0])
+
+    def test_other_weeks_and_rejected_bookings_do_not_count(self):
+        """Test only the booking's own week and non-rejected bookings are summed"""
+        self._book(self.monday + timezone.timedelta(days=1), 2, status='rejected')
+        self._book(self.monday - timezone.timedelta(days=1), 3)
+        self.assertTrue(self._form(self.monday + timezone.timedelta(days=6), 2).is_valid())
+
+    def test_editing_a_booking_does_not_count_it_twice(self):
+        """Test a booking being edited is left out of its own quota check"""
+        booking = Booking.objects.get()
+        self.assertTrue(self._form(self.monday, 4, instance=booking).is_valid())
+
+    def test_quota_is_checked_again_when_saving(self):
+        """Test a booking that filled the quota after validation stops the save"""
+        form = self._form(self.monday + timezone.timedelta(days=2), 2)
+        self.assertTrue(form.is_valid())
+        self._book(self.monday + timezone.timedelta(days=1), 1)
+        self.assertFalse(form.save_within_quota(form.save(commit=False)))
+        self.assertIn('already has 3 of its 4 weekly hours', form.errors['team'][0])
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_quota_is_one_aggregate_query(self):
+        """Test the check costs one query however many bookings the team has"""
+        for day in range(1, 4):
+            self._book(self.monday + timezone.timedelta(days=day), 0.25)
+        with self.assertNumQueries(1):
+            booked = team_hours_booked(self.team.pk, *week_bounds(self.monday))
+        self.assertEqual(booked, timezone.timedelta(hours=2.75))
+
+    def test_coaches_only_see_their_own_teams(self):
+        """Test a coach can only book for the teams they coach"""
+        Team.objects.create(age_group='U14', gender='girls', sport='camogie')
+        response = self.client.get(reverse('create_booking'))
+        self.assertEqual(list(response.context['form'].fields['team'].queryset), [self.team])
+
+    def _series(self, start, hours, weeks):
+        return BookingSeries.objects.create(
+            pitch=self.pitch, created_by=self.coach, team=self.team, start_time=start,
+            end_time=start + timezone.timedelta(hours=hours), until=(start + timezone.timedelta(weeks=weeks)).date(),
+        )
+
+    def test_series_is_checked_against_every_week(self):
+        """Test a series over the quota in any one week books nothing, and one that fits is booked"""
+        series = self._series(self.monday + timezone.timedelta(days=2), 3, weeks=2)
+        with self.assertRaisesMessage(ValidationError, 'already has 2 of its 4 weekly hours booked in the week of'):
+            create_series(series, self.coach)
+        self.assertFalse(series.bookings.exists())
+
+        self.assertEqual(len(create_series(self._series(self.monday + timezone.timedelta(weeks=1), 3, weeks=2), self.coach)), 3)
@@ -1,12 +1,24 @@
+from datetime import date, datetime, time, timedelta
+from urllib.parse import urlencode
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
-from .forms import BookingForm
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.db import transaction
+from django.views.decorators.http import require_GET, require_POST
+from config.pagination import InvalidCursor, KeysetPaginator
+from .availability import pitch_availability
+from .forms import BookingForm, BookingSeriesForm, UtilisationReportForm
 from .models import Booking, Pitch
+from .policy import get_policy
+from .rollups import report
+from .services import OPEN_STATUSES, approvable_together, create_series, has_approved_conflict, save_booking
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.exceptions import PermissionDenied
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
 # Create your views here.
 def create_booking(request):
@@ -22,43 +34,9 @@ def create_booking(request):
                 booking.email = request.user.email
 
                 role = request.user.role
-                pitch_name = booking.pitch.name.lower()
-
-                is_astro = 'astro' in pitch_name
-                is_main = 'main' in pitch_name
-
-                # Default to pending for all roles, changed below based on role
-                booking.status = 'pending'
-
-                # Chairman or Secretary auto-approve all Main pitch bookings
-                if role in ['chairman', 'secretary'] and is_main:
-                    booking.status = 'approved'
-
-                # Manager logic
-                elif role == 'manager':
-                    if is_astro:
-                        # Managers auto-approved for Astro pitch
-                        booking.status = 'approved'
-                    elif is_main:
-                        # Managers approved for Main pitch only if no conflict
-                        conflict = Booking.objects.filter(
-                            pitch=booking.pitch,
-                            start_time__lt=booking.end_time,
-                            end_time__gt=booking.start_time,
-                            status='approved'
-                        ).exists()
-                        booking.status = 'conflicting' if conflict else 'approved'
-
-                # Coach logic (Main pitch only, Astro always pending)
-                elif role == 'coach' and is_main:
-                    # Coaches approved for Main pitch only if no conflict
-                    conflict = Booking.objects.filter(
-                        pitch=booking.pitch,
-                        start_time__lt=booking.end_time,
-                        end_time__gt=booking.start_time,
-                        status='approved'
-                    ).exists()
-                    booking.status = 'conflicting' if conflict else 'approved'
+                booking.status = get_policy().initial_status(
+                    role, booking.pitch_id, lambda: has_approved_conflict(booking)
+                )
 
                 # For all non-managers, set method to 'web'
                 if role != 'manager':
@@ -69,31 +47,133 @@ def create_booking(request):
                 booking.method = 'web'
                 booking.status = 'pending'
 
-            booking.save()
-            return redirect('booking_list')
+            if form.save_within_quota(booking):
+                return redirect('booking_list')
     else:
         form = BookingForm(user=request.user)
 
     return render(request, 'bookings/create_booking.html', {'form': form})
 
 
+SERIES_ROLES = ['coach', 'manager', 'chairman', 'secretary']
+
+@login_required
+def create_booking_series(request):
+    if request.user.role not in SERIES_ROLES:
+        raise PermissionDenied("Only club officials and coaches can book recurring sessions")
+
+    if request.method == 'POST':
+        form = BookingSeriesForm(request.POST, user=request.user)
+        if form.is_valid():
+            series = form.save(commit=False)
+            series.created_by = request.user
+            # No series without its bookings if expanding it fails
+            with transaction.atomic():
+                series.save()
+                create_series(series, request.user)
+            return redirect('booking_list')
+    else:
+        form = BookingSeriesForm(user=request.user)
+
+    return render(request, 'bookings/create_booking_series.html', {'form': form})
+
 
 class BookingList(LoginRequiredMixin, ListView):
     model = Booking
 
     template_name = 'booking_list.html'
     context_object_name = 'bookings'
+    paginate_by = 25
+
+    STATUS_CHOICES = ['pending', 'approved', 'rejected', 'conflicting']
+
+    # Only the columns the table renders
+    LIST_COLUMNS = [
+        'id', 'name', 'start_time', 'end_time', 'method', 'status',
+        'pitch__name', 'created_by__first_name', 'created_by__last_name', 'created_by__role',
+    ]
+
+    def get_filters(self):
+        filters = {}
+        params = self.request.GET
+        if params.get('pitch', '').isdigit():
+            filters['pitch'] = int(params['pitch'])
+        if params.get('status') in self.STATUS_CHOICES:
+            filters['status'] = params['status']
+        for key in ('date_from', 'date_to'):
+            try:
+                filters[key] = date.fromisoformat(params.get(key, ''))
+            except ValueError:
+                pass
+        return filters
 
     # Busines rule: only upcoming bookings should appear on this
     def get_queryset(self):
         now = timezone.now()
-    
-        return Booking.objects.filter(
-            start_time__gte=now
-        ).order_by('start_time')
+        self.filters = self.get_filters()
+
+        queryset = Booking.objects.filter(start_time__gte=now)
+        if 'pitch' in self.filters:
+            queryset = queryset.filter(pitch_id=self.filters['pitch'])
+        if 'status' in self.filters:
+            queryset = queryset.filter(status=self.filters['status'])
+        # Compare against day boundaries rather than start_time__date so the index is used
+        if 'date_from' in self.filters:
+            day_start = datetime.combine(self.filters['date_from'], time.min)
+            queryset = queryset.filter(start_time__gte=timezone.make_aware(day_start))
+        if 'date_to' in self.filters:
+            day_end = datetime.combine(self.filters['date_to'] + timedelta(days=1), time.min)
+            queryset = queryset.filter(start_time__lt=timezone.make_aware(day_end))
+
+        return (
+            queryset
+            .select_related('pitch', 'created_by')
+            .only(*self.LIST_COLUMNS)
+            .order_by('start_time', 'id')
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        # Keyset pagination on (start_time, id) instead of OFFSET/COUNT
+        paginator = KeysetPaginator(queryset, ordering=['start_time', 'id'], per_page=page_size)
+        after, before = self.request.GET.get('after'), self.request.GET.get('before')
+        try:
+            for cursor in filter(None, [after, before]):
+                paginator.decode_cursor(cursor)
+        except InvalidCursor:
+            raise Http404("Invalid page cursor")
+        # The page is only fetched if the template's cached table fragment is missing
+        page = SimpleLazyObject(lambda: paginator.page(after=after, before=before))
+        return (
+            paginator,
+            page,
+            SimpleLazyObject(lambda: page.object_list),
+            SimpleLazyObject(lambda: page.has_other_pages()),
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['pitches'] = Pitch.objects.only('id', 'name')
+        context['statuses'] = self.STATUS_CHOICES
+        context['filters'] = self.filters
+        policy = get_policy()
+        context['approvable_pitches'] = policy.approvable(self.request.user.role)
+        context['approvable_pitch_names'] = sorted(policy.pitch_names[pk] for pk in context['approvable_pitches'])
+        context['filter_query'] = urlencode({
+            key: value.isoformat() if hasattr(value, 'isoformat') else value
+            for key, value in self.filters.items()
+        })
+        return context
 
 class BookingDetail(LoginRequiredMixin, DetailView):
-    model = Booking
+    queryset = Booking.objects.select_related('pitch', 'created_by')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['can_decide'] = (
+            self.object.status in OPEN_STATUSES
+            and get_policy().can_approve(self.request.user.role, self.object.pitch_id)
+        )
+        return context
 
 class BookingUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
   model = Booking
@@ -107,7 +187,10 @@ class BookingUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     
   def form_valid(self, form):
     form.instance.author = self.request.user
-    return super().form_valid(form)
+    self.object = form.save(commit=False)
+    if not form.save_within_quota(self.object):
+      return self.form_invalid(form)
+    return redirect(self.get_success_url())
   
   def test_func(self):
     booking = self.get_object()
@@ -140,36 +223,104 @@ class PitchList(ListView):
         return Pitch.objects.none()
 
 def is_authorised_approver(user):
-    return user.is_authenticated and user.role in ['manager', 'secretary', 'chairman']
+    return user.is_authenticated and bool(get_policy().approvable(user.role))
+
+def _check_can_decide(user, booking):
+    if not get_policy().can_approve(user.role, booking.pitch_id):
+        raise PermissionDenied("You cannot approve or reject bookings for this pitch")
 
 @login_required
 @user_passes_test(is_authorised_approver)
 def approve_booking(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id)
-
-    if request.user.role in ['secretary', 'chairman'] and booking.pitch.name != 'Main Pitch':
-        raise PermissionDenied("Chairman and Secretary can only approve Main Pitch Bookings")
-    
-    if request.user.role == 'manager' and booking.pitch.name != 'Astro Pitch':
-        raise PermissionDenied("Manager can only approve Main Pitch Bookings")
+    _check_can_decide(request.user, booking)
 
     if request.method == 'POST' and booking.status in ['pending', 'conflicting']:
         booking.status = 'approved'
-        booking.save()
+        save_booking(booking)
     return redirect('booking_detail', pk=booking.id)
 
 @login_required
 @user_passes_test(is_authorised_approver)
 def reject_booking(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id)
-
-    if request.user.role in ['secretary', 'chairman'] and booking.pitch.name != 'Main Pitch':
-        raise PermissionDenied("Chairman and Secretary can only reject Main Pitch Bookings")
-    
-    if request.user.role == 'manager' and booking.pitch.name != 'Astro Pitch':
-        raise PermissionDenied("Manager can only reject Astro Pitch Bookings")
+    _check_can_decide(request.user, booking)
 
     if request.method == 'POST' and booking.status in ['pending', 'conflicting']:
         booking.status = 'rejected'
         booking.save()
     return redirect('booking_detail', pk=booking.id)
+
+BULK_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+@login_required
+@user_passes_test(is_authorised_approver)
+@require_POST
+def bulk_update_status(request):
+    new_status = BULK_ACTIONS.get(request.POST.get('action'))
+    if not new_status:
+        return HttpResponseBadRequest("Unknown bulk action")
+    booking_ids = [int(pk) for pk in request.POST.getlist('booking_ids') if pk.isdigit()]
+
+    with transaction.atomic():
+        # Lock the selection so the rows checked below are the rows updated
+        locked = Booking.objects.select_for_update().filter(pk__in=booking_ids, status__in=OPEN_STATUSES)
+        open_bookings = Booking.objects.filter(pk__in=list(locked.values_list('pk', flat=True)))
+
+        # One query checks the pitch permission for the whole selection
+        allowed = get_policy().approvable(request.user.role)
+        if open_bookings.exclude(pitch_id__in=allowed).exists():
+            raise PermissionDenied("You can only approve or reject bookings for the pitches you approve")
+
+        if new_status == 'approved' and settings.BOOKING_EXCLUSION_CONSTRAINT:
+            # As with save_booking, anything the constraint would refuse stays
+            # open and is flagged conflicting by the approvals around it
+            open_bookings = open_bookings.filter(pk__in=approvable_together(open_bookings))
+
+        # Tracked bulk update: one UPDATE, notifications sent as one batch
+        open_bookings.update(status=new_status)
+
+    return redirect('booking_list')
+
+MAX_AVAILABILITY_DAYS = 31
+
+@require_GET
+def availability(request):
+    try:
+        pitch_id = int(request.GET['pitch'])
+        start_day = date.fromisoformat(request.GET['start'])
+        end_day = date.fromisoformat(request.GET.get('end', request.GET['start']))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'pitch and start (YYYY-MM-DD) are required'}, status=400)
+
+    if end_day < start_day or end_day - start_day >= timedelta(days=MAX_AVAILABILITY_DAYS):
+        return JsonResponse({'error': f'Date range must be between 1 and {MAX_AVAILABILITY_DAYS} days'}, status=400)
+
+    if not Pitch.objects.filter(pk=pitch_id).exists():
+        return JsonResponse({'error': 'Pitch not found'}, status=404)
+
+    return JsonResponse({
+        'pitch': pitch_id,
+        'days': pitch_availability(pitch_id, start_day, end_day),
+    })
+
+REPORT_ROLES = ['manager', 'chairman', 'secretary']
+
+@login_required
+@require_GET
+def utilisation_report(request):
+    if request.user.role not in REPORT_ROLES:
+        raise PermissionDenied("Only club officials can view utilisation reports")
+
+    # Defaults to approved bookings so far this month
+    today = timezone.localdate()
+    form = UtilisationReportForm(request.GET or {'start': today.replace(day=1), 'end': today, 'status': ['approved']})
+    context = {'form': form}
+    if form.is_valid():
+        context.update(report(
+            form.cleaned_data['start'],
+            form.cleaned_data['end'],
+            pitch=form.cleaned_data['pitch'],
+            statuses=form.cleaned_data['status'],
+        ))
+    return render(request, 'bookings/utilisation_report.html', context)
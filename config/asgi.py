@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+# Serve through this module (e.g. `uvicorn config.asgi:application`) for live
+# notifications: alerts.views.notification_stream keeps a server-sent-events
+# connection open per tab, which only scales on an async server
 application = get_asgi_application()
@@ -0,0 +1,68 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# Versioned cache keys. Every namespace ('bookings', 'teams', ...) has a
+# version number kept in the shared cache and each key built with
+# versioned_key() embeds the versions it depends on. Bumping a namespace
+# (see the model receivers in bookings.signals) orphans every key built on
+# it at once, without knowing what those keys were; orphans age out on their
+# own timeout.
+
+
+def _version_key(namespace):
+    return f"version:{namespace}"
+
+
+def get_versions(*namespaces):
+    """
+    {namespace: version} in one cache round trip. A namespace seen for the
+    first time (or evicted) starts from the clock, so it never goes back to a
+    version older keys were built with.
+    """
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        cache.add(key, time.time_ns(), None)
+        found[key] = cache.get(key)
+    return {namespace: found[key] for key, namespace in keys.items()}
+
+
+def get_version(namespace):
+    return get_versions(namespace)[namespace]
+
+
+def versioned_key(namespaces, *parts, versions=None):
+    # e.g. versioned_key(['teams', 'users'], 'team_list') -> "teams.users:170.171:team_list"
+    versions = versions or get_versions(*namespaces)
+    stamp = ".".join(str(versions[namespace]) for namespace in namespaces)
+    return ":".join([".".join(namespaces), stamp, *map(str, parts)])
+
+
+def _bump(namespaces):
+    # A fresh clock value rather than incr(): one write, and never a version seen before
+    cache.set_many({_version_key(namespace): time.time_ns() for namespace in namespaces}, None)
+
+
+def bump(*namespaces, after=None):
+    """
+    Invalidate everything cached under the namespaces once the surrounding
+    transaction commits (straight away outside one). Bumping any earlier
+    would let a reader re-cache the pre-commit state under the new version.
+    `after` is called in the same callback, for process-local copies.
+    """
+    def on_commit():
+        _bump(namespaces)
+        if after is not None:
+            after()
+    transaction.on_commit(on_commit)
+
+
+def get_or_set(namespaces, parts, compute, timeout=None):
+    key = versioned_key(namespaces, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
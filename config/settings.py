@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'bookings.apps.BookingsConfig',
     'teams.apps.TeamsConfig',
     'alerts.apps.AlertsConfig',
+    'tasks.apps.TasksConfig',
     "crispy_forms",
     "crispy_bootstrap5",
     'django.contrib.admin',
@@ -92,10 +93,69 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 
+# Persistent connections are off by default: the web process runs under ASGI,
+# where each request may get a new thread and a kept connection would leak.
+# The task worker sets DB_CONN_MAX_AGE to reuse its connection between polls.
 DATABASES = {
-    'default': dj_database_url.config(conn_max_age=600)
+    'default': dj_database_url.config(conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', 0)))
 }
 
+# Shared by every worker and node through the database, no cache server needed.
+# Create the table with `manage.py createcachetable` (run on each deploy).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+# PostgreSQL only: let the database reject overlapping approved bookings (applied by bookings migration 0004)
+BOOKING_EXCLUSION_CONSTRAINT = os.environ.get('BOOKING_EXCLUSION_CONSTRAINT', 'False') == 'True'
+
+# Hours (local time) between which pitches can be booked, used for free-slot calculation
+PITCH_OPENING_HOURS = (9, 22)
+
+# Whether owners are told when a booking that has already finished is deleted,
+# e.g. when a pitch and its booking history are retired
+NOTIFY_PAST_BOOKING_DELETIONS = True
+
+# Repeated notifications with the same dedupe_key (e.g. a booking's status
+# bouncing between pending and conflicting) coalesce into one unread row per window
+NOTIFICATION_DEDUPE_WINDOW = 60 * 60  # seconds
+
+# At most one pending-approvals digest per approver per period (`manage.py send_approval_digests`)
+APPROVAL_DIGEST_PERIOD = 24 * 60 * 60  # seconds
+
+# Fan-out for live notifications (alerts.realtime). The local backend only
+# reaches streams held by the same process, so notifications created by the
+# task worker need the PostgreSQL one
+NOTIFICATION_HUB_BACKEND = (
+    'alerts.realtime.PostgresBackend' if DATABASES['default'].get('ENGINE', '').endswith('postgresql')
+    else 'alerts.realtime.LocalBackend'
+)
+
+# Applied by `manage.py prune_notifications`, see alerts.retention.RetentionRule
+NOTIFICATION_RETENTION = [
+    {'read': True, 'days': 90, 'action': 'delete'},
+    {'read': False, 'days': 365, 'action': 'archive'},
+]
+
+# Background work (tasks app): `manage.py run_worker` runs queued tasks and
+# queues these on a cron-style "minute hour day month weekday" schedule
+TASK_SCHEDULE = {
+    'alerts.deliver_outbox': '* * * * *',
+    'bookings.send_approval_digests': '0 7 * * *',
+    'alerts.prune_notifications': '30 2 * * *',
+    'alerts.reconcile_unread_counts': '0 3 * * 0',
+    'bookings.rebuild_rollups': '30 3 * * 0',
+}
+TASKS_MAX_ATTEMPTS = 5
+TASKS_RETRY_DELAY = 30  # seconds, doubled after each failed attempt
+# How long a claimed task may run before another worker assumes it died and takes it over
+TASKS_LEASE = 10 * 60  # seconds
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -148,7 +208,15 @@ LOGIN_URL = '/login/'
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Mail is queued in the outbox within the request and sent by `manage.py deliver_outbox`
+# through EMAIL_DELIVERY_BACKEND, see alerts.outbox
+EMAIL_BACKEND = "alerts.outbox.OutboxBackend"
+EMAIL_DELIVERY_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+EMAIL_OUTBOX_RETRY_DELAY = 60  # seconds, doubled after each failed attempt
+EMAIL_OUTBOX_LEASE = 10 * 60  # seconds a claimed batch is held before another worker may retry it
+# Bounds each SMTP call so a stalled server can't outlast the lease
+EMAIL_TIMEOUT = 30
 EMAIL_HOST = os.environ.get('EMAIL_HOST')
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
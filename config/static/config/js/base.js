@@ -1 +1,74 @@
 console.log("base JS loaded");
+
+// Live unread count for the navbar badge, pushed by the notification stream
+document.addEventListener("DOMContentLoaded", function () {
+    const link = document.querySelector("[data-notification-stream]");
+    if (!link || !window.EventSource) {
+        return;
+    }
+
+    function setCount(count) {
+        let badge = link.querySelector(".badge");
+        if (!count) {
+            if (badge) {
+                badge.remove();
+            }
+            return;
+        }
+        if (!badge) {
+            badge = document.createElement("span");
+            badge.className = "badge bg-primary rounded-pill";
+            link.appendChild(badge);
+        }
+        badge.textContent = count;
+    }
+
+    // New notifications pop up as toasts linking to the notification
+    const levels = {info: "primary", success: "success", warning: "warning", error: "danger"};
+    let toasts = null;
+
+    function showNotification(notification) {
+        if (!window.bootstrap) {
+            return;
+        }
+        if (!toasts) {
+            toasts = document.createElement("div");
+            toasts.className = "toast-container position-fixed bottom-0 end-0 p-3";
+            document.body.appendChild(toasts);
+        }
+        const toast = document.createElement("div");
+        const colour = levels[notification.level] || "primary";
+        toast.className = "toast border-0 text-bg-" + colour;
+        toast.setAttribute("role", "status");
+        toast.setAttribute("aria-live", "polite");
+
+        const row = document.createElement("div");
+        row.className = "d-flex";
+        const body = document.createElement("a");
+        body.className = "toast-body text-reset text-decoration-none";
+        body.href = notification.url;
+        body.textContent = notification.message;
+        const close = document.createElement("button");
+        close.type = "button";
+        // Warning toasts have dark text, the rest need the light close button
+        close.className = "btn-close me-2 m-auto" + (colour === "warning" ? "" : " btn-close-white");
+        close.setAttribute("data-bs-dismiss", "toast");
+        close.setAttribute("aria-label", "Close");
+        row.append(body, close);
+        toast.appendChild(row);
+
+        toasts.appendChild(toast);
+        toast.addEventListener("hidden.bs.toast", function () {
+            toast.remove();
+        });
+        bootstrap.Toast.getOrCreateInstance(toast).show();
+    }
+
+    const stream = new EventSource(link.dataset.notificationStream);
+    stream.addEventListener("unread", function (event) {
+        setCount(JSON.parse(event.data).count);
+    });
+    stream.addEventListener("notification", function (event) {
+        showNotification(JSON.parse(event.data));
+    });
+});
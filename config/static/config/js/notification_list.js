@@ -0,0 +1,8 @@
+document.addEventListener('DOMContentLoaded', () => {
+  const selectAll = document.querySelector('#select_all');
+  selectAll?.addEventListener('change', () => {
+    document.querySelectorAll('input[name="notification_ids"]').forEach(box => {
+      box.checked = selectAll.checked;
+    });
+  });
+});
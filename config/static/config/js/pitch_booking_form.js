@@ -75,8 +75,44 @@ document.addEventListener('DOMContentLoaded', () => {
     startInput?.addEventListener('change', () => {
         startInput.value = roundMinutes(startInput.value);
         endInput.value = addHour(startInput.value);
+        loadAvailability();
     });
 
+    pitch?.addEventListener('change', loadAvailability);
+
+
+    // Availability
+    const availability = document.querySelector('#availability');
+    const busyList = document.querySelector('#availability_busy');
+
+    function loadAvailability() {
+        if (!availability || !pitch?.value || !startInput?.value) return;
+        const day = startInput.value.slice(0, 10);
+        const params = new URLSearchParams({ pitch: pitch.value, start: day });
+
+        fetch(`${availability.dataset.url}?${params}`)
+            .then(response => response.ok ? response.json() : null)
+            .then(data => {
+                if (!data) return;
+                const busy = data.days[0]?.busy || [];
+                busyList.innerHTML = '';
+                if (!busy.length) {
+                    busyList.textContent = 'No approved bookings yet, the pitch is free all day.';
+                }
+                busy.forEach(slot => {
+                    const item = document.createElement('li');
+                    item.textContent = `${formatTime(slot.start)} – ${formatTime(slot.end)}`;
+                    busyList.appendChild(item);
+                });
+                availability.hidden = false;
+            });
+    }
+
+    function formatTime(value) {
+        const date = new Date(value);
+        return `${String(date.getHours()).padStart(2, '0')}:${String(date.getMinutes()).padStart(2, '0')}`;
+    }
+
 
     //Helpers
     function validateRequired(input, message) {
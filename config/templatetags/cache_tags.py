@@ -0,0 +1,19 @@
+from django import template
+
+from config.cache import get_versions
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def cache_version(context, *namespaces):
+    # For {% cache %} fragment keys, e.g.
+    #   {% cache_version "teams" "users" as version %}{% cache 3600 team_list version %}
+    # Memoised on the request so every fragment on a page shares one cache read
+    request = context.get("request")
+    known = getattr(request, "_cache_versions", {})
+    missing = [namespace for namespace in namespaces if namespace not in known]
+    if missing:
+        known.update(get_versions(*missing))
+        if request is not None:
+            request._cache_versions = known
+    return ".".join(str(known[namespace]) for namespace in namespaces)
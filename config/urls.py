@@ -21,6 +21,7 @@ from . import views
 from users import views as user_views
 from django.contrib.auth import views as auth_views
 from bookings import views as booking_views
+from bookings import feeds as booking_feeds
 from teams import views as team_views
 from alerts import views as alert_views
 
@@ -36,13 +37,20 @@ urlpatterns = [
     path('profile/', user_views.profile, name='profile'),
     path('logout/', auth_views.LogoutView.as_view(template_name='users/logout.html'), name='logout'),
     path('bookings/new/', booking_views.create_booking, name='create_booking'),
+    path('bookings/series/new/', booking_views.create_booking_series, name='create_booking_series'),
     path('bookings/', booking_views.BookingList.as_view(), name='booking_list'),
+    path('bookings/availability/', booking_views.availability, name='pitch_availability'),
+    path('bookings/bulk/', booking_views.bulk_update_status, name='booking_bulk_update'),
+    path('bookings/utilisation/', booking_views.utilisation_report, name='utilisation_report'),
     path('bookings/<int:pk>', booking_views.BookingDetail.as_view(), name='booking_detail'),
     path('bookings/<int:pk>/update/', booking_views.BookingUpdateView.as_view(template_name='bookings/create_booking.html'), name='booking_update'),
     path('bookings/<int:pk>/delete/', booking_views.BookingDeleteView.as_view(), name='booking_delete'),
     path('bookings/<int:booking_id>/approve/', booking_views.approve_booking, name='booking_approve'),
     path('bookings/<int:booking_id>/reject/', booking_views.reject_booking, name='booking_reject'),
     path('pitches/', booking_views.PitchList.as_view(), name='pitch_list'),
+    path('pitches/<int:pk>/calendar.ics', booking_feeds.pitch_feed, name='pitch_feed'),
+    path('calendar/<str:token>/bookings.ics', booking_feeds.user_feed, name='user_feed'),
+    path('calendar/<str:token>/approvals.ics', booking_feeds.approver_feed, name='approver_feed'),
     path('teams/create/', team_views.create_team, name='create_team'),
     path('teams/', team_views.TeamList.as_view(), name='team_list'),
     path('teams/<int:pk>/', team_views.TeamDetail.as_view(), name='team_detail'),
@@ -51,6 +59,8 @@ urlpatterns = [
     path('notifications/', alert_views.NotificationListView.as_view(), name='notification_list'),
     path('notifications/<int:pk>/', alert_views.NotificationDetailView.as_view(), name='notification_detail'),
     path('notifications/<int:pk>/delete/', alert_views.NotificationDeleteView.as_view(), name='notification_delete' ),
+    path('notifications/stream/', alert_views.notification_stream, name='notification_stream'),
+    path('notifications/bulk/', alert_views.bulk_update_notifications, name='notification_bulk_update'),
     path('password-reset/', auth_views.PasswordResetView.as_view(template_name='users/password_reset.html', html_email_template_name='users/emails/password_reset_email.html'), name='password_reset'),
     path('password-reset/done/', auth_views.PasswordResetDoneView.as_view(template_name='users/password_reset_done.html'), name='password_reset_done'),
     path('password-reset-confirm/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(template_name='users/password_reset_confirm.html'), name='password_reset_confirm'),
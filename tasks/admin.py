@@ -0,0 +1,12 @@
+from django.contrib import admin
+from .models import ScheduledRun, Task
+# Register your models here.
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'run_at', 'attempts', 'created_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+
+@admin.register(ScheduledRun)
+class ScheduledRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'next_run_at', 'last_run_at')
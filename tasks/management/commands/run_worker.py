@@ -0,0 +1,56 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from tasks.queue import claim, run
+from tasks.schedule import enqueue_due
+
+# Cron expressions go down to the minute, so there is nothing new to queue
+# more often than that
+SCHEDULE_TICK = 60
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks and queue the periodic ones in settings.TASK_SCHEDULE."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20, help="Tasks claimed at a time.")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds to wait when nothing is due.")
+        parser.add_argument("--once", action="store_true", help="Exit once nothing is due instead of polling.")
+        parser.add_argument("--no-schedule", action="store_true", help="Only run queued tasks, never queue periodic ones.")
+
+    def handle(self, *args, batch_size, interval, once, no_schedule, **options):
+        self.stopping = False
+        # Finish the current task on SIGTERM (e.g. a deploy) rather than dying mid-way
+        signal.signal(signal.SIGTERM, self.stop)
+
+        succeeded = failed = 0
+        next_tick = 0
+        while not self.stopping:
+            # The worker outlives any request, so drop connections the
+            # database has closed or that are past CONN_MAX_AGE ourselves
+            close_old_connections()
+            if not no_schedule and time.time() >= next_tick:
+                for name in enqueue_due():
+                    self.stdout.write(f"Queued scheduled task {name}")
+                next_tick = (time.time() // SCHEDULE_TICK + 1) * SCHEDULE_TICK
+            tasks = claim(batch_size, timezone.now())
+            for task in tasks:
+                if run(task):
+                    succeeded += 1
+                else:
+                    failed += 1
+                close_old_connections()
+            if tasks:
+                continue
+            if once:
+                break
+            time.sleep(interval)
+
+        self.stdout.write(f"Ran {succeeded} task(s), {failed} failed.")
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,118 @@
+import logging
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Work that does not need to finish before the response is sent. enqueue()
+# inserts a Task row in the caller's transaction, so a rolled-back request
+# queues nothing and the worker never sees a task before its data is
+# committed. Workers claim due rows with SELECT ... FOR UPDATE SKIP LOCKED,
+# so any number of them can share the table.
+
+_registry = {}
+
+
+def task(name, max_attempts=None):
+    """
+    Register a function as a task, e.g. @task("alerts.deliver_outbox"), and
+    give it an enqueue(*args, run_at=None, **kwargs) helper. Arguments must be
+    JSON serialisable; datetimes arrive back as ISO strings.
+    """
+    def register(func):
+        func.task_name = name
+        func.max_attempts = max_attempts or settings.TASKS_MAX_ATTEMPTS
+        func.enqueue = partial(enqueue, name)
+        _registry[name] = func
+        return func
+    return register
+
+
+def enqueue(name, *args, run_at=None, **kwargs):
+    if name not in _registry:
+        raise ValueError(f"Unknown task {name!r}")
+    return Task.objects.create(name=name, args=list(args), kwargs=kwargs, run_at=run_at or timezone.now())
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def _attempts_left():
+    """Match tasks that have not yet used up their function's max_attempts."""
+    limits = {}
+    for name, func in _registry.items():
+        limits.setdefault(func.max_attempts, []).append(name)
+    # run() fails unregistered tasks outright, but they still get the default here
+    left = Q(attempts__lt=settings.TASKS_MAX_ATTEMPTS) & ~Q(name__in=list(_registry))
+    for max_attempts, names in limits.items():
+        left |= Q(name__in=names, attempts__lt=max_attempts)
+    return left
+
+
+def claim(batch_size, now):
+    # Due pending tasks, plus running ones whose worker has outlived the lease.
+    # A takeover counts as another attempt, so a task that keeps killing its
+    # worker is failed once it runs out rather than retried forever.
+    expired = Q(status=Task.Status.RUNNING, run_at__lte=now)
+    with transaction.atomic():
+        Task.objects.filter(expired).exclude(_attempts_left()).update(
+            status=Task.Status.FAILED, last_error="Lease expired on the final attempt",
+        )
+        tasks = list(
+            Task.objects
+            .filter(Q(status=Task.Status.PENDING, run_at__lte=now) | (expired & _attempts_left()))
+            .select_for_update(skip_locked=True)
+            .order_by("run_at", "id")[:batch_size]
+        )
+        lease_ends = now + timedelta(seconds=settings.TASKS_LEASE)
+        Task.objects.filter(pk__in=[t.pk for t in tasks]).update(
+            status=Task.Status.RUNNING, run_at=lease_ends, attempts=F("attempts") + 1,
+        )
+    for t in tasks:
+        t.attempts += 1
+    return tasks
+
+
+def run(task):
+    """
+    Call the task's function, deleting the row on success. On failure the task
+    is retried with exponential backoff until its max_attempts, then marked failed.
+    """
+    func = _registry.get(task.name)
+    try:
+        if func is None:
+            raise LookupError(f"No task registered as {task.name!r}")
+        func(*task.args, **task.kwargs)
+    except Exception as error:
+        logger.exception("Task %s (%s) failed on attempt %s", task.pk, task.name, task.attempts)
+        error_text = f"{type(error).__name__}: {error}"
+        if func is None or task.attempts >= func.max_attempts:
+            Task.objects.filter(pk=task.pk).update(status=Task.Status.FAILED, last_error=error_text)
+        else:
+            Task.objects.filter(pk=task.pk).update(
+                status=Task.Status.PENDING,
+                run_at=timezone.now() + retry_delay(task.attempts),
+                last_error=error_text,
+            )
+        return False
+    Task.objects.filter(pk=task.pk).delete()
+    return True
+
+
+def run_pending(batch_size=20, now=None):
+    """Run one batch of due tasks and return (succeeded, failed)."""
+    succeeded = failed = 0
+    for t in claim(batch_size, now or timezone.now()):
+        if run(t):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from functools import cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ScheduledRun
+from .queue import enqueue
+
+
+class Cron:
+    """
+    A five-field cron expression, "minute hour day month weekday", in local
+    time. Fields take *, numbers, ranges, lists and steps (e.g. "*/15",
+    "1-5", "0,30"); weekday 0 and 7 are both Sunday. As in cron, when both day
+    and weekday are restricted a date matching either one is due.
+    """
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f"Cron expression {expression!r} needs five fields")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(","):
+            spec, _, step = part.partition("/")
+            try:
+                step = int(step) if step else 1
+                if spec == "*":
+                    start, end = low, high
+                elif "-" in spec:
+                    start, end = map(int, spec.split("-"))
+                else:
+                    start = int(spec)
+                    end = high if "/" in part else start
+            except ValueError:
+                raise ValueError(f"Invalid cron field {field!r}")
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day):
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return in_week
+        if self.any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, moment):
+        # Walk forward a month, day or hour at a time past fields that cannot match
+        local = timezone.localtime(moment).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        give_up = local.year + 5
+        while local.year <= give_up:
+            if local.month not in self.months:
+                local = datetime(local.year + local.month // 12, local.month % 12 + 1, 1)
+            elif not self._day_matches(local):
+                local = datetime.combine(local.date() + timedelta(days=1), datetime.min.time())
+            elif local.hour not in self.hours:
+                local = local.replace(minute=0) + timedelta(hours=1)
+            elif local.minute not in self.minutes:
+                local += timedelta(minutes=1)
+            else:
+                return timezone.make_aware(local)
+        raise ValueError("Cron expression never matches")
+
+
+@cache
+def cron(expression):
+    return Cron(expression)
+
+
+def enqueue_due(now=None):
+    """
+    Queue every settings.TASK_SCHEDULE entry whose time has come and return
+    their names. Runs missed while no worker was up are queued once, not
+    once per missed slot.
+    """
+    now = now or timezone.now()
+    schedule = {name: cron(expression) for name, expression in settings.TASK_SCHEDULE.items()}
+    if not schedule:
+        return []
+
+    with transaction.atomic():
+        ScheduledRun.objects.bulk_create(
+            [ScheduledRun(name=name, next_run_at=entry.next_after(now)) for name, entry in schedule.items()],
+            ignore_conflicts=True,
+        )
+        # SKIP LOCKED: with several workers only one queues each run
+        due = list(
+            ScheduledRun.objects
+            .filter(name__in=schedule, next_run_at__lte=now)
+            .select_for_update(skip_locked=True)
+        )
+        for run in due:
+            enqueue(run.name)
+            run.last_run_at = now
+            run.next_run_at = schedule[run.name].next_after(now)
+        ScheduledRun.objects.bulk_update(due, ["last_run_at", "next_run_at"])
+    return [run.name for run in due]
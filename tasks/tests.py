@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from bookings.models import Booking, Pitch
+from .models import ScheduledRun, Task
+from .queue import enqueue, run_pending, task
+from .schedule import Cron, enqueue_due
+
+User = get_user_model()
+
+calls = []
+
+
+@task("tests.record")
+def record(value):
+    calls.append(value)
+
+
+@task("tests.explode", max_attempts=2)
+def explode():
+    raise RuntimeError("Boom")
+
+
+@override_settings(TASKS_RETRY_DELAY=30, TASKS_LEASE=600)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_task_runs_once_and_is_removed(self):
+        """Test a queued task runs with its arguments and its row is deleted"""
+        record.enqueue('hello')
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(calls, ['hello'])
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(run_pending(), (0, 0))
+
+    def test_rolled_back_enqueue_is_discarded(self):
+        """Test a task queued in a transaction that rolls back never runs"""
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            record.enqueue('lost')
+            raise RuntimeError
+        self.assertFalse(Task.objects.exists())
+
+    def test_unknown_task_is_rejected(self):
+        """Test enqueueing a name nobody registered fails straight away"""
+        with self.assertRaises(ValueError):
+            enqueue('tests.missing')
+
+    def test_future_tasks_wait(self):
+        """Test a task scheduled for later is not run early"""
+        now = timezone.now()
+        record.enqueue('later', run_at=now + timedelta(minutes=5))
+        self.assertEqual(run_pending(now=now), (0, 0))
+        self.assertEqual(run_pending(now=now + timedelta(minutes=5)), (1, 0))
+
+    def test_failures_back_off_then_give_up(self):
+        """Test a failing task is retried after a delay and marked failed at its limit"""
+        explode.enqueue()
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 1))
+        queued = Task.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (Task.Status.PENDING, 1))
+        self.assertGreater(queued.run_at, timezone.now() + timedelta(seconds=25))
+
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            run_pending(now=queued.run_at)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.Status.FAILED, 2))
+        self.assertIn('Boom', queued.last_error)
+
+    def test_abandoned_task_is_taken_over_after_lease(self):
+        """Test a task left running by a dead worker is picked up once its lease ends"""
+        now = timezone.now()
+        record.enqueue('again')
+        Task.objects.update(status=Task.Status.RUNNING, run_at=now + timedelta(seconds=600), attempts=1)
+        self.assertEqual(run_pending(now=now), (0, 0))
+        self.assertEqual(run_pending(now=now + timedelta(seconds=600)), (1, 0))
+        self.assertEqual(calls, ['again'])
+
+    def test_exhausted_task_is_not_taken_over(self):
+        """Test a task whose lease runs out on its last attempt is failed rather than re-run"""
+        now = timezone.now()
+        explode.enqueue()
+        record.enqueue('again')
+        Task.objects.update(status=Task.Status.RUNNING, run_at=now, attempts=2)
+        self.assertEqual(run_pending(now=now), (1, 0))
+        self.assertEqual(calls, ['again'])
+        self.assertEqual(Task.objects.get().status, Task.Status.FAILED)
+
+    def test_booking_delete_notifies_owner_through_worker(self):
+        """Test the deletion notice is sent by the worker rather than inside the delete"""
+        coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        start = timezone.now() + timedelta(days=1)
+        booking = Booking.objects.create(
+            pitch=Pitch.objects.create(name='Astro Pitch'), name='Booker', created_by=coach,
+            start_time=start, end_time=start + timedelta(hours=1),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+        self.assertFalse(coach.notifications.filter(type='booking_deleted').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending()
+        self.assertIn('was deleted', coach.notifications.get(type='booking_deleted').message)
+
+
+# The worker drops stale connections between tasks, which needs real commits
+@override_settings(TASKS_RETRY_DELAY=30, TASKS_LEASE=600)
+class WorkerCommandTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_worker_command_drains_queue(self):
+        """Test run_worker --once runs what is due and exits"""
+        for value in range(3):
+            record.enqueue(value)
+        out = StringIO()
+        call_command('run_worker', '--once', '--no-schedule', '--batch-size', '2', stdout=out)
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertIn('Ran 3 task(s), 0 failed', out.getvalue())
+
+    @override_settings(TASK_SCHEDULE={'tests.record': '* * * * *'})
+    def test_worker_command_queues_schedule(self):
+        """Test run_worker sets up the schedule before running what is queued"""
+        out = StringIO()
+        call_command('run_worker', '--once', stdout=out)
+        self.assertTrue(ScheduledRun.objects.filter(name='tests.record').exists())
+        self.assertIn('Ran 0 task(s), 0 failed', out.getvalue())
+
+
+class CronTests(TestCase):
+    def _next(self, expression, moment):
+        return Cron(expression).next_after(timezone.make_aware(moment)).replace(tzinfo=None)
+
+    def test_next_run_times(self):
+        """Test the next matching minute for common expressions"""
+        moment = datetime(2026, 3, 6, 10, 17)  # a Friday
+        self.assertEqual(self._next('* * * * *', moment), datetime(2026, 3, 6, 10, 18))
+        self.assertEqual(self._next('*/15 * * * *', moment), datetime(2026, 3, 6, 10, 30))
+        self.assertEqual(self._next('0 7 * * *', moment), datetime(2026, 3, 7, 7, 0))
+        self.assertEqual(self._next('0 3 * * 0', moment), datetime(2026, 3, 8, 3, 0))
+        self.assertEqual(self._next('30 2 1 1-6/2 *', moment), datetime(2026, 5, 1, 2, 30))
+        self.assertEqual(self._next('0 0 1 * *', datetime(2026, 12, 15)), datetime(2027, 1, 1))
+
+    def test_day_and_weekday_match_either(self):
+        """Test a restricted day and weekday match on either, as in cron"""
+        self.assertEqual(self._next('0 9 20 * 1', datetime(2026, 3, 6, 10, 0)), datetime(2026, 3, 9, 9, 0))
+
+    def test_invalid_expressions(self):
+        """Test malformed or impossible expressions are rejected"""
+        for expression in ['* * * *', '60 * * * *', '*/0 * * * *', 'a * * * *']:
+            with self.assertRaises(ValueError):
+                Cron(expression)
+        with self.assertRaises(ValueError):
+            Cron('0 0 31 2 *').next_after(timezone.now())
+
+
+@override_settings(TASK_SCHEDULE={'tests.record': '0 * * * *'})
+class ScheduleTests(TestCase):
+    def test_due_entries_are_queued_once(self):
+        """Test a schedule entry is queued when due, once, and then moved to its next slot"""
+        now = timezone.make_aware(datetime(2026, 3, 6, 10, 17))
+        self.assertEqual(enqueue_due(now), [])
+        self.assertEqual(ScheduledRun.objects.get().next_run_at, now.replace(hour=11, minute=0))
+
+        due = now.replace(hour=11, minute=0)
+        self.assertEqual(enqueue_due(due), ['tests.record'])
+        self.assertEqual(enqueue_due(due), [])
+        self.assertEqual(Task.objects.filter(name='tests.record').count(), 1)
+        self.assertEqual(ScheduledRun.objects.get().next_run_at, due + timedelta(hours=1))
+
+    def test_missed_runs_are_not_replayed(self):
+        """Test a worker that was down for hours queues a single catch-up run"""
+        now = timezone.make_aware(datetime(2026, 3, 6, 10, 17))
+        enqueue_due(now)
+        self.assertEqual(enqueue_due(now + timedelta(hours=5)), ['tests.record'])
+        self.assertEqual(Task.objects.count(), 1)
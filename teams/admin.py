@@ -1,8 +1,14 @@
 from django.contrib import admin
-from .models import Team
+from .models import Team, TrainingWindow
 # Register your models here.
+class TrainingWindowInline(admin.TabularInline):
+    model = TrainingWindow
+    extra = 0
+
+
 @admin.register(Team)
 class TeamAdmin(admin.ModelAdmin):
-    list_display = ('age_group', 'gender', 'sport', 'coach')
+    inlines = [TrainingWindowInline]
+    list_display = ('age_group', 'gender', 'sport', 'coach', 'weekly_hours_quota', 'training_sessions')
     list_filter = ('gender', 'sport', 'age_group')
     search_fields = ('coach__first_name', 'coach__last_name')
\ No newline at end of file
@@ -7,12 +7,13 @@ CustomUser = get_user_model()
 class TeamForm(forms.ModelForm):
     class Meta:
         model = Team
-        fields = ['age_group', 'gender', 'sport', 'coach']
+        fields = ['age_group', 'gender', 'sport', 'coach', 'weekly_hours_quota']
         widgets = {
             'age_group': forms.Select(attrs={'class': 'form-control'}),
             'gender': forms.Select(attrs={'class': 'form-control'}),
             'sport': forms.Select(attrs={'class': 'form-control'}),
             'coach': forms.Select(attrs={'class': 'form-control'}),
+            'weekly_hours_quota': forms.NumberInput(attrs={'class': 'form-control'}),
         }
 
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0002_alter_team_age_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='weekly_hours_quota',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Pitch hours the team may book in a week (Monday to Sunday). Leave blank for no limit.', null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0010_bookingseries_team'),
+        ('teams', '0003_team_weekly_hours_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='session_minutes',
+            field=models.PositiveSmallIntegerField(default=60),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='training_sessions',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Weekly training sessions to allocate at the start of the season.'),
+        ),
+        migrations.CreateModel(
+            name='TrainingWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('preference', models.PositiveSmallIntegerField(default=1)),
+                ('pitch', models.ForeignKey(blank=True, help_text='Leave blank for any pitch.', null=True, on_delete=django.db.models.deletion.CASCADE, to='bookings.pitch')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='training_windows', to='teams.team')),
+            ],
+            options={
+                'ordering': ['team', 'preference', 'weekday', 'start_time'],
+            },
+        ),
+    ]
@@ -47,5 +47,52 @@ class Team(models.Model):
         related_name='coached_teams'
     )
 
+    # Checked when a booking for the team is submitted, see bookings.services.team_hours_booked
+    weekly_hours_quota = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        help_text='Pitch hours the team may book in a week (Monday to Sunday). Leave blank for no limit.'
+    )
+
+    # What the season allocator (bookings.allocation) looks for each week
+    training_sessions = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='Weekly training sessions to allocate at the start of the season.'
+    )
+    session_minutes = models.PositiveSmallIntegerField(default=60)
+
+    def __str__(self):
+        return f"{self.age_group} {self.get_gender_display()} ({self.get_sport_display()})"
+
+
+class TrainingWindow(models.Model):
+    # When a team can train. With none the allocator may use any time the pitches are open
+    WEEKDAY_CHOICES = [
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    ]
+
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='training_windows')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    pitch = models.ForeignKey(
+        'bookings.Pitch',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        help_text='Leave blank for any pitch.'
+    )
+    # Lower is tried first
+    preference = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        ordering = ['team', 'preference', 'weekday', 'start_time']
+
     def __str__(self):
-        return f"{self.age_group} {self.get_gender_display()} ({self.get_sport_display()})"
\ No newline at end of file
+        return f"{self.team} on {self.get_weekday_display()} {self.start_time:%H:%M}-{self.end_time:%H:%M}"
\ No newline at end of file
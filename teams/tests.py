@@ -1,7 +1,10 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from bookings.models import Booking, Pitch
 from teams.models import Team
 
 User = get_user_model()
@@ -220,4 +223,70 @@ class TeamPermissionTests(TestCase):
         self.client.login(username='coach', password='pass1234')
         resp_coach = self.client.post(reverse('team_delete', kwargs={'pk': self.team2.pk}))
         self.assertEqual(resp_coach.status_code, 403)
-        self.assertTrue(Team.objects.filter(pk=self.team2.pk).exists())
\ No newline at end of file
+        self.assertTrue(Team.objects.filter(pk=self.team2.pk).exists())
+
+class TeamScheduleTests(TestCase):
+    def setUp(self):
+        """Set up a team with a weekly quota and a logged in coach"""
+        self.pitch = Pitch.objects.create(name='Main Pitch')
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach')
+        self.team = Team.objects.create(age_group='U12', gender='boys', sport='football', coach=self.coach, weekly_hours_quota=6)
+        self.client.login(username='coach', password='pass1234')
+
+    def _book(self, days, status='approved'):
+        start = timezone.now() + timezone.timedelta(days=days)
+        return Booking.objects.create(
+            pitch=self.pitch, name='Coach', team=self.team, status=status,
+            start_time=start, end_time=start + timezone.timedelta(hours=1),
+        )
+
+    def test_detail_lists_upcoming_bookings(self):
+        """Test the team page lists upcoming bookings but not past or rejected ones"""
+        upcoming = self._book(2)
+        past = self._book(-2)
+        rejected = self._book(3, status='rejected')
+        response = self.client.get(reverse('team_detail', args=[self.team.pk]))
+        self.assertEqual(response.context['team'].upcoming_bookings, [upcoming])
+        self.assertNotIn(past, response.context['team'].upcoming_bookings)
+        self.assertNotIn(rejected, response.context['team'].upcoming_bookings)
+        self.assertContains(response, 'of 6')
+
+    def test_detail_queries_do_not_grow_with_bookings(self):
+        """Test the team page costs the same number of queries for one booking or many"""
+        self._book(1)
+        url = reverse('team_detail', args=[self.team.pk])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(url)
+        for days in range(2, 8):
+            self._book(days)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+        self.assertEqual(len(one), len(many))
+
+
+class TeamListCacheTests(TestCase):
+    def setUp(self):
+        """Set up a coached team and a logged in coach"""
+        self.coach = User.objects.create_user(username='coach', password='pass1234', role='coach', first_name='Cora')
+        self.team = Team.objects.create(age_group='U12', gender='boys', sport='football', coach=self.coach)
+        self.client.login(username='coach', password='pass1234')
+
+    def test_repeat_render_skips_team_query(self):
+        """Test a cached team list is served without reading the teams"""
+        self.client.get(reverse('team_list'))
+        with CaptureQueriesContext(connection) as repeat:
+            response = self.client.get(reverse('team_list'))
+        self.assertFalse([q for q in repeat.captured_queries if 'teams_team' in q['sql']])
+        self.assertContains(response, 'Cora')
+
+    def test_team_and_coach_changes_refresh_list(self):
+        """Test saving a team or renaming its coach shows up on the next render"""
+        self.client.get(reverse('team_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Team.objects.create(age_group='U14', gender='girls', sport='hurling', coach=self.coach)
+        self.assertContains(self.client.get(reverse('team_list')), 'data-sport="hurling"')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coach.first_name = 'Nora'
+            self.coach.save()
+        self.assertContains(self.client.get(reverse('team_list')), 'Nora')
@@ -3,6 +3,10 @@ from django.contrib.auth.decorators import login_required
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
+from django.db.models import Prefetch
+from django.utils import timezone
+from bookings.models import Booking
+from bookings.services import team_hours_booked, week_bounds
 from .forms import TeamForm
 from .models import Team
 
@@ -29,12 +33,36 @@ class TeamList(ListView):
     template_name = 'teams/team_list.html'
     context_object_name = 'teams'
 
+    def get_queryset(self):
+        # Lazy, so it only runs when the cached table fragment is missing
+        return Team.objects.select_related('coach')
+
 
 class TeamDetail(LoginRequiredMixin, DetailView):
     model = Team
     template_name = 'teams/team_detail.html'
     context_object_name = 'team'
 
+    def get_queryset(self):
+        # The team's upcoming schedule comes with the team in one prefetch
+        upcoming = (
+            Booking.objects
+            .filter(end_time__gte=timezone.now())
+            .exclude(status='rejected')
+            .select_related('pitch')
+            .only('id', 'team_id', 'start_time', 'end_time', 'status', 'pitch__name')
+            .order_by('start_time', 'id')
+        )
+        return Team.objects.select_related('coach').prefetch_related(
+            Prefetch('bookings', queryset=upcoming, to_attr='upcoming_bookings')
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        booked = team_hours_booked(self.object.pk, *week_bounds(timezone.now()))
+        context['hours_this_week'] = booked.total_seconds() / 3600
+        return context
+
 
 class TeamUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = Team
@@ -9,4 +9,8 @@ class CustomUser(AbstractUser):
         ('chairman', 'Chairman'),
         ('secretary', 'Secretary'),
     ]
-    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
\ No newline at end of file
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+
+    # Denormalised count of unread notifications for the navbar badge, kept
+    # current by alerts.models.adjust_unread_counts and the reconcile_unread_counts command
+    unread_notifications = models.PositiveIntegerField(default=0, editable=False)
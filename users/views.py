@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .forms import UserRegisterForm, UserUpdateForm
 from django.contrib import messages
+from bookings.feeds import feed_links
 
 # Create your views here.
 def register(request):
@@ -31,5 +32,6 @@ def profile(request):
 
   context = {
     'form': form,
+    'calendar_feeds': feed_links(request.user),
   }
   return render(request, 'users/profile.html', context)
\ No newline at end of file